@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+""" Streaming analysis of the SUMO outputs written by most.test.sumocfg.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The output files are read one top-level element at a time (xml2pickle.iterparse_elements)
+    and each measure is aggregated on the fly per mode (count, sum, mean, standard deviation,
+    minimum and maximum): the memory does not depend on the length of the simulation.
+    The mode of a vehicle is the vTypeDistribution of its vType (e.g. passenger, ptw,
+    on-demand, commercial), or the vType itself, as defined in the vType files.
+"""
+
+import argparse
+import collections
+import csv
+import logging
+import math
+import os
+import sys
+import xml.etree.ElementTree
+
+import instrumentation
+import xml2pickle
+
+## Output files of tools/most.test.sumocfg, relative to the output prefix.
+OUTPUTS = collections.OrderedDict([
+    ('tripinfo', 'tripinfo.xml'),
+    ('vehroute', 'vehroute.xml'),
+    ('stop', 'stop.out.xml'),
+    ('lanechange', 'lanechanges.out.xml'),
+    ('summary', 'summary.xml'),
+])
+
+## sumocfg output options of each output file.
+SUMOCFG_OPTIONS = {
+    'tripinfo': 'tripinfo-output',
+    'vehroute': 'vehroute-output',
+    'stop': 'stop-output',
+    'lanechange': 'lanechange-output',
+    'summary': 'summary-output',
+}
+
+CSV_COLUMNS = ['output', 'mode', 'metric', 'count', 'sum', 'mean', 'std', 'min', 'max']
+
+def _logs():
+    """ Log init. """
+    file_handler = logging.FileHandler(filename='{}.log'.format(sys.argv[0]),
+                                       mode='w')
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    handlers = [file_handler, stdout_handler]
+    logging.basicConfig(handlers=handlers, level=logging.DEBUG,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Aggregate per mode the SUMO outputs of a simulation run.')
+    parser.add_argument(
+        '-c', type=str, dest='sumocfg', default=None,
+        help='SUMO configuration of the run: output prefix, output files and vType files '
+             'are read from it.')
+    parser.add_argument(
+        '--prefix', type=str, dest='prefix', default='out/res/most.',
+        help='Output prefix of the run, when the configuration is not given.')
+    parser.add_argument(
+        '--vtypes', type=str, nargs='+', dest='vtypes', default=[],
+        help='Files with the vTypes and vTypeDistributions defining the modes.')
+    parser.add_argument(
+        '-o', type=str, dest='output', default=None,
+        help='Aggregates file [default: <prefix>analysis.csv].')
+    parser.add_argument(
+        '--format', type=str, dest='format', choices=['csv', 'parquet'], default='csv',
+        help='Format of the summary, parquet requires pyarrow.')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+class RunningStats(object):
+    """ Count, sum, mean, standard deviation (Welford), minimum and maximum of a stream. """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+
+    def add(self, value):
+        """ Add a value to the aggregates. """
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def std(self):
+        """ Population standard deviation. """
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+class OutputsAnalyzer(object):
+    """ Aggregates per mode the SUMO outputs, one file at a time. """
+
+    def __init__(self):
+        self._modes = {}
+        self._stats = collections.OrderedDict()
+        ## cumulative counters of the summary, the last value of each
+        self._totals = collections.OrderedDict()
+        self._handlers = {
+            'tripinfo': self._tripinfo,
+            'vehroute': self._vehroute,
+            'stop': self._stop,
+            'lanechange': self._lanechange,
+            'summary': self._summary,
+        }
+
+    def load_vtypes(self, filename):
+        """ Map the vTypes to their distribution, the mode. """
+        for element in xml2pickle.iterparse_elements(filename):
+            if element.tag == 'vTypeDistribution':
+                members = [vtype.get('id') for vtype in element.iter('vType')]
+                members.extend(element.get('vTypes', '').split())
+                for vtype in members:
+                    self._modes[vtype] = element.get('id')
+            elif element.tag == 'vType':
+                self._modes.setdefault(element.get('id'), element.get('id'))
+
+    def mode(self, vtype):
+        """ Mode of the vType. """
+        return self._modes.get(vtype, vtype)
+
+    def _add(self, output, mode, metric, value):
+        """ Aggregate a value, ignoring the missing ones. """
+        if value is None:
+            return
+        key = (output, mode, metric)
+        if key not in self._stats:
+            self._stats[key] = RunningStats()
+        self._stats[key].add(float(value))
+
+    def analyze(self, output, filename):
+        """ Stream the output file through its handler.
+            ret: number of elements processed. """
+        handler = self._handlers[output]
+        elements = 0
+        for element in xml2pickle.iterparse_elements(filename):
+            handler(element)
+            elements += 1
+        return elements
+
+    ## ---------------------------------------------------------------------------------------- ##
+    ##                                      Output handlers                                     ##
+    ## ---------------------------------------------------------------------------------------- ##
+
+    def _tripinfo(self, element):
+        """ Travel time, delay and waiting time of vehicles and persons. """
+        if element.tag == 'tripinfo':
+            mode = self.mode(element.get('vType'))
+            if float(element.get('arrival', -1)) < 0:
+                self._add('tripinfo', mode, 'unfinished', 1)
+                return
+            self._add('tripinfo', mode, 'travelTime', element.get('duration'))
+            self._add('tripinfo', mode, 'timeLoss', element.get('timeLoss'))
+            self._add('tripinfo', mode, 'waitingTime', element.get('waitingTime'))
+            self._add('tripinfo', mode, 'departDelay', element.get('departDelay'))
+            self._add('tripinfo', mode, 'routeLength', element.get('routeLength'))
+        elif element.tag == 'personinfo':
+            mode = 'person'
+            duration = 0.0
+            for stage in element:
+                if stage.get('duration') is None:
+                    continue
+                self._add('tripinfo', '{}.{}'.format(mode, stage.tag), 'travelTime',
+                          stage.get('duration'))
+                self._add('tripinfo', '{}.{}'.format(mode, stage.tag), 'timeLoss',
+                          stage.get('timeLoss'))
+                self._add('tripinfo', '{}.{}'.format(mode, stage.tag), 'waitingTime',
+                          stage.get('waitingTime'))
+                duration += max(0.0, float(stage.get('duration')))
+            self._add('tripinfo', mode, 'travelTime', duration)
+
+    def _vehroute(self, element):
+        """ Route length, number of edges and reroutes of the vehicles. """
+        if element.tag != 'vehicle':
+            return
+        mode = self.mode(element.get('type'))
+        routes = list(element.iter('route'))
+        if not routes:
+            return
+        self._add('vehroute', mode, 'routeLength', element.get('routeLength'))
+        self._add('vehroute', mode, 'edges', len(routes[-1].get('edges', '').split()))
+        self._add('vehroute', mode, 'reroutes', len(routes) - 1)
+
+    def _stop(self, element):
+        """ Dwell time, delay and passengers of the stops. """
+        if element.tag != 'stopinfo':
+            return
+        mode = self.mode(element.get('type'))
+        if element.get('ended') is not None:
+            self._add('stop', mode, 'dwell',
+                      float(element.get('ended')) - float(element.get('started')))
+        if float(element.get('delay', -1)) >= 0:
+            self._add('stop', mode, 'delay', element.get('delay'))
+        self._add('stop', mode, 'loadedPersons', element.get('loadedPersons'))
+        self._add('stop', mode, 'unloadedPersons', element.get('unloadedPersons'))
+
+    def _lanechange(self, element):
+        """ Lane changes by reason. """
+        if element.tag != 'change':
+            return
+        mode = self.mode(element.get('type'))
+        self._add('lanechange', mode, element.get('reason', 'unknown'), element.get('speed'))
+
+    def _summary(self, element):
+        """ Vehicles in the network over the simulation steps. """
+        if element.tag != 'step':
+            return
+        for metric in ['running', 'waiting', 'halting', 'stopped', 'meanWaitingTime',
+                       'meanTravelTime', 'meanSpeed', 'duration']:
+            value = element.get(metric)
+            ## -1 until the first vehicle ends its trip
+            if value is not None and float(value) >= 0:
+                self._add('summary', 'all', metric, value)
+        for metric in ['loaded', 'inserted', 'ended', 'arrived', 'collisions', 'teleports']:
+            if element.get(metric) is not None:
+                self._totals[metric] = float(element.get(metric))
+
+    ## ---------------------------------------------------------------------------------------- ##
+
+    def rows(self):
+        """ Aggregates as list of dicts with the CSV_COLUMNS keys. """
+        rows = []
+        for (output, mode, metric), stats in self._stats.items():
+            rows.append({
+                'output': output, 'mode': mode, 'metric': metric, 'count': stats.count,
+                'sum': stats.total, 'mean': stats.mean, 'std': stats.std(),
+                'min': stats.minimum, 'max': stats.maximum,
+            })
+        for metric, value in self._totals.items():
+            rows.append({
+                'output': 'summary', 'mode': 'all', 'metric': metric, 'count': 1, 'sum': value,
+                'mean': value, 'std': 0.0, 'min': value, 'max': value,
+            })
+        return rows
+
+def _outputs_from_sumocfg(filename):
+    """ Output files and vType files of a SUMO configuration.
+        ret: ({output: file}, [vType files]) with paths relative to the working directory. """
+    folder = os.path.dirname(os.path.abspath(filename))
+    values = {}
+    for element in xml.etree.ElementTree.parse(filename).getroot().iter():
+        if element.get('value') is not None:
+            values[element.tag] = element.get('value')
+    prefix = values.get('output-prefix', '')
+    outputs = collections.OrderedDict()
+    for output, option in SUMOCFG_OPTIONS.items():
+        if option in values:
+            outputs[output] = os.path.join(folder, prefix + values[option])
+    vtypes = [os.path.join(folder, additional)
+              for additional in values.get('additional-files', '').split(',')
+              if additional.endswith('vType.xml')]
+    return outputs, vtypes
+
+def write_csv(rows, filename):
+    """ Save the aggregates to a CSV file. """
+    with open(filename, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def write_parquet(rows, filename):
+    """ Save the aggregates to a Parquet file. """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit('The parquet format requires pyarrow.')
+    table = pyarrow.table({column: [row[column] for row in rows] for column in CSV_COLUMNS})
+    pyarrow.parquet.write_table(table, filename)
+
+def _main():
+    """ Aggregate per mode the SUMO outputs of a simulation run. """
+
+    args = _args()
+    instrumentation.start('analyze.sumo.outputs', args.profile)
+
+    if args.sumocfg:
+        outputs, vtypes = _outputs_from_sumocfg(args.sumocfg)
+        prefix = os.path.commonprefix(list(outputs.values())) if outputs else ''
+    else:
+        outputs = collections.OrderedDict([(output, args.prefix + filename)
+                                           for output, filename in OUTPUTS.items()])
+        vtypes = []
+        prefix = args.prefix
+
+    analyzer = OutputsAnalyzer()
+    for filename in vtypes + args.vtypes:
+        logging.info('Loading the vTypes from %s', filename)
+        analyzer.load_vtypes(filename)
+
+    for output, filename in outputs.items():
+        if not os.path.isfile(filename):
+            logging.warning('%s not found, skipped.', filename)
+            continue
+        logging.info('Analyzing %s', filename)
+        with instrumentation.phase(output) as phase:
+            phase.count = analyzer.analyze(output, filename)
+        logging.info('%d elements in %.1fs.', phase.count, phase.wall)
+
+    summary = args.output or '{}analysis.{}'.format(prefix, args.format)
+    if args.format == 'parquet':
+        write_parquet(analyzer.rows(), summary)
+    else:
+        write_csv(analyzer.rows(), summary)
+    logging.info('Summary saved to %s', summary)
+
+    instrumentation.write_report(args.report or '{}.report.json'.format(summary))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
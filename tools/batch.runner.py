@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+""" Parallel batch of seeded MoST simulations, with a table of the results.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    A run is a SUMO configuration with a seed and, optionally, a time window. Each run has its
+    own folder <output>/<config>.s<seed>[.<begin>-<end>] with a copy of the configuration
+    (run.sumocfg: input paths relative to the folder, seed, output prefix and log in the
+    folder, duration-log.statistics enabled) and the stdout and stderr of the process.
+    The TraCI server options are removed: the runs do not wait for a client.
+
+    The runs are executed by a pool of processes sized to the cores and to the memory
+    available (--memory-per-run), and the results table (CSV) has the exit status, the wall
+    time and peak RSS of each run, and the values printed by duration-log.statistics
+    (e.g. Vehicles.Inserted, Statistics.TimeLoss); the runs longer than --timeout seconds
+    are killed. The binary is $SUMO_HOME/bin/sumo or sumo, any executable accepting
+    -c <config> can be used in its place with --sumo.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree
+
+## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+RESULT_COLUMNS = ['run', 'config', 'seed', 'begin', 'end', 'status', 'exit_code', 'wall_s',
+                  'peak_rss_mb']
+
+## duration-log.statistics: section headers ("Vehicles:", "Statistics (avg of 42):") and
+## values (" Inserted: 12 (Loaded: 13)")
+SECTION_RE = re.compile(r'^(\w[\w ]*?)(?: \(.*\))?:\s*$')
+VALUE_RE = re.compile(r'(\w[\w ]*?): (-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)')
+
+def _logs():
+    """ Log init. """
+    file_handler = logging.FileHandler(filename='{}.log'.format(sys.argv[0]),
+                                       mode='w')
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    handlers = [file_handler, stdout_handler]
+    logging.basicConfig(handlers=handlers, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Run a batch of seeded SUMO simulations in parallel.')
+    parser.add_argument(
+        '-c', type=str, nargs='+', dest='sumocfgs', required=True,
+        help='SUMO configurations (e.g. scenario/most.sumocfg scenario/most.out.sumocfg).')
+    parser.add_argument(
+        '-o', type=str, dest='output', default='batch',
+        help='Output folder, with a sub-folder for each run.')
+    parser.add_argument(
+        '--seeds', type=int, nargs='+', dest='seeds', default=[42],
+        help='Seeds of the runs of each configuration.')
+    parser.add_argument(
+        '--windows', type=str, nargs='+', dest='windows', default=None,
+        help='Time windows as <begin>:<end> [default: the one of the configuration].')
+    parser.add_argument(
+        '--sumo', type=str, dest='sumo', default=sumo_binary(),
+        help='SUMO binary (or any executable accepting -c <config>).')
+    parser.add_argument(
+        '-j', type=int, dest='processes', default=None,
+        help='Number of parallel runs [default: from the cores and the free memory].')
+    parser.add_argument(
+        '--memory-per-run', type=float, dest='memory', default=2048.0,
+        help='Memory [MB] required by each run, to size the pool.')
+    parser.add_argument(
+        '--timeout', type=float, dest='timeout', default=None,
+        help='Wall time [s] after which a run is killed.')
+    parser.add_argument(
+        '--results', type=str, dest='results', default=None,
+        help='CSV file of the results [default: <output>/results.csv].')
+    parser.add_argument(
+        '--dry-run', dest='dry_run', action='store_true',
+        help='Write the configurations of the runs without running them.')
+    return parser.parse_args()
+
+def sumo_binary(name='sumo'):
+    """ SUMO binary (sumo, netconvert, ..) from SUMO_HOME, if declared, otherwise from the
+        PATH. """
+    if 'SUMO_HOME' in os.environ:
+        return os.path.join(os.environ['SUMO_HOME'], 'bin', name)
+    return name
+
+def _available_memory():
+    """ Available memory [MB], None if unknown. """
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def pool_size(memory_per_run, runs):
+    """ Parallel runs allowed by the cores and by the available memory. """
+    size = min(os.cpu_count() or 1, runs)
+    available = _available_memory()
+    if available is not None and memory_per_run > 0:
+        size = min(size, int(available // memory_per_run))
+    return max(size, 1)
+
+Run = collections.namedtuple('Run', ['name', 'sumocfg', 'seed', 'begin', 'end'])
+
+def plan_runs(sumocfgs, seeds, windows=None):
+    """ All the combinations of configurations, seeds and time windows. """
+    runs = []
+    for sumocfg in sumocfgs:
+        config = os.path.splitext(os.path.basename(sumocfg))[0]
+        for window in windows or [None]:
+            begin, end = window if window else (None, None)
+            for seed in seeds:
+                name = '{}.s{}'.format(config, seed)
+                if window:
+                    name += '.{:g}-{:g}'.format(begin, end)
+                runs.append(Run(name, sumocfg, seed, begin, end))
+    return runs
+
+def _option(parent, section, option, value):
+    """ Set the value of an option of the configuration, adding it if necessary, or remove
+        it if the value is None. """
+    group = parent.find(section)
+    if value is None:
+        if group is not None:
+            for element in group.findall(option):
+                group.remove(element)
+        return
+    if group is None:
+        group = xml.etree.ElementTree.SubElement(parent, section)
+    element = group.find(option)
+    if element is None:
+        element = xml.etree.ElementTree.SubElement(group, option)
+    element.set('value', value)
+
+def write_run_config(run, folder, options=None):
+    """ Configuration of the run in its folder, options {(section, option): value} are set
+        last (e.g. the input files of the run, relative to the folder), or removed if the
+        value is None.
+        ret: the configuration file. """
+    source = os.path.dirname(os.path.abspath(run.sumocfg))
+    target = os.path.abspath(folder)
+    tree = xml.etree.ElementTree.parse(run.sumocfg)
+    root = tree.getroot()
+    for element in root.iterfind('input/*'):
+        if element.get('value') is not None:
+            element.set('value', ','.join(
+                [os.path.relpath(os.path.join(source, path), target)
+                 for path in element.get('value').split(',')]))
+    traci = root.find('traci_server')
+    if traci is not None:
+        logging.warning('%s: the TraCI server options are removed from %s.',
+                        run.name, run.sumocfg)
+        root.remove(traci)
+    _option(root, 'random_number', 'seed', str(run.seed))
+    _option(root, 'output', 'output-prefix', 'most.')
+    _option(root, 'report', 'log', 'sumo.log')
+    _option(root, 'report', 'duration-log.statistics', 'true')
+    if run.begin is not None:
+        _option(root, 'time', 'begin', '{:g}'.format(run.begin))
+        _option(root, 'time', 'end', '{:g}'.format(run.end))
+    for (section, option), value in (options or {}).items():
+        _option(root, section, option, value)
+    os.makedirs(folder, exist_ok=True)
+    filename = os.path.join(folder, 'run.sumocfg')
+    tree.write(filename, encoding='UTF-8', xml_declaration=True)
+    return filename
+
+def parse_statistics(text):
+    """ Values printed by duration-log.statistics, as {'<Section>.<Name>': value}. """
+    values = collections.OrderedDict()
+    section = None
+    for line in text.splitlines():
+        match = SECTION_RE.match(line)
+        if match and not line.startswith(' '):
+            section = match.group(1).replace(' ', '')
+            continue
+        if section is None or not line.startswith(' '):
+            continue
+        for name, value in VALUE_RE.findall(line):
+            values['{}.{}'.format(section, name.strip().replace(' ', ''))] = float(value)
+    return values
+
+def execute(run, folder, sumo, timeout=None):
+    """ Run the simulation and collect its results. """
+    sumocfg = os.path.join(folder, 'run.sumocfg')
+    stdout_file = os.path.join(folder, 'stdout.log')
+    with open(stdout_file, 'w') as stdout, \
+            open(os.path.join(folder, 'stderr.log'), 'w') as stderr:
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen([sumo, '-c', sumocfg], stdout=stdout, stderr=stderr,
+                                       cwd=folder)
+        except OSError as error:
+            logging.error('%s: %s', run.name, error)
+            return {'status': 'error', 'exit_code': None, 'wall_s': 0.0}
+        expired = threading.Event()
+        lock = threading.Lock()
+
+        def _kill():
+            """ Kill the simulation at the timeout, if it is not reaped yet. """
+            with lock:
+                if process.returncode is None:
+                    expired.set()
+                    os.kill(process.pid, signal.SIGKILL)
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, _kill)
+            timer.start()
+        ## waitid does not reap the child: its PID cannot be recycled while the timer may
+        ## still signal it, and it is reaped under the lock by wait4, which returns the
+        ## resource usage of this child only
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        with lock:
+            if timer is not None:
+                timer.cancel()
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+        timed_out = expired.is_set() and process.returncode < 0
+
+    result = collections.OrderedDict([
+        ('status', 'timeout' if timed_out else 'ok' if process.returncode == 0 else 'failed'),
+        ('exit_code', process.returncode),
+        ('wall_s', round(wall, 3)),
+        ('peak_rss_mb', round(usage.ru_maxrss / _RSS_UNIT, 3)),
+    ])
+    with open(stdout_file, 'r') as stdout:
+        result.update(parse_statistics(stdout.read()))
+    logging.info('%s: %s in %.1fs.', run.name, result['status'], wall)
+    return result
+
+def run_batch(runs, output, sumo, processes, timeout=None):
+    """ Execute the runs on a pool of processes.
+        ret: list of the results, in the order of the runs. """
+    results = [None] * len(runs)
+    ## the simulations are external processes, threads are enough to wait for them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(execute, run, os.path.join(output, run.name), sumo, timeout): pos
+                   for pos, run in enumerate(runs)}
+        for future in concurrent.futures.as_completed(futures):
+            pos = futures[future]
+            run = runs[pos]
+            result = collections.OrderedDict([
+                ('run', run.name), ('config', run.sumocfg), ('seed', run.seed),
+                ('begin', run.begin), ('end', run.end)])
+            result.update(future.result())
+            results[pos] = result
+    return results
+
+def write_results(results, filename):
+    """ Save the results table to a CSV file, the statistics in order of appearance. """
+    columns = list(RESULT_COLUMNS)
+    for result in results:
+        columns.extend([column for column in result if column not in columns])
+    with open(filename, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+def _window(value):
+    """ Time window from <begin>:<end>. """
+    try:
+        begin, end = [float(time) for time in value.split(':')]
+    except ValueError:
+        sys.exit('Invalid time window {}, use <begin>:<end>.'.format(value))
+    if begin >= end:
+        sys.exit('Empty time window {}.'.format(value))
+    return begin, end
+
+def _main():
+    """ Run a batch of seeded SUMO simulations in parallel. """
+    args = _args()
+
+    windows = [_window(window) for window in args.windows] if args.windows else None
+    runs = plan_runs(args.sumocfgs, args.seeds, windows)
+    names = [run.name for run in runs]
+    if len(set(names)) != len(names):
+        sys.exit('Configurations with the same name: the runs would share their folders.')
+    for run in runs:
+        write_run_config(run, os.path.join(args.output, run.name))
+    logging.info('%d runs configured in %s', len(runs), args.output)
+    if args.dry_run:
+        return
+
+    processes = args.processes or pool_size(args.memory, len(runs))
+    logging.info('Running with %s on %d parallel processes.', args.sumo, processes)
+    start = time.perf_counter()
+    results = run_batch(runs, args.output, args.sumo, processes, args.timeout)
+    results_file = args.results or os.path.join(args.output, 'results.csv')
+    write_results(results, results_file)
+    failed = [result['run'] for result in results if result['status'] != 'ok']
+    logging.info('Done in %.1fs, %d runs failed%s. Results saved to %s',
+                 time.perf_counter() - start, len(failed),
+                 ': {}'.format(' '.join(failed)) if failed else '', results_file)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+""" Shared helpers for the MoST tools benchmarks.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import os
+import random
+import sys
+
+TOOLS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(TOOLS_DIR)
+from toolloader import load_tool # pylint: disable=C0413,W0611
+
+## UTM zone of Monaco, the synthetic networks are placed around the principality.
+NET_OFFSET = (-370000.0, -4840000.0)
+PROJ_PARAMETER = '+proj=utm +zone=32 +ellps=WGS84 +datum=WGS84 +units=m +no_defs'
+
+NET_HEADER_TPL = """<?xml version="1.0" encoding="UTF-8"?>
+
+<net version="1.9" junctionCornerDetail="5" limitTurnSpeed="5.50">
+    <location netOffset="{offx:.2f},{offy:.2f}" convBoundary="0.00,0.00,{width:.2f},{height:.2f}" origBoundary="7.0,43.0,8.0,44.0" projParameter="{proj}"/>""" # pylint: disable=C0301
+
+EDGE_TPL = """
+    <edge id="{eid}" from="{efrom}" to="{eto}" priority="1">{lanes}
+    </edge>"""
+
+LANE_TPL = """
+        <lane id="{eid}_{index}" index="{index}" allow="{allow}" speed="13.89" length="{length:.2f}" shape="{shape}"/>""" # pylint: disable=C0301
+
+CONNECTION_TPL = """
+    <connection from="{efrom}" to="{eto}" fromLane="{lfrom}" toLane="{lto}" dir="s" state="M"/>""" # pylint: disable=C0301
+
+NET_FOOTER_TPL = """
+</net>
+"""
+
+def _jittered_shape(start, end, points, jitter, rng):
+    """ Straight line from start to end with 'points' intermediate jittered vertices. """
+    shape = [start]
+    for pos in range(1, points + 1):
+        frac = pos / (points + 1)
+        shape.append((start[0] + (end[0] - start[0]) * frac + rng.uniform(-jitter, jitter),
+                      start[1] + (end[1] - start[1]) * frac + rng.uniform(-jitter, jitter)))
+    shape.append(end)
+    return shape
+
+def _shape_length(shape):
+    """ Length of a polyline. """
+    length = 0.0
+    for pos in range(1, len(shape)):
+        length += math.hypot(shape[pos][0] - shape[pos-1][0], shape[pos][1] - shape[pos-1][1])
+    return length
+
+def _synthetic_grid(districts, spacing, points, rail_every, seed):
+    """ Edges of the grid network as (edge ID, from, to, [(allow, shape) of each lane]). """
+    rng = random.Random(seed)
+    size = districts * 5
+    edges = []
+    for pos_x in range(size):
+        for pos_y in range(size):
+            start = (pos_x * spacing, pos_y * spacing)
+            if pos_x + 1 < size:
+                end = ((pos_x + 1) * spacing, pos_y * spacing)
+                shape = _jittered_shape(start, end, points, spacing / 50, rng)
+                edges.append(('h{}_{}'.format(pos_x, pos_y), 'n{}_{}'.format(pos_x, pos_y),
+                              'n{}_{}'.format(pos_x + 1, pos_y),
+                              [('pedestrian', shape), ('bus passenger', shape)]))
+            if pos_y + 1 < size:
+                end = (pos_x * spacing, (pos_y + 1) * spacing)
+                shape = _jittered_shape(start, end, points, spacing / 50, rng)
+                allow = 'rail' if pos_x % rail_every == 0 else 'pedestrian'
+                edges.append(('v{}_{}'.format(pos_x, pos_y), 'n{}_{}'.format(pos_x, pos_y),
+                              'n{}_{}'.format(pos_x, pos_y + 1), [(allow, shape)]))
+    return edges
+
+def _grid_connections(districts, allowed):
+    """ Lane connections of the grid network, as (from edge, to edge, from lane, to lane). """
+    size = districts * 5
+    connections = []
+    for pos_x in range(size):
+        for pos_y in range(size):
+            incoming = ['h{}_{}'.format(pos_x - 1, pos_y), 'v{}_{}'.format(pos_x, pos_y - 1)]
+            outgoing = ['h{}_{}'.format(pos_x, pos_y), 'v{}_{}'.format(pos_x, pos_y)]
+            for efrom in [edge for edge in incoming if edge in allowed]:
+                for eto in [edge for edge in outgoing if edge in allowed]:
+                    for lfrom, allow in enumerate(allowed[efrom]):
+                        if allow in allowed[eto]:
+                            connections.append((efrom, eto, lfrom, allowed[eto].index(allow)))
+    return connections
+
+def write_synthetic_net(filename, districts=4, spacing=250.0, points=3, rail_every=5, seed=42):
+    """ Write a SUMO grid network of (districts * 5)^2 junctions.
+
+        Horizontal edges are streets with a sidewalk (lane 0) and a bus lane (lane 1),
+        every 'rail_every' column the vertical edges are railways, the others are
+        pedestrian-only streets. At each junction the lanes of the incoming edges are
+        connected to the lanes of the outgoing edges allowing the same vehicle classes.
+    """
+    width = height = (districts * 5 - 1) * spacing
+    edges = _synthetic_grid(districts, spacing, points, rail_every, seed)
+    allowed = {eid: [allow for allow, _ in lanes] for eid, _, _, lanes in edges}
+    with open(filename, 'w') as outfile:
+        outfile.write(NET_HEADER_TPL.format(offx=NET_OFFSET[0], offy=NET_OFFSET[1],
+                                            width=width, height=height, proj=PROJ_PARAMETER))
+        for eid, efrom, eto, lanes in edges:
+            string_of_lanes = ''
+            for index, (allow, shape) in enumerate(lanes):
+                string_of_lanes += LANE_TPL.format(
+                    eid=eid, index=index, allow=allow, length=_shape_length(shape),
+                    shape=' '.join(['{:.2f},{:.2f}'.format(*p) for p in shape]))
+            outfile.write(EDGE_TPL.format(eid=eid, efrom=efrom, eto=eto, lanes=string_of_lanes))
+        for efrom, eto, lfrom, lto in _grid_connections(districts, allowed):
+            outfile.write(CONNECTION_TPL.format(efrom=efrom, eto=eto, lfrom=lfrom, lto=lto))
+        outfile.write(NET_FOOTER_TPL)
+    return width, height
+
+class _GridLane(object):
+    """ Lane of the stand-in network, as read by netcache.write_cache. """
+
+    def __init__(self, allow, shape):
+        self._allowed = allow.split()
+        ## the shapes are rounded as in the XML of write_synthetic_net
+        self._shape = [(round(x_coord, 2), round(y_coord, 2)) for x_coord, y_coord in shape]
+        self._length = round(_shape_length(shape), 2)
+
+    def getLength(self):
+        """ Length of the lane. """
+        return self._length
+
+    def getShape(self):
+        """ Shape of the lane. """
+        return self._shape
+
+class _GridEdge(object):
+    """ Edge of the stand-in network, as read by netcache.write_cache. """
+
+    def __init__(self, eid, lanes):
+        self._id = eid
+        self._lanes = [_GridLane(allow, shape) for allow, shape in lanes]
+        self._outgoing = {}
+
+    def getID(self):
+        """ Edge ID. """
+        return self._id
+
+    def getLength(self):
+        """ Length of the edge. """
+        return self._lanes[0].getLength()
+
+    def getLanes(self):
+        """ Lanes of the edge. """
+        return self._lanes
+
+    def getOutgoing(self):
+        """ Edges connected downstream. """
+        return self._outgoing
+
+class _GridNet(object):
+    """ Stand-in for the sumolib network of write_synthetic_net, as read by
+        netcache.write_cache. """
+
+    def __init__(self, districts, spacing, points, rail_every, seed):
+        grid = _synthetic_grid(districts, spacing, points, rail_every, seed)
+        self._edges = [_GridEdge(eid, lanes) for eid, _, _, lanes in grid]
+        id2edge = {edge.getID(): edge for edge in self._edges}
+        allowed = {eid: [allow for allow, _ in lanes] for eid, _, _, lanes in grid}
+        for efrom, eto, _, _ in _grid_connections(districts, allowed):
+            id2edge[efrom].getOutgoing().setdefault(id2edge[eto], [])
+        self._location = {
+            'netOffset': '{:.2f},{:.2f}'.format(*NET_OFFSET),
+            'projParameter': PROJ_PARAMETER,
+        }
+
+    def getEdges(self):
+        """ All the edges. """
+        return self._edges
+
+def write_synthetic_net_cache(folder, districts=4, spacing=250.0, points=3, rail_every=5,
+                              seed=42):
+    """ Write the network cache (see netcache.py) of the grid network of write_synthetic_net,
+        without SUMO: netcache.CachedNet(folder) is a stand-in for the sumolib network. """
+    netcache = load_tool('netcache.py')
+    netcache.write_cache(_GridNet(districts, spacing, points, rail_every, seed),
+                         'synthetic-{}-districts'.format(districts), folder)
+    width = height = (districts * 5 - 1) * spacing
+    return width, height
+
+def synthetic_ptstops(net, width, height, number, seed=42, origin=(0.0, 0.0)):
+    """ OSM-like nodes for 'number' bus stops and number/10 train stations,
+        randomly placed in the network boundaries, from origin to origin + (width, height). """
+    rng = random.Random(seed)
+    nodes = []
+    for pos in range(number + number // 10):
+        lon, lat = net.convertXY2LonLat(rng.uniform(origin[0], origin[0] + width),
+                                        rng.uniform(origin[1], origin[1] + height))
+        tag = {'k': 'highway', 'v': 'bus_stop'}
+        if pos >= number:
+            tag = {'k': 'railway', 'v': 'station'}
+        nodes.append({
+            'id': str(pos + 1),
+            'lat': '{:.7f}'.format(lat),
+            'lon': '{:.7f}'.format(lon),
+            'tag': [tag, {'k': 'name', 'v': 'Stop {}'.format(pos + 1)}],
+        })
+    return nodes
+
+def synthetic_osm(nodes, first_id=1, duplicates=0.05, seed=42):
+    """ OSM-like structure, as produced by xml2pickle.py, with 'nodes' nodes,
+        nodes/10 ways of 10 nodes each and ways/10 relations of 10 ways each.
+
+        A fraction of the nodes ('duplicates') shares the coordinates of another node,
+        to exercise the deduplication of the merger.
+    """
+    rng = random.Random(seed)
+    osm = {
+        'bounds': [{'minlat': '43.7', 'minlon': '7.3', 'maxlat': '43.8', 'maxlon': '7.5'}],
+        'node': [],
+        'way': [],
+        'relation': [],
+    }
+    for pos in range(nodes):
+        nid = str(first_id + pos)
+        if osm['node'] and rng.random() < duplicates:
+            twin = osm['node'][rng.randrange(len(osm['node']))]
+            osm['node'].append({'id': nid, 'lat': twin['lat'], 'lon': twin['lon']})
+            continue
+        node = {
+            'id': nid,
+            'lat': '{:.7f}'.format(rng.uniform(43.7, 43.8)),
+            'lon': '{:.7f}'.format(rng.uniform(7.3, 7.5)),
+        }
+        if pos % 20 == 0:
+            node['tag'] = [{'k': 'highway', 'v': 'bus_stop'}, {'k': 'name', 'v': 'Stop ' + nid}]
+        osm['node'].append(node)
+    for pos in range(nodes // 10):
+        osm['way'].append({
+            'id': str(first_id + pos),
+            'nd': [{'ref': str(first_id + pos * 10 + ref)} for ref in range(10)],
+            'tag': [{'k': 'highway', 'v': 'residential'}],
+        })
+    for pos in range(nodes // 100):
+        members = [{'type': 'way', 'ref': str(first_id + pos * 10 + ref), 'role': ''}
+                   for ref in range(10)]
+        members.append({'type': 'node', 'ref': str(first_id + pos * 100), 'role': 'stop'})
+        osm['relation'].append({
+            'id': str(first_id + pos),
+            'member': members,
+            'tag': [{'k': 'type', 'v': 'route'}, {'k': 'route', 'v': 'bus'}],
+        })
+    return osm
+
+def synthetic_buildings(buildings, seed=42):
+    """ OSM-like structure, as produced by xml2pickle.py, with 'buildings' closed ways of 4 to
+        12 nodes each, placed around Monaco. """
+    rng = random.Random(seed)
+    osm = {
+        'bounds': [{'minlat': '43.7', 'minlon': '7.3', 'maxlat': '43.8', 'maxlon': '7.5'}],
+        'node': [],
+        'way': [],
+    }
+    for pos in range(buildings):
+        lat, lon = rng.uniform(43.7, 43.8), rng.uniform(7.3, 7.5)
+        radius = rng.uniform(5e-5, 2e-4)
+        refs = []
+        for angle in sorted([rng.uniform(0, 2 * math.pi) for _ in range(rng.randint(4, 12))]):
+            refs.append(str(len(osm['node']) + 1))
+            osm['node'].append({
+                'id': refs[-1],
+                'lat': '{:.7f}'.format(lat + radius * math.sin(angle)),
+                'lon': '{:.7f}'.format(lon + radius * math.cos(angle)),
+                'tag': [],
+            })
+        osm['way'].append({
+            'id': str(pos + 1),
+            'nd': [{'ref': ref} for ref in refs + refs[:1]],
+            'tag': [{'k': 'building', 'v': 'yes'}],
+        })
+    return osm
+
+def write_osm_xml(osm, filename):
+    """ Write an OSM-like structure, as produced by xml2pickle.py, to an OSM-like XML file. """
+    osmwriter = load_tool('osmwriter.py')
+    with osmwriter.OSMWriter(filename, attributes=' version="1"') as writer:
+        writer.write_header(osm['bounds'][0])
+        writer.write_nodes((node['id'], node['lat'], node['lon'], node.get('ele', '0.0'),
+                            node.get('tag', [])) for node in osm['node'])
+        writer.write_ways((way['id'], [nd['ref'] for nd in way['nd']], way.get('tag', []))
+                          for way in osm.get('way', []))
+        writer.write_relations(
+            (rel['id'], [(member['type'], member['ref'], member['role'])
+                         for member in rel['member']], rel.get('tag', []))
+            for rel in osm.get('relation', []))
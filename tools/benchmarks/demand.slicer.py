@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+""" Benchmark the slicing and scaling of the demand.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import load_tool
+
+SLICER = load_tool('demand.slicer.py')
+ROUTESTORE = load_tool('routestore.py')
+
+VEHICLE_TPL = """
+    <vehicle id="v{pos}" type="commercial" depart="{depart}" departLane="best" arrivalPos="random">
+        <route edges="{edges}"/>
+    </vehicle>""" # pylint: disable=C0301
+
+FLOW_TPL = """
+    <flow id="f{pos}" from="e{origin}" to="e{destination}" type="highway" begin="14400.0" end="50400.0" period="{period}"/>""" # pylint: disable=C0301
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Measure throughput and memory of the demand slicer.')
+    parser.add_argument(
+        '--vehicles', type=int, nargs='+', dest='vehicles', default=[20000, 200000],
+        help='Number of synthetic vehicles of each run.')
+    parser.add_argument(
+        '--scale', type=float, dest='scale', default=0.25,
+        help='Demand scale.')
+    return parser.parse_args()
+
+def _write_routes(filename, vehicles, seed=42):
+    """ Synthetic route file of vehicles departing between 14400 and 50400, and flows. """
+    rng = random.Random(seed)
+    with open(filename, 'w') as outfile:
+        outfile.write(ROUTESTORE.HEADER)
+        for pos in range(vehicles):
+            outfile.write(VEHICLE_TPL.format(
+                pos=pos, depart=14400 + pos * 36000 // vehicles,
+                edges=' '.join(['e{}'.format(rng.randrange(10000)) for _ in range(60)])))
+            if pos % 100 == 0:
+                outfile.write(FLOW_TPL.format(pos=pos, origin=rng.randrange(10000),
+                                              destination=rng.randrange(10000),
+                                              period=rng.randint(10, 900)))
+        outfile.write(ROUTESTORE.FOOTER)
+
+def _main():
+    """ Measure throughput and memory of the demand slicer. """
+    args = _args()
+
+    for vehicles in args.vehicles:
+        with tempfile.TemporaryDirectory() as folder:
+            route_file = os.path.join(folder, 'routes.rou.xml')
+            _write_routes(route_file, vehicles)
+            size = os.path.getsize(route_file) / 1e6
+            output = os.path.join(folder, 'slice.rou.xml')
+            ## the morning peak
+            slicer = SLICER.DemandSlicer(28800, 30000, args.scale)
+
+            start = time.perf_counter()
+            counts = slicer.slice_file(route_file, output)
+            elapsed = time.perf_counter() - start
+            ## memory measured in a second run, tracemalloc slows down the parsing
+            tracemalloc.start()
+            slicer.slice_file(route_file, output)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            print('{:7d} vehicles | {:8.1f} MB | {:6d} vehicles and {:4d} flows written | '
+                  '{:7.2f}s | {:6.1f} MB/s | peak memory {:6.2f} MB'.format(
+                      vehicles, size, counts['vehicle'][1], counts['flow'][1], elapsed,
+                      size / elapsed, peak))
+
+            expected = vehicles * 1200 / 36000 * args.scale
+            if abs(counts['vehicle'][1] - expected) > 5 * expected ** 0.5 + 1:
+                sys.exit('{} vehicles written, {:.0f} expected.'.format(
+                    counts['vehicle'][1], expected))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
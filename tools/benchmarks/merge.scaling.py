@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+""" Benchmark the scaling of merge.osm.pickles.py with the number of nodes.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from common import load_tool, synthetic_osm
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Check that merging OSM-like pickles scales linearly with the nodes.')
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', dest='sizes', default=[10000, 100000, 1000000],
+        help='Number of nodes of each run.')
+    parser.add_argument(
+        '--files', type=int, dest='files', default=2,
+        help='Number of pickles the nodes are split into.')
+    parser.add_argument(
+        '--processes', type=int, dest='processes', default=1,
+        help='Number of processes used by the merger to load the pickles.')
+    parser.add_argument(
+        '--tolerance', type=float, dest='tolerance', default=2.5,
+        help='Maximum ratio between the time per node of the largest and the smallest run.')
+    return parser.parse_args()
+
+def _write_pickles(folder, nodes, files):
+    """ Split 'nodes' synthetic nodes in 'files' OSM-like pickles. """
+    per_file = nodes // files
+    for pos in range(files):
+        osm = synthetic_osm(per_file, first_id=pos * per_file + 1, seed=pos)
+        with open(os.path.join(folder, 'synthetic.{}.pkl'.format(pos)), 'wb') as dump:
+            pickle.dump(osm, dump, pickle.HIGHEST_PROTOCOL)
+
+def _main():
+    """ Check that merging OSM-like pickles scales linearly with the nodes. """
+    args = _args()
+
+    ## the same merger for all the runs, each merge starts from an empty state
+    merger = load_tool(os.path.join('merger', 'merge.osm.pickles.py')).MergeOSMFiles()
+    results = []
+    for nodes in sorted(args.sizes):
+        with tempfile.TemporaryDirectory() as folder:
+            _write_pickles(folder, nodes, args.files)
+            start = time.perf_counter()
+            merger.merge(folder, args.processes)
+            elapsed = time.perf_counter() - start
+        results.append((nodes, elapsed))
+        print('nodes: {:9d} | merge {:8.3f}s | {:8.3f} us/node'.format(
+            nodes, elapsed, elapsed / nodes * 1e6))
+
+    smallest = results[0][1] / results[0][0]
+    largest = results[-1][1] / results[-1][0]
+    ratio = largest / smallest
+    print('Time per node, largest vs smallest run: {:.2f}x (tolerance {:.2f}x)'.format(
+        ratio, args.tolerance))
+    if ratio > args.tolerance:
+        sys.exit('The merge does not scale linearly with the number of nodes.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+""" Benchmark the write throughput of the OSM-like files produced by the merger.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import filecmp
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from common import load_tool, synthetic_osm
+
+osmwriter = load_tool('osmwriter.py')
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Measure the write throughput (MB/s) of the merged OSM-like file.')
+    parser.add_argument(
+        '--nodes', type=int, dest='nodes', default=500000,
+        help='Number of synthetic nodes to merge and write.')
+    return parser.parse_args()
+
+def _legacy_write(merger, filename):
+    """ Reference writer, as it was in the merger: string concatenation per element,
+        one write per element and lossy escaping of the tag values. """
+    attributes = ' version="1" timestamp="2018-01-01T12:00:00Z"'
+    with open(filename, 'w', encoding='utf-8') as outfile:
+        outfile.write(osmwriter.HEADER_TPL.format(**merger._boundaries))
+        for _, node in merger._all_nodes.items():
+            text = osmwriter.NODE_OPEN_TPL.format(
+                id=node['new_id'], lat=node['lat'], lon=node['lon'], ele=node['ele'],
+                attributes=attributes)
+            for tag in node['tags']:
+                text += osmwriter.TAG_TPL.format(
+                    k_val=tag['k'], v_val=tag['v'].replace('"', '').replace('&', 'and'))
+            outfile.write(text + osmwriter.NODE_CLOSE)
+        for wid, way in merger._all_ways.items():
+            text = osmwriter.WAY_OPEN_TPL.format(id=wid, attributes=attributes)
+            for ref in way['nds']:
+                text += osmwriter.ND_TPL.format(ref=ref)
+            text += ' '
+            for tag in way['tags']:
+                text += osmwriter.TAG_TPL.format(
+                    k_val=tag['k'], v_val=tag['v'].replace('"', '').replace('&', 'and'))
+            outfile.write(text + osmwriter.WAY_CLOSE)
+        for rid, rel in merger._all_relations.items():
+            text = osmwriter.REL_OPEN_TPL.format(id=rid, attributes=attributes)
+            for mtype, ref, role in rel['members']:
+                text += osmwriter.MEMB_TPL.format(mtype=mtype, ref=ref, role=role)
+            text += ' '
+            for tag in rel['tags']:
+                text += osmwriter.TAG_TPL.format(
+                    k_val=tag['k'], v_val=tag['v'].replace('"', '').replace('&', 'and'))
+            outfile.write(text + osmwriter.REL_CLOSE)
+        outfile.write(osmwriter.FOOTER_TPL)
+
+def _timed(function, *args, repeat=3):
+    """ Run the function repeat times and return the best elapsed time: the first run also
+        pays the growth of the process memory, whichever writer runs first. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _main():
+    """ Measure the write throughput (MB/s) of the merged OSM-like file. """
+    args = _args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        inputs = os.path.join(folder, 'inputs')
+        os.makedirs(inputs)
+        with open(os.path.join(inputs, 'synthetic.pkl'), 'wb') as dump:
+            pickle.dump(synthetic_osm(args.nodes), dump, pickle.HIGHEST_PROTOCOL)
+        merger = load_tool(os.path.join('merger', 'merge.osm.pickles.py')).MergeOSMFiles(inputs)
+
+        legacy = os.path.join(folder, 'legacy.osm')
+        plain = os.path.join(folder, 'merged.osm')
+        compressed = os.path.join(folder, 'merged.osm.gz')
+        runs = [
+            ('legacy', legacy, _timed(_legacy_write, merger, legacy)),
+            ('buffered', plain, _timed(merger.write_osm_file, plain)),
+            ('buffered gzip', compressed, _timed(merger.write_osm_file, compressed)),
+        ]
+        ## throughput is measured on the uncompressed XML size
+        size = os.path.getsize(plain) / 1e6
+        for name, filename, elapsed in runs:
+            print('{:14s} | {:8.3f}s | {:8.1f} MB/s | {:8.1f} MB on disk'.format(
+                name, elapsed, size / elapsed, os.path.getsize(filename) / 1e6))
+
+        if not filecmp.cmp(legacy, plain, shallow=False):
+            sys.exit('The buffered writer output differs from the reference one.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+""" Benchmark the streaming analysis of the SUMO outputs.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import TOOLS_DIR, load_tool
+
+ANALYZER = load_tool('analyze.sumo.outputs.py')
+XML2PICKLE = load_tool('xml2pickle.py')
+
+VTYPES = os.path.join(TOOLS_DIR, '..', 'scenario', 'in', 'add', 'basic.vType.xml')
+
+TRIPINFO_TPL = """
+    <tripinfo id="{id}" depart="{depart:.2f}" departLane="e_0" departPos="0.00" departSpeed="0.00" departDelay="{delay:.2f}" arrival="{arrival:.2f}" arrivalLane="f_0" arrivalPos="10.00" arrivalSpeed="5.00" duration="{duration:.2f}" routeLength="{length:.2f}" waitingTime="{waiting:.2f}" waitingCount="1" stopTime="0.00" timeLoss="{loss:.2f}" rerouteNo="0" devices="tripinfo_{id}" vType="{vtype}" speedFactor="1.00" vaporized=""/>""" # pylint: disable=C0301
+
+PERSONINFO_TPL = """
+    <personinfo id="{id}" depart="{depart:.2f}" type="avgpedestrian" speedFactor="1.00">
+        <walk depart="{depart:.2f}" departPos="0.00" arrival="{arrival:.2f}" arrivalPos="5.00" duration="{duration:.2f}" routeLength="{length:.2f}" timeLoss="{loss:.2f}" maxSpeed="1.50"/>
+        <ride waitingTime="{waiting:.2f}" vehicle="bus_0" depart="{arrival:.2f}" arrival="{end:.2f}" arrivalPos="10.00" duration="{ride:.2f}" routeLength="{length:.2f}"/>
+    </personinfo>""" # pylint: disable=C0301
+
+VEHROUTE_TPL = """
+    <vehicle id="{id}" type="{vtype}" depart="{depart:.2f}" arrival="{arrival:.2f}" routeLength="{length:.2f}">
+        <routeDistribution>
+            <route replacedOnEdge="a" reason="device.rerouting" replacedAtTime="{depart:.2f}" probability="0" edges="{edges}"/>
+            <route edges="{edges} x"/>
+        </routeDistribution>
+    </vehicle>""" # pylint: disable=C0301
+
+STOPINFO_TPL = """
+    <stopinfo id="{id}" type="bus" lane="e_1" pos="10.00" parking="0" started="{depart:.2f}" ended="{arrival:.2f}" delay="{delay:.2f}" initialPersons="0" loadedPersons="3" unloadedPersons="2" busStop="s1"/>""" # pylint: disable=C0301
+
+CHANGE_TPL = """
+    <change id="{id}" type="{vtype}" time="{depart:.2f}" from="e_0" to="e_1" dir="1" speed="{speed:.2f}" pos="5.00" reason="{reason}" leaderGap="None" leaderSecureGap="None" followerGap="None" followerSecureGap="None" origLeaderGap="None" origLeaderSecureGap="None" latGap="None"/>""" # pylint: disable=C0301
+
+STEP_TPL = """
+    <step time="{time:.2f}" loaded="{loaded}" inserted="{loaded}" running="{running}" waiting="0" ended="{ended}" arrived="{ended}" collisions="0" teleports="0" halting="{halting}" stopped="0" meanWaitingTime="1.00" meanTravelTime="{travel:.2f}" meanSpeed="{speed:.2f}" meanSpeedRelative="0.50" duration="2"/>""" # pylint: disable=C0301
+
+MODES = ['passenger1', 'passenger2a', 'motorcycle', 'moped', 'taxi', 'uber', 'bus', 'delivery']
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Measure throughput and memory of the streaming analysis of SUMO outputs.')
+    parser.add_argument(
+        '--trips', type=int, nargs='+', dest='trips', default=[20000, 200000],
+        help='Number of synthetic trips of each run.')
+    return parser.parse_args()
+
+def _write_outputs(prefix, trips, seed=42):
+    """ Synthetic tripinfo, vehroute, stop, lane change and summary outputs. """
+    rng = random.Random(seed)
+    files = {output: open(prefix + filename, 'w')
+             for output, filename in ANALYZER.OUTPUTS.items()}
+    roots = {'tripinfo': 'tripinfos', 'vehroute': 'routes', 'stop': 'stops',
+             'lanechange': 'lanechanges', 'summary': 'summary'}
+    for output, outfile in files.items():
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n<{}>'.format(roots[output]))
+    for pos in range(trips):
+        depart = rng.uniform(0, 86400)
+        duration = rng.uniform(60, 1800)
+        values = {
+            'id': 'v{}'.format(pos), 'vtype': rng.choice(MODES), 'depart': depart,
+            'arrival': depart + duration if pos % 50 else -1, 'duration': duration,
+            'delay': rng.uniform(0, 10), 'length': rng.uniform(500, 10000),
+            'waiting': rng.uniform(0, 60), 'loss': rng.uniform(0, 300),
+            'speed': rng.uniform(0, 14), 'reason': rng.choice(['speedGain', 'strategic']),
+            'end': depart + 2 * duration, 'ride': duration,
+            'edges': ' '.join(['e{}'.format(rng.randrange(1000)) for _ in range(20)]),
+        }
+        files['tripinfo'].write(TRIPINFO_TPL.format(**values))
+        if pos % 10 == 0:
+            files['tripinfo'].write(PERSONINFO_TPL.format(**values))
+            files['stop'].write(STOPINFO_TPL.format(**values))
+        files['vehroute'].write(VEHROUTE_TPL.format(**values))
+        files['lanechange'].write(CHANGE_TPL.format(**values))
+        files['summary'].write(STEP_TPL.format(
+            time=pos * 0.5, loaded=pos + 1, running=rng.randrange(100), ended=pos // 2,
+            halting=rng.randrange(10), travel=rng.uniform(0, 100), speed=rng.uniform(0, 14)))
+    for output, outfile in files.items():
+        outfile.write('\n</{}>\n'.format(roots[output]))
+        outfile.close()
+
+def _analyze(prefix):
+    """ Analyze all the outputs.
+        ret: the analyzer and the number of elements. """
+    analyzer = ANALYZER.OutputsAnalyzer()
+    analyzer.load_vtypes(VTYPES)
+    elements = sum([analyzer.analyze(output, prefix + filename)
+                    for output, filename in ANALYZER.OUTPUTS.items()])
+    return analyzer, elements
+
+def _reference(prefix, modes):
+    """ Mean travel time and time loss per mode from the whole tripinfo tree in memory. """
+    tree = XML2PICKLE._parse_xml_file(prefix + 'tripinfo.xml') # pylint: disable=W0212
+    values = {}
+    for trip in tree['tripinfo']:
+        if float(trip['arrival']) < 0:
+            continue
+        mode = modes.get(trip['vType'], trip['vType'])
+        values.setdefault(mode, []).append((float(trip['duration']), float(trip['timeLoss'])))
+    return {mode: (sum([value[0] for value in trips]) / len(trips),
+                   sum([value[1] for value in trips]) / len(trips))
+            for mode, trips in values.items()}
+
+def _main():
+    """ Measure throughput and memory of the streaming analysis of SUMO outputs. """
+    args = _args()
+
+    for trips in args.trips:
+        with tempfile.TemporaryDirectory() as folder:
+            prefix = os.path.join(folder, 'most.')
+            _write_outputs(prefix, trips)
+            size = sum([os.path.getsize(prefix + filename)
+                        for filename in ANALYZER.OUTPUTS.values()]) / 1e6
+
+            start = time.perf_counter()
+            analyzer, elements = _analyze(prefix)
+            elapsed = time.perf_counter() - start
+            ## memory measured in a second run, tracemalloc slows down the parsing
+            tracemalloc.start()
+            _analyze(prefix)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            print('{:7d} trips | {:8.1f} MB | {:8d} elements | {:7.2f}s | {:6.1f} MB/s | '
+                  'peak memory {:6.2f} MB'.format(trips, size, elements, elapsed,
+                                                  size / elapsed, peak))
+
+            rows = {(row['output'], row['mode'], row['metric']): row for row in analyzer.rows()}
+            for mode, (travel, loss) in _reference(prefix, analyzer._modes).items(): # pylint: disable=W0212
+                if not (math.isclose(rows[('tripinfo', mode, 'travelTime')]['mean'], travel)
+                        and math.isclose(rows[('tripinfo', mode, 'timeLoss')]['mean'], loss)):
+                    sys.exit('The streaming aggregates of {} differ from the reference.'.format(
+                        mode))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
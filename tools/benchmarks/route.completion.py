@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+""" Benchmark the completion of the routes of the public transport lines.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import load_tool, write_synthetic_net
+
+PT = load_tool('pt.osm2sumo.py')
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Compare the memoized route completion with the uncached shortest paths.')
+    parser.add_argument(
+        '--districts', type=int, dest='districts', default=4,
+        help='Size of the synthetic network.')
+    parser.add_argument(
+        '--lines', type=int, dest='lines', default=500,
+        help='Number of synthetic bus lines.')
+    parser.add_argument(
+        '--stops', type=int, dest='stops', default=8,
+        help='Number of stops of each line.')
+    parser.add_argument(
+        '--seed', type=int, dest='seed', default=42,
+        help='Seed of the synthetic lines.')
+    return parser.parse_args()
+
+def _synthetic_lines(size, lines, stops, seed):
+    """ Edges of the stops of bus lines running along the rows of the grid, from west to east.
+
+        The stops of each row are drawn from a small pool, so that the lines share most of
+        their pairs of consecutive stops, as in a real network.
+    """
+    rng = random.Random(seed)
+    pools = {pos_y: rng.sample(range(size - 1), min(size - 1, stops * 2))
+             for pos_y in range(size)}
+    synthetic = []
+    for _ in range(lines):
+        pos_y = rng.randrange(size)
+        columns = sorted(rng.sample(pools[pos_y], min(len(pools[pos_y]), stops)))
+        synthetic.append(['h{}_{}'.format(pos_x, pos_y) for pos_x in columns])
+    return synthetic
+
+def uncached(router, lines):
+    """ Complete the routes computing the shortest paths of every line. """
+    ## a new dictionary for every line disables the memoization across the lines
+    routes = []
+    for stop_edges in lines:
+        router._paths = {} # pylint: disable=W0212
+        routes.append(PT.PublicTransportsGenerator._complete_route( # pylint: disable=W0212
+            None, router, stop_edges))
+    return routes
+
+def memoized(router, lines):
+    """ Complete the routes with the memoized shortest paths. """
+    router._paths = {} # pylint: disable=W0212
+    complete_route = PT.PublicTransportsGenerator._complete_route # pylint: disable=W0212
+    return [complete_route(None, router, stop_edges) for stop_edges in lines]
+
+def _check(net, lines, routes):
+    """ Compare the routes with the sumolib shortest paths between the same stops.
+        ret: number of routes that differ from the reference ones.
+    """
+    errors = 0
+    for stop_edges, route in zip(lines, routes):
+        reference = [stop_edges[0]]
+        for from_edge, to_edge in zip(stop_edges, stop_edges[1:]):
+            if from_edge == to_edge:
+                continue
+            path, _ = net.getShortestPath(net.getEdge(from_edge), net.getEdge(to_edge),
+                                          vClass='bus')
+            reference.extend([edge.getID() for edge in path[1:]])
+        if reference != route:
+            errors += 1
+    return errors
+
+def _main():
+    """ Compare the memoized route completion with the uncached shortest paths. """
+    if PT.sumolib is None:
+        sys.exit("Please declare environment variable 'SUMO_TOOLS'")
+    args = _args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        netfile = os.path.join(tmpdir, 'net.xml')
+        write_synthetic_net(netfile, districts=args.districts)
+        net = PT.sumolib.net.readNet(netfile)
+
+    lines = _synthetic_lines(args.districts * 5, args.lines, args.stops, args.seed)
+    router = PT.EdgeRouter(net.getEdges(), PT.PT_VCLASSES['bus'])
+
+    results = {}
+    timings = {}
+    for name, function in (('uncached', uncached), ('memoized', memoized)):
+        start = time.perf_counter()
+        results[name] = function(router, lines)
+        timings[name] = time.perf_counter() - start
+        print('{:10s} | {:6d} lines | {:8.3f}s | {:8.0f} lines/s'.format(
+            name, len(lines), timings[name], len(lines) / timings[name]))
+    print('Speedup: {:.1f}x'.format(timings['uncached'] / timings['memoized']))
+
+    if results['uncached'] != results['memoized']:
+        sys.exit('The memoized routes differ from the uncached ones.')
+    errors = _check(net, lines, results['memoized'])
+    if errors:
+        sys.exit('{} routes differ from the sumolib shortest paths.'.format(errors))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
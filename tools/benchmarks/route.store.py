@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+""" Benchmark the filtering of a demand with the columnar route store.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree
+
+from common import load_tool
+
+ROUTESTORE = load_tool('routestore.py')
+
+VEHICLE_TPL = """
+    <vehicle id="commercial_{pos}" type="commercial" depart="{depart}" departLane="best" arrivalPos="random">
+        <route edges="{edges}"/>{stop}
+    </vehicle>""" # pylint: disable=C0301
+
+STOP_TPL = """
+        <stop parkingArea="p{parking}" until="{until}"/>"""
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Compare the filtering of a demand rewriting the XML and with the store.')
+    parser.add_argument(
+        '--vehicles', type=int, nargs='+', dest='vehicles', default=[10000, 100000],
+        help='Number of synthetic vehicles of each run.')
+    parser.add_argument(
+        '--edges', type=int, dest='edges', default=20000,
+        help='Number of distinct edges of the synthetic network.')
+    parser.add_argument(
+        '--length', type=int, dest='length', default=80,
+        help='Average number of edges of a route.')
+    return parser.parse_args()
+
+def _write_routes(filename, vehicles, edges, length, seed=42):
+    """ Synthetic route file, with the departures in increasing order. """
+    rng = random.Random(seed)
+    names = ['{}{}#{}'.format(rng.choice(['', '-']), 150000 + pos, rng.randrange(5))
+             for pos in range(edges)]
+    with open(filename, 'w') as outfile:
+        outfile.write(ROUTESTORE.HEADER)
+        for pos in range(vehicles):
+            start = rng.randrange(edges)
+            route = [names[(start + step) % edges]
+                     for step in range(rng.randint(length // 2, length * 3 // 2))]
+            outfile.write(VEHICLE_TPL.format(
+                pos=pos, depart=14400 + pos * 36000 // vehicles, edges=' '.join(route),
+                stop=STOP_TPL.format(parking=rng.randrange(100), until=50400)
+                if pos % 50 == 0 else ''))
+        outfile.write(ROUTESTORE.FOOTER)
+    return names
+
+def xml_filter(route_file, output, begin, end, from_edges):
+    """ Filter the demand parsing and rewriting the XML. """
+    tree = xml.etree.ElementTree.parse(route_file)
+    root = tree.getroot()
+    for vehicle in list(root):
+        depart = float(vehicle.attrib['depart'])
+        origin = vehicle.find('route').attrib['edges'].split(' ', 1)[0]
+        if not begin <= depart < end or origin not in from_edges:
+            root.remove(vehicle)
+    tree.write(output, encoding='UTF-8', xml_declaration=True)
+    return len(root)
+
+def store_filter(folder, output, begin, end, from_edges):
+    """ Filter the demand with the array selection of the store. """
+    store = ROUTESTORE.RouteStore(folder)
+    selection = store.select(begin=begin, end=end, from_edges=from_edges)
+    return store.write_routes(output, selection)
+
+def _main():
+    """ Compare the filtering of a demand rewriting the XML and with the store. """
+    args = _args()
+
+    for vehicles in args.vehicles:
+        with tempfile.TemporaryDirectory() as folder:
+            route_file = os.path.join(folder, 'routes.rou.xml')
+            names = _write_routes(route_file, vehicles, args.edges, args.length)
+            size = os.path.getsize(route_file) / 1e6
+
+            start = time.perf_counter()
+            ROUTESTORE.write_store(route_file, os.path.join(folder, 'store'))
+            convert = time.perf_counter() - start
+            store_size = sum([os.path.getsize(os.path.join(folder, 'store', filename))
+                              for filename in os.listdir(os.path.join(folder, 'store'))]) / 1e6
+            print('{:7d} vehicles | XML {:7.1f} MB | store {:7.1f} MB | converted in {:6.2f}s'
+                  .format(vehicles, size, store_size, convert))
+
+            ## one hour of departures from a tenth of the edges
+            from_edges = set(names[::10])
+            results = {}
+            for name, function, source in (('xml', xml_filter, route_file),
+                                           ('store', store_filter,
+                                            os.path.join(folder, 'store'))):
+                output = os.path.join(folder, '{}.rou.xml'.format(name))
+                start = time.perf_counter()
+                count = function(source, output, 28800, 32400, from_edges)
+                elapsed = time.perf_counter() - start
+                results[name] = (count, elapsed, output)
+                print('{:7d} vehicles | {:6s} filter | {:6d} selected | {:7.3f}s'.format(
+                    vehicles, name, count, elapsed))
+            print('Speedup: {:.1f}x'.format(results['xml'][1] / results['store'][1]))
+
+            def _vehicles(filename):
+                """ Vehicles of a route file, as comparable tuples. """
+                return [(vehicle.attrib, [(child.tag, child.attrib) for child in vehicle])
+                        for vehicle in xml.etree.ElementTree.parse(filename).getroot()]
+            if _vehicles(results['xml'][2]) != _vehicles(results['store'][2]):
+                sys.exit('The vehicles selected by the store differ from the XML filter.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+""" Benchmark the stop-to-lane snapping of pt.osm2sumo.py against a linear scan.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+
+from common import load_tool, write_synthetic_net, synthetic_ptstops
+
+PT = load_tool('pt.osm2sumo.py')
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Compare the indexed stop snapping with the brute-force one.')
+    parser.add_argument(
+        '--osm', type=str, dest='osmstruct', default=None,
+        help='Pickle-OSM object (default: synthetic stops).')
+    parser.add_argument(
+        '--net', type=str, dest='netstruct', default=None,
+        help='SUMO network (default: synthetic grid network).')
+    parser.add_argument(
+        '--districts', type=int, dest='districts', default=4,
+        help='Size of the synthetic network.')
+    parser.add_argument(
+        '--stops', type=int, dest='stops', default=500,
+        help='Number of synthetic bus stops.')
+    return parser.parse_args()
+
+## ---------------------------------------------------------------------------------------- ##
+##                  Reference implementation: linear scan over all the edges                ##
+## ---------------------------------------------------------------------------------------- ##
+
+def _closest_point(coord, lane, lane_info, dist_edge, offset):
+    """ Linear scan over the shape segments of a lane. """
+    shape = lane.getShape()
+    length = 0.0
+    for pos in range(1, len(shape)):
+        (start_x, start_y), (end_x, end_y) = shape[pos-1], shape[pos]
+        delta_x, delta_y = end_x - start_x, end_y - start_y
+        sq_length = delta_x * delta_x + delta_y * delta_y
+        rel_x, rel_y = coord[0] - start_x, coord[1] - start_y
+        fraction = 0.0
+        if sq_length > 0:
+            fraction = min(max((rel_x * delta_x + rel_y * delta_y) / sq_length, 0.0), 1.0)
+        dist = math.sqrt((rel_x - fraction * delta_x) ** 2 + (rel_y - fraction * delta_y) ** 2)
+        if dist < dist_edge:
+            lane_info = lane
+            dist_edge = dist
+            offset = length + fraction * math.sqrt(sq_length)
+        length += math.sqrt(sq_length)
+    return lane_info, dist_edge, offset
+
+def brute_force_bus(net, coord):
+    """ Closest bus lane, as computed before the spatial index. """
+    lane_info, dist_edge, offset = None, sys.float_info.max, None
+    for edge in net.getEdges():
+        if not (edge.allows('bus') and edge.allows('pedestrian')):
+            continue
+        if edge.getLength() < (PT.BUS_PLATFORM_LEN * 1.5):
+            continue
+        try:
+            stop_lane = edge.getLane(1)
+        except IndexError:
+            stop_lane = edge.getLane(0)
+        lane_info, dist_edge, offset = _closest_point(
+            coord, stop_lane, lane_info, dist_edge, offset)
+    return (lane_info, offset)
+
+def brute_force_train(net, coord):
+    """ Closest railway and street lanes, as computed before the spatial index. """
+    railway = [None, sys.float_info.max, None]
+    street = [None, sys.float_info.max, None]
+    for edge in net.getEdges():
+        if edge.allows('rail'):
+            if edge.getLength() < (PT.TRAIN_PLATFORM_LEN * 1.5):
+                continue
+            railway = _closest_point(coord, edge.getLane(0), *railway)
+        elif edge.allows('pedestrian'):
+            street = _closest_point(coord, edge.getLane(0), *street)
+    street_access = (street[0], street[2])
+    if street[1] > 500.0:
+        street_access = None
+    return ((railway[0], railway[2]), street_access)
+
+## ---------------------------------------------------------------------------------------- ##
+
+def _same_access(expected, computed):
+    """ Compare two (lane, offset) tuples. """
+    if expected is None or computed is None:
+        return expected is computed
+    if expected[0] is None or computed[0] is None:
+        return expected[0] is computed[0]
+    return (expected[0].getID() == computed[0].getID() and
+            math.isclose(expected[1], computed[1], abs_tol=1e-6))
+
+def _stops_coords(stops, coords):
+    """ List of (id, (x, y)) from the stops dict and the projected coordinates arrays. """
+    return list(zip(stops, zip(coords[0].tolist(), coords[1].tolist())))
+
+def _compare(name, stops, reference, indexed):
+    """ Time both the snapping functions on the (id, coord) stops and count the differences. """
+    start = time.perf_counter()
+    expected = {sid: reference(coord) for sid, coord in stops}
+    brute_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    computed = {sid: indexed(sid, coord) for sid, coord in stops}
+    index_time = time.perf_counter() - start
+
+    mismatches = 0
+    for sid, value in expected.items():
+        if name == 'bus':
+            same = _same_access(value, computed[sid])
+        else:
+            same = all([_same_access(*pair) for pair in zip(value, computed[sid])])
+        if not same:
+            mismatches += 1
+            logging.error('Stop %s [%s]: expected %s, got %s.', sid, name, value, computed[sid])
+
+    print('{:6s} stops: {:6d} | brute-force {:8.3f}s | indexed {:8.3f}s | '
+          'speedup {:7.1f}x | mismatches {}'.format(
+              name, len(stops), brute_time, index_time,
+              brute_time / max(index_time, 1e-9), mismatches))
+    return mismatches
+
+def _main():
+    """ Compare the indexed stop snapping with the brute-force one. """
+    if PT.sumolib is None:
+        sys.exit("Please declare environment variable 'SUMO_TOOLS'")
+    args = _args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        netfile = args.netstruct
+        if netfile is None:
+            netfile = os.path.join(tmpdir, 'synthetic.net.xml')
+            write_synthetic_net(netfile, districts=args.districts)
+        net = PT.sumolib.net.readNet(netfile)
+
+        if args.osmstruct is None:
+            xmin, ymin, xmax, ymax = net.getBoundary()
+            osm = {'node': synthetic_ptstops(net, xmax - xmin, ymax - ymin, args.stops,
+                                             origin=(xmin, ymin)),
+                   'relation': []}
+        else:
+            osm = PT._read_from_pickle(args.osmstruct) # pylint: disable=W0212
+
+    print('Edges: {}'.format(len(net.getEdges())))
+    # pylint: disable=W0212
+    ptransports = PT.PublicTransportsGenerator(osm, net)
+    start = time.perf_counter()
+    ptransports._bus_lanes_index()
+    ptransports._train_lanes_indexes()
+    print('Index construction: {:.3f}s'.format(time.perf_counter() - start))
+
+    mismatches = _compare('bus', _stops_coords(ptransports._osm_ptstops['bus'],
+                                               ptransports._ptstops_xy['bus']),
+                          lambda coord: brute_force_bus(net, coord),
+                          ptransports._bus_stop_to_lane)
+    mismatches += _compare('train', _stops_coords(ptransports._osm_ptstops['train'],
+                                                  ptransports._ptstops_xy['train']),
+                           lambda coord: brute_force_train(net, coord),
+                           ptransports._train_stop_to_lane)
+    # pylint: enable=W0212
+
+    if mismatches:
+        sys.exit('The indexed snapping differs from the brute-force one.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+""" Benchmark suite of the scenario generation toolchain, on synthetic inputs.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    For each scale, the synthetic OSM-like files, buildings, public transports and grid
+    network are generated in a temporary folder, then each stage is timed (best of --repeat
+    runs) and, in a separate run under tracemalloc, its peak memory is measured as the
+    maximum traced memory above the one at the beginning of the stage. The network is the
+    cache of the grid network built without SUMO (see common.write_synthetic_net_cache),
+    loaded with netcache.CachedNet as stand-in for the sumolib one.
+
+    The results are saved in a JSON file, that can be used as --baseline of later runs: a
+    stage is a regression when its time or its memory grow more than --tolerance.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import (load_tool, synthetic_buildings, synthetic_osm, synthetic_ptstops,
+                    write_osm_xml, write_synthetic_net_cache)
+
+XML2PICKLE = load_tool('xml2pickle.py')
+MERGER = load_tool(os.path.join('merger', 'merge.osm.pickles.py'))
+AREA = load_tool('compute.area.poly.py')
+NETCACHE = load_tool('netcache.py')
+## imported as the tools do, the store checks of compute.area.poly.py use the same module
+import osmstore # pylint: disable=C0413
+## sumolib is not required, the network of the public transports is a stand-in
+PT = load_tool('pt.osm2sumo.py')
+
+## Scales, as side of the square of districts (e.g. 'city' is 10 x 10 districts): a district
+## is a 5x5 grid of 250m blocks, with the OSM nodes, buildings and stops below. Custom scales
+## are given as side as well.
+SCALES = collections.OrderedDict([
+    ('district', 1),
+    ('town', 4),
+    ('city', 10),
+    ('region', 25),
+])
+NODES_PER_DISTRICT = 10000
+BUILDINGS_PER_DISTRICT = 1000
+STOPS_PER_DISTRICT = 50
+PICKLES = 4
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Time the scenario generation toolchain on synthetic inputs.')
+    parser.add_argument(
+        '--scales', type=str, nargs='+', dest='scales', default=['district', 'town'],
+        help='Scales to run: {} or the side of the square of districts.'.format(
+            ', '.join(SCALES)))
+    parser.add_argument(
+        '--repeat', type=int, dest='repeat', default=3,
+        help='Runs of each stage, the best time is kept.')
+    parser.add_argument(
+        '--no-memory', dest='memory', action='store_false',
+        help='Skip the measure of the peak memory (a second run under tracemalloc).')
+    parser.add_argument(
+        '--results', type=str, dest='results', default='suite.results.json',
+        help='JSON file of the results.')
+    parser.add_argument(
+        '--baseline', type=str, dest='baseline', default=None,
+        help='Results of a previous run, to compare with.')
+    parser.add_argument(
+        '--tolerance', type=float, dest='tolerance', default=0.2,
+        help='Relative growth of time or memory from the baseline considered a regression.')
+    return parser.parse_args()
+
+def _side(scale):
+    """ Side, in districts, of a named or numeric scale. """
+    if scale in SCALES:
+        return SCALES[scale]
+    try:
+        return int(scale)
+    except ValueError:
+        sys.exit('Unknown scale {}, use {} or the side of the square of districts.'.format(
+            scale, ', '.join(SCALES)))
+
+def _synthetic_ptlines(stops, trains, seed=42):
+    """ OSM-like relations of bus and train lines over the synthetic stops. """
+    rng = random.Random(seed)
+    relations = []
+    for pos in range(max(1, stops // 10)):
+        members = [{'type': 'node', 'ref': str(rng.randint(1, stops)), 'role': 'stop'}
+                   for _ in range(8)]
+        relations.append({'id': 'b{}'.format(pos), 'member': members, 'tag': [
+            {'k': 'route', 'v': 'bus'}, {'k': 'ref', 'v': str(pos)}]})
+    for pos in range(max(1, trains // 5)):
+        members = [{'type': 'node', 'ref': str(rng.randint(stops + 1, stops + trains)),
+                    'role': 'stop'} for _ in range(4)]
+        relations.append({'id': 't{}'.format(pos), 'member': members, 'tag': [
+            {'k': 'route', 'v': 'train'}, {'k': 'ref', 'v': 'T{}'.format(pos)}]})
+    return relations
+
+def _stages(side, folder):
+    """ Generate the inputs of the scale, side x side districts, in the folder.
+        ret: list of the stages as (name, number of elements, function). """
+    stages = []
+
+    osm = synthetic_osm(NODES_PER_DISTRICT * side * side)
+    elements = len(osm['node']) + len(osm['way']) + len(osm['relation'])
+    xml_file = os.path.join(folder, 'synthetic.osm')
+    write_osm_xml(osm, xml_file)
+    stages.append(('xml2pickle.parse', elements,
+                   lambda: XML2PICKLE._parse_xml_file(xml_file))) # pylint: disable=W0212
+    stages.append(('xml2pickle.iterparse', elements,
+                   lambda: XML2PICKLE._iterparse_xml_file(xml_file))) # pylint: disable=W0212
+
+    pickles = os.path.join(folder, 'pickles')
+    os.makedirs(pickles)
+    per_file = len(osm['node']) // PICKLES
+    for pos in range(PICKLES):
+        with open(os.path.join(pickles, '{}.pkl'.format(pos)), 'wb') as dump:
+            pickle.dump(synthetic_osm(per_file, first_id=pos * per_file + 1, seed=pos), dump,
+                        pickle.HIGHEST_PROTOCOL)
+    del osm
+    merged = {}
+    def _merge():
+        """ Merge the pickles. """
+        merged.clear()
+        merged['merger'] = MERGER.MergeOSMFiles(pickles)
+    stages.append(('merge', per_file * PICKLES, _merge))
+    stages.append(('merge.write', per_file * PICKLES, lambda: merged['merger'].write_osm_file(
+        os.path.join(folder, 'merged.osm'))))
+
+    buildings = synthetic_buildings(BUILDINGS_PER_DISTRICT * side * side)
+    stages.append(('area', len(buildings['way']),
+                   lambda: AREA._compute_area_from_osm(buildings))) # pylint: disable=W0212
+    def _area_write(osm, filename):
+        """ Area of the polygons, written to the OSM-like file. """
+        polygons = AREA._compute_area_from_osm(osm) # pylint: disable=W0212
+        AREA._write_osm_file(osm['bounds'][0], polygons, filename) # pylint: disable=W0212
+    stages.append(('area.write', len(buildings['way']),
+                   lambda: _area_write(buildings, os.path.join(folder, 'buildings.osm'))))
+    ## the same polygons from an OSM store, whose elements omit the empty tags and ele
+    store = os.path.join(folder, 'buildings.store')
+    osmstore.write_store(buildings, store)
+    stages.append(('area.store', len(buildings['way']),
+                   lambda: _area_write(osmstore.OSMStore(store),
+                                       os.path.join(folder, 'buildings.store.osm'))))
+
+    netfolder = os.path.join(folder, 'net.cache')
+    width, height = write_synthetic_net_cache(netfolder, districts=side)
+    net = NETCACHE.CachedNet(netfolder)
+    stops = STOPS_PER_DISTRICT * side * side
+    ptosm = {'node': synthetic_ptstops(net, width, height, stops)}
+    ptosm['relation'] = _synthetic_ptlines(stops, len(ptosm['node']) - stops)
+    generator = PT.PublicTransportsGenerator()
+    prefix = os.path.join(folder, 'most.')
+    stages.extend([
+        ('pt.load', len(ptosm['node']) + len(ptosm['relation']),
+         lambda: generator.load(ptosm, net)),
+        ('pt.buses', stops, generator.generate_buses),
+        ('pt.trains', len(ptosm['node']) - stops, generator.generate_trains),
+        ('pt.save', len(ptosm['relation']), lambda: (generator.save_buses_to_file(prefix),
+                                                     generator.save_trains_to_file(prefix))),
+    ])
+    return stages
+
+def _run(stages, repeat, memory):
+    """ Time (best of repeat) and, optionally, measure the peak memory of the stages. """
+    results = collections.OrderedDict()
+    for name, count, _ in stages:
+        results[name] = {'count': count, 'seconds': float('inf')}
+    for _ in range(repeat):
+        for name, _, function in stages:
+            start = time.perf_counter()
+            function()
+            results[name]['seconds'] = min(results[name]['seconds'],
+                                           time.perf_counter() - start)
+    if memory:
+        tracemalloc.start()
+        for name, _, function in stages:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            function()
+            results[name]['peak_mb'] = (tracemalloc.get_traced_memory()[1] - current) / 1e6
+        tracemalloc.stop()
+    for result in results.values():
+        result['per_s'] = result['count'] / max(result['seconds'], 1e-9)
+    return results
+
+def _compare(results, baseline, tolerance):
+    """ Print the comparison with the baseline, the stages of the baseline missing from the
+        results (of the same scale) are regressions as well.
+        ret: list of the regressions. """
+    regressions = []
+    print('\nComparison with the baseline (ratio new/baseline):')
+    for scale, stages in results.items():
+        for name in baseline.get(scale, {}):
+            if name not in stages:
+                print('{:10s} | {:22s} | <-- REGRESSION (missing)'.format(scale, name))
+                regressions.append('{} {} missing'.format(scale, name))
+        for name, result in stages.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is None:
+                continue
+            ratios = {'time': result['seconds'] / max(reference['seconds'], 1e-9)}
+            if 'peak_mb' in result and 'peak_mb' in reference:
+                ratios['memory'] = result['peak_mb'] / max(reference['peak_mb'], 1e-3)
+            flags = [measure for measure, ratio in ratios.items() if ratio > 1 + tolerance]
+            print('{:10s} | {:22s} | time {:6.2f} | memory {:>6s} {}'.format(
+                scale, name, ratios['time'],
+                '{:.2f}'.format(ratios['memory']) if 'memory' in ratios else '-',
+                '<-- REGRESSION ({})'.format(', '.join(flags)) if flags else ''))
+            regressions.extend(['{} {} {}'.format(scale, name, measure) for measure in flags])
+    return regressions
+
+def _main():
+    """ Time the scenario generation toolchain on synthetic inputs. """
+    args = _args()
+
+    results = collections.OrderedDict()
+    for scale in args.scales:
+        side = _side(scale)
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            stages = _stages(side, folder)
+            print('Scale {} ({} x {} districts): inputs generated in {:.1f}s.'.format(
+                scale, side, side, time.perf_counter() - start))
+            results[scale] = _run(stages, args.repeat, args.memory)
+        for name, result in results[scale].items():
+            print('{:10s} | {:22s} | {:9d} elements | {:8.3f}s | {:11.0f} elements/s | {:>9s}'
+                  .format(scale, name, result['count'], result['seconds'], result['per_s'],
+                          '{:.1f} MB'.format(result['peak_mb']) if 'peak_mb' in result else '-'))
+
+    with open(args.results, 'w') as outfile:
+        json.dump({
+            'meta': {
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'repeat': args.repeat,
+            },
+            'results': results,
+        }, outfile, indent=4)
+    print('Results saved to {}'.format(args.results))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as infile:
+            baseline = json.load(infile)['results']
+        regressions = _compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
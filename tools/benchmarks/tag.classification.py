@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+""" Benchmark the classification of the OSM public transports by tags.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import random
+import sys
+import time
+
+from common import load_tool
+
+PT = load_tool('pt.osm2sumo.py')
+
+## tags of the synthetic elements, the public transports ones are mixed with common ones
+TAGS = [
+    ('highway', 'bus_stop'), ('highway', 'residential'), ('highway', 'footway'),
+    ('public_transport', 'stop_position'), ('public_transport', 'platform'),
+    ('railway', 'station'), ('railway', 'rail'), ('amenity', 'bus_station'),
+    ('amenity', 'bench'), ('bus', 'yes'), ('bus', 'no'), ('route', 'bus'),
+    ('route', 'train'), ('route', 'hiking'), ('type', 'public_transport'),
+    ('type', 'multipolygon'), ('name', 'Casino'), ('name', 'Fontvieille'),
+    ('building', 'yes'), ('shelter', 'yes'), ('source', 'survey'),
+]
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Measure the classification rate (tags per second) of the PT filters.')
+    parser.add_argument(
+        '--elements', type=int, dest='elements', default=200000,
+        help='Number of synthetic tagged elements.')
+    parser.add_argument(
+        '--seed', type=int, dest='seed', default=42,
+        help='Seed of the synthetic tags.')
+    return parser.parse_args()
+
+def _synthetic_elements(number, seed):
+    """ Elements with 1 to 6 random tags. """
+    rng = random.Random(seed)
+    return [{'id': str(pos), 'tag': [{'k': key, 'v': value}
+                                     for key, value in rng.sample(TAGS, rng.randint(1, 6))]}
+            for pos in range(number)]
+
+## ---------------------------------------------------------------------------------------- ##
+##              Reference implementation: the rules rebuilt for every single tag            ##
+## ---------------------------------------------------------------------------------------- ##
+
+def _is_pt_train(tag):
+    """ Check if the tag matches to one of the possible public transports. """
+    pt_dict = {
+        'railway': ['station'],
+        'route': ['train'],
+    }
+    for key, value in pt_dict.items():
+        if tag['k'] == key and tag['v'] in value:
+            return True
+    return False
+
+def _is_pt_bus(tag):
+    """ Check if the tag matches to one of the possible public transports. """
+    pt_dict = {
+        'bus': ['yes'],
+        'highway': ['bus_stop'],
+        'public_transport': ['stop_position', 'stop_area'],
+        'amenity': ['bus_station'],
+        'route': ['bus'],
+        'type': ['public_transport'],
+    }
+    for key, value in pt_dict.items():
+        if tag['k'] == key and tag['v'] in value:
+            return True
+    return False
+
+def reference(elements):
+    """ Types of each public transport element, bus before train. """
+    types = {}
+    for element in elements:
+        bus = False
+        train = False
+        for tag in element['tag']:
+            if _is_pt_bus(tag):
+                bus = True
+            elif _is_pt_train(tag):
+                train = True
+        if bus or train:
+            types[element['id']] = [pt_type for pt_type, match in (('bus', bus), ('train', train))
+                                    if match]
+    return types
+
+## ---------------------------------------------------------------------------------------- ##
+
+def compiled(elements):
+    """ Types of each public transport element, with the compiled rules. """
+    classifier = PT.TagClassifier(PT.PT_TAG_RULES)
+    return {element['id']: classifier.matching(mask)
+            for element, mask in classifier.classify(elements)}
+
+def _main():
+    """ Measure the classification rate (tags per second) of the PT filters. """
+    args = _args()
+
+    elements = _synthetic_elements(args.elements, args.seed)
+    tags = sum([len(element['tag']) for element in elements])
+
+    results = {}
+    for name, function in (('reference', reference), ('compiled', compiled)):
+        start = time.perf_counter()
+        results[name] = function(elements)
+        elapsed = time.perf_counter() - start
+        print('{:10s} | {:9d} tags | {:8.3f}s | {:12.0f} tags/s'.format(
+            name, tags, elapsed, tags / elapsed))
+
+    if results['reference'] != results['compiled']:
+        sys.exit('The compiled rules classify the elements differently.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
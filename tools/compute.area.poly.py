@@ -17,41 +17,36 @@
 
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Centroids and convex hulls of all the polygons are computed at once with NumPy and the
+    vectorized Shapely 2 API, with a single cached projection; the coordinates of an OSM
+    store are read from its arrays. With -p N the polygons are split in chunks
+    (--chunk-size) processed by N processes sharing the node coordinates, and the
+    throughput of each chunk is logged.
 """
 
 import argparse
+import functools
 import logging
+import multiprocessing
 import sys
 import pickle
+import time
 import numpy
 import pyproj
+import shapely
 
-from functools import partial
-from shapely.geometry import shape, MultiPoint
-from shapely.ops import transform
+from multiprocessing import shared_memory
 from tqdm import tqdm
 
-HEADER_TPL = """<?xml version='1.0' encoding='UTF-8'?>
-<osm version="0.6">
-    <bounds minlat="{minlat}" minlon="{minlon}" maxlat="{maxlat}" maxlon="{maxlon}"/>""" # pylint: disable=C0301
-
-NODE_TPL = """
-    <node id="{id}" lat="{lat}" lon="{lon}" ele="{ele}" version="1"> {tags}
-    </node>"""
-
-WAY_TPL = """
-    <way id="{id}" version="1"> {nds} {tags}
-    </way>"""
-
-ND_TPL = """
-        <nd ref="{ref}"/>"""
+import instrumentation
+import osmstore
+import osmwriter
 
-TAG_TPL = """
-        <tag k="{k_val}" v="{v_val}"/>"""
+DEFAULT_CHUNK_SIZE = 10000
 
-FOOTER_TPL = """
-</osm>
-"""
+## Read-only node coordinates, attached by each worker process to the shared memory.
+_WORKER_COORDINATES = {}
 
 def _logs():
     """ Log init. """
@@ -73,10 +68,17 @@ def _args():
         description='Compute the area of the polygons and tag it in a OSM-like file.')
     parser.add_argument(
         '-i', type=str, dest='input', required=True,
-        help='OSM-like input in pickle format.')
+        help='OSM-like input in pickle format or OSM store folder.')
     parser.add_argument(
         '-o', type=str, dest='output', required=True,
         help='OSM-like output file.')
+    parser.add_argument(
+        '-p', type=int, dest='processes', default=1,
+        help='Number of processes computing the polygons.')
+    parser.add_argument(
+        '--chunk-size', type=int, dest='chunk_size', default=DEFAULT_CHUNK_SIZE,
+        help='Number of polygons processed by each task (with -p > 1).')
+    instrumentation.add_arguments(parser)
     return parser.parse_args()
 
 def _read_from_pickle(filename):
@@ -85,23 +87,186 @@ def _read_from_pickle(filename):
         obj = pickle.load(pickle_obj)
     return obj
 
-def _compute_area_from_osm(osm):
+def _load_osm(filename):
+    """ Load the OSM-like structure from a pickle or from an OSM store folder. """
+    if osmstore.is_store(filename):
+        return osmstore.OSMStore(filename)
+    return _read_from_pickle(filename)
+
+@functools.lru_cache(maxsize=None)
+def _mercator_transformer():
+    """ Cached transformer from EPSG:4326 to EPSG:3857.
+        see: http://openstreetmapdata.com/info/projections
+
+        It mirrors pyproj.transform with Proj(init=...), axis order included: the points
+        are (lat, lon) pairs fed as (x, y).
+    """
+    return pyproj.Transformer.from_crs('epsg:4326', 'epsg:3857', always_xy=True)
+
+def _nodes_coordinates(osm):
+    """ Return the arrays of lat and lon of all the nodes, and a function mapping a
+        list of node references to their positions in the arrays. """
+
+    if isinstance(osm, osmstore.OSMStore):
+        ids = numpy.asarray(osm.node_id)
+        sorter = numpy.argsort(ids, kind='stable')
+        sorted_ids = ids[sorter]
+
+        def _positions(refs):
+            refs = numpy.asarray(refs, dtype=numpy.int64)
+            found = numpy.minimum(numpy.searchsorted(sorted_ids, refs), len(ids) - 1)
+            if len(refs) and (not len(ids) or (sorted_ids[found] != refs).any()):
+                raise KeyError('Missing node in {}.'.format(osm.folder))
+            return sorter[found]
+
+        return numpy.asarray(osm.node_lat), numpy.asarray(osm.node_lon), _positions
+
+    nodes = osm['node']
+    lat = numpy.empty(len(nodes))
+    lon = numpy.empty(len(nodes))
+    index = {}
+    for pos, node in enumerate(nodes):
+        index[node['id']] = pos
+        lat[pos] = float(node['lat'])
+        lon[pos] = float(node['lon'])
+
+    def _positions(refs):
+        return numpy.array([index[ref] for ref in refs], dtype=numpy.int64)
+
+    return lat, lon, _positions
+
+def _ways_nodes(osm, positions):
+    """ CSR (offsets, node positions) of the nodes of all the ways. """
+    if isinstance(osm, osmstore.OSMStore):
+        return numpy.asarray(osm.way_nd_offsets), positions(osm.way_nd_refs)
+
+    ways = osm['way']
+    offsets = numpy.zeros(len(ways) + 1, dtype=numpy.int64)
+    refs = []
+    for pos, way in enumerate(ways):
+        refs.extend([node['ref'] for node in way.get('nd', [])])
+        offsets[pos + 1] = len(refs)
+    return offsets, positions(refs)
+
+def _centroids_and_areas(lat, lon, offsets, nodes):
+    """ Centroid (mean of lat and lon) and approximated area (convex hull, projected
+        in EPSG:3857) of all the polygons at once.
+        see: https://arachnoid.com/area_irregular_polygon/
+             https://gist.github.com/robinkraft/c6de2f988c9d3f01af3c
+    """
+    counts = numpy.diff(offsets)
+    ways = numpy.repeat(numpy.arange(len(counts)), counts)
+    points = numpy.column_stack((lat[nodes], lon[nodes]))
+
+    ## node-by-node sums over all the ways at once, in the same order (and with the same
+    ## rounding) of numpy.mean on each polygon; ways sorted by decreasing number of nodes
+    sums = numpy.zeros((len(counts), 2))
+    order = numpy.argsort(-counts, kind='stable')
+    sorted_counts = counts[order]
+    for step in range(int(sorted_counts[0]) if len(counts) else 0):
+        active = order[:numpy.searchsorted(-sorted_counts, -step, side='left')]
+        sums[active] += points[offsets[active] + step]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        centroids = sums / counts[:, None]
+
+    multipoints = numpy.empty(len(counts), dtype=object)
+    if len(points):
+        shapely.multipoints(points, indices=ways, out=multipoints)
+    hulls = shapely.convex_hull(multipoints)
+
+    transformer = _mercator_transformer()
+    def _project(coords):
+        """ Project all the coordinates of all the hulls with a single call. """
+        return numpy.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    areas = shapely.area(shapely.transform(hulls, _project))
+    areas[numpy.isnan(areas)] = 0.0
+    return centroids, areas
+
+def _share_array(array):
+    """ Copy the array into a new shared memory block. """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block
+
+def _init_worker(lat_name, lon_name, length):
+    """ Attach the worker process to the shared node coordinates. """
+    for key, name in (('lat', lat_name), ('lon', lon_name)):
+        block = shared_memory.SharedMemory(name=name)
+        _WORKER_COORDINATES[key + '_block'] = block
+        _WORKER_COORDINATES[key] = numpy.ndarray((length,), dtype=numpy.float64,
+                                                 buffer=block.buf)
+
+def _process_chunk(chunk):
+    """ Centroids and areas of a chunk of polygons, using the shared coordinates. """
+    pos, offsets, nodes = chunk
+    start = time.perf_counter()
+    centroids, areas = _centroids_and_areas(
+        _WORKER_COORDINATES['lat'], _WORKER_COORDINATES['lon'], offsets, nodes)
+    return pos, centroids, areas, time.perf_counter() - start
+
+def _parallel_centroids_and_areas(lat, lon, offsets, nodes, processes, chunk_size):
+    """ Split the polygons in chunks and process them on a pool of processes.
+        The node coordinates are shared read-only, only the node positions of each chunk
+        are sent to the workers. The results are merged in the original order. """
+    ways = len(offsets) - 1
+    chunks = []
+    for first in range(0, ways, chunk_size):
+        last = min(first + chunk_size, ways)
+        chunks.append((len(chunks), offsets[first:last+1] - offsets[first],
+                       nodes[offsets[first]:offsets[last]]))
+
+    centroids = numpy.empty((ways, 2))
+    areas = numpy.empty(ways)
+    lat_block = _share_array(numpy.ascontiguousarray(lat, dtype=numpy.float64))
+    lon_block = _share_array(numpy.ascontiguousarray(lon, dtype=numpy.float64))
+    try:
+        with multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                  initargs=(lat_block.name, lon_block.name, len(lat))) as pool:
+            for pos, chunk_centroids, chunk_areas, elapsed in pool.imap_unordered(
+                    _process_chunk, chunks):
+                first = pos * chunk_size
+                centroids[first:first+len(chunk_areas)] = chunk_centroids
+                areas[first:first+len(chunk_areas)] = chunk_areas
+                logging.info("Chunk %d: %d polygons, %d nodes in %.3fs (%.0f polygons/s).",
+                             pos, len(chunk_areas), len(chunks[pos][2]), elapsed,
+                             len(chunk_areas) / max(elapsed, 1e-9))
+    finally:
+        for block in (lat_block, lon_block):
+            block.close()
+            block.unlink()
+    return centroids, areas
+
+def _compute_area_from_osm(osm, processes=1, chunk_size=DEFAULT_CHUNK_SIZE):
     """ Compute the are of the polygons OSM-like structure. """
 
-    osm_nodes = dict()
-    for node in osm['node']:
-        osm_nodes[node['id']] = node
+    logging.info("Loading the coordinates of the nodes..")
+    with instrumentation.phase('coordinates') as phase:
+        lat, lon, positions = _nodes_coordinates(osm)
+        offsets, nodes = _ways_nodes(osm, positions)
+        phase.count = len(lat)
+
+    logging.info("Computing centroids and areas of %d polygons..", len(offsets) - 1)
+    start = time.perf_counter()
+    with instrumentation.phase('polygons', len(offsets) - 1):
+        if processes > 1:
+            centroids, areas = _parallel_centroids_and_areas(
+                lat, lon, offsets, nodes, processes, chunk_size)
+        else:
+            centroids, areas = _centroids_and_areas(lat, lon, offsets, nodes)
+    elapsed = time.perf_counter() - start
+    logging.info("%d polygons in %.3fs (%.0f polygons/s).", len(areas), elapsed,
+                 len(areas) / max(elapsed, 1e-9))
 
     poly = list()
-    for way in tqdm(osm['way']):
-        centroid = _poly_centroid(way, osm_nodes)
-        centroid_str = '{}, {}'.format(centroid[0], centroid[1])
-        area = _poly_area_approximation(way, osm_nodes)
+    with instrumentation.phase('tag', len(areas)):
+        for pos, way in enumerate(tqdm(osm['way'])):
+            centroid_str = '{}, {}'.format(centroids[pos][0], centroids[pos][1])
 
-        ## Update the tags for the way
-        way['tag'] = _update_tag(way['tag'], 'centroid', centroid_str)
-        way['tag'] = _update_tag(way['tag'], 'approx_area', str(area))
-        poly.append(way)
+            ## Update the tags for the way
+            way['tag'] = _update_tag(way.get('tag', []), 'centroid', centroid_str)
+            way['tag'] = _update_tag(way['tag'], 'approx_area', str(float(areas[pos])))
+            poly.append(way)
 
     ## Update the ways in the OSM-like structure.
     osm['way'] = poly
@@ -124,114 +289,53 @@ def _update_tag(tags, key, value):
 
     return tags
 
-def _poly_centroid(way, nodes):
-    """ Compute the centroid of a OSM polygon. """
-    points = []
-    for node in way['nd']:
-        points.append([float(nodes[node['ref']]['lat']), float(nodes[node['ref']]['lon'])])
-    return numpy.mean(numpy.array(points), axis=0)
+def _node_ele(node):
+    """ Elevation of the node, from the ele tag if present. """
+    ele = node.get('ele', '0.0')
+    for value in node.get('tag', []):
+        if value['k'] == 'ele':
+            ele = value['v']
+    return str(ele)
 
-def _poly_area_shapely(way, nodes):
-    """ Compute the area of an irregular OSM polygon.
-        see: https://arachnoid.com/area_irregular_polygon/
-             https://gist.github.com/robinkraft/c6de2f988c9d3f01af3c
-    """
-    points = []
-    for node in way['nd']:
-        points.append([float(nodes[node['ref']]['lat']), float(nodes[node['ref']]['lon'])])
-
-    geom = {'type': 'Polygon',
-            'coordinates': [points]}
-
-    s = shape(geom)
-    # http://openstreetmapdata.com/info/projections
-    proj = partial(pyproj.transform, pyproj.Proj(init='epsg:4326'),
-                   pyproj.Proj(init='epsg:3857'))
-
-    newshape = transform(proj, s)
-
-    return newshape.area
-
-def _poly_area_approximation(way, nodes):
-    """ Compute the approximated area of an irregular OSM polygon.
-        see: https://arachnoid.com/area_irregular_polygon/
-             https://gist.github.com/robinkraft/c6de2f988c9d3f01af3c
-    """
-    points = []
-    for node in way['nd']:
-        points.append([float(nodes[node['ref']]['lat']), float(nodes[node['ref']]['lon'])])
-
-    approx = MultiPoint(points).convex_hull
-    # http://openstreetmapdata.com/info/projections
-    proj = partial(pyproj.transform, pyproj.Proj(init='epsg:4326'),
-                   pyproj.Proj(init='epsg:3857'))
-
-    converted_approximation = transform(proj, approx)
-
-    return converted_approximation.area
-
-def _write_all_nodes(osm, filebuffer):
+def _write_all_nodes(osm, writer):
     """ Write all the nodes to OSM-like file. """
+    ## the nodes of an OSM store are rebuilt at each access, they are not modified
+    writer.write_nodes((node['id'], node['lat'], node['lon'], _node_ele(node), node.get('tag', []))
+                       for node in osm['node'])
 
-    for node in osm['node']:
-        string_of_tags = ""
-        for value in node['tag']:
-            val = value['v'].replace('"', '')
-            val = val.replace('&', 'and')
-            string_of_tags += TAG_TPL.format(
-                k_val=value['k'],
-                v_val=val) # .encode('utf-8')
-            if value['k'] == 'ele':
-                node['ele'] = val
-
-        filebuffer.write(NODE_TPL.format(id=node['id'], lat=node['lat'],
-                                         lon=node['lon'], ele=node['ele'],
-                                         tags=string_of_tags))
-
-def _write_all_ways(osm, filebuffer):
+def _write_all_ways(osm, writer):
     """ Write all the ways to OSM-like file. """
-    for way in osm['way']:
-        string_of_nodes = ""
-        for nid in way['nd']:
-            string_of_nodes += ND_TPL.format(ref=nid['ref'])
-        string_of_tags = ""
-        for tag in way['tag']:
-            value = tag['v'].replace('"', '')
-            value = value.replace('&', 'and')
-            string_of_tags += TAG_TPL.format(
-                k_val=tag['k'],
-                v_val=value) # .encode('utf-8')
-
-        filebuffer.write(WAY_TPL.format(
-            id=way['id'], nds=string_of_nodes, tags=string_of_tags))
+    writer.write_ways((way['id'], [nid['ref'] for nid in way['nd']], way['tag'])
+                      for way in osm['way'])
 
 def _write_osm_file(boundaries, polygons, filename):
-    """ Write the OSM-like file. """
+    """ Write the OSM-like file (gzip compressed if the name ends with .gz). """
 
-    with open(filename, 'w') as outfile:
-        outfile.write(HEADER_TPL.format(
-            minlat=boundaries['minlat'], minlon=boundaries['minlon'],
-            maxlat=boundaries['maxlat'], maxlon=boundaries['maxlon']))
-
-        _write_all_nodes(polygons, outfile)
-        _write_all_ways(polygons, outfile)
-
-        outfile.write(FOOTER_TPL)
+    with instrumentation.phase('write', len(polygons['node']) + len(polygons['way'])):
+        with osmwriter.OSMWriter(filename, attributes=' version="1"') as writer:
+            writer.write_header(boundaries)
+            _write_all_nodes(polygons, writer)
+            _write_all_ways(polygons, writer)
 
 def _main():
     """ Compute the area of the polygons and tag it in a OSM-like file. """
 
     args = _args()
+    instrumentation.start('compute.area.poly', args.profile)
 
     logging.info("Loading %s", args.input)
-    osm = _read_from_pickle(args.input)
+    with instrumentation.phase('load') as phase:
+        osm = _load_osm(args.input)
+        phase.count = len(osm['node']) + len(osm['way'])
 
     logging.info("Parsing polygons..")
-    polygons = _compute_area_from_osm(osm)
+    polygons = _compute_area_from_osm(osm, args.processes, args.chunk_size)
 
     logging.info("Creation of %s", args.output)
     _write_osm_file(osm['bounds'][0], polygons, args.output)
 
+    instrumentation.write_report(args.report or '{}.report.json'.format(args.output))
+
 if __name__ == "__main__":
     _logs()
     _main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+""" Time window slicing and scaling of the MoST demand, with the matching SUMO configuration.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The route files are read one top-level element at a time (xml2pickle.iterparse_elements)
+    and written as they are read, in a single pass per file with constant memory:
+        - vehicles, trips, persons and containers are kept if they depart in [begin, end);
+          with --scale below 1 each one is kept with probability scale, with --scale above
+          1 it is cloned (ids <id>.1, <id>.2, ..) as many times as the integer part, plus
+          once more with the probability of the fractional part;
+        - flows are clipped to [begin, end), keeping the phase of their departures, and
+          their rate (period, vehsPerHour, personsPerHour, probability, number) is scaled;
+          the public transport flows (with a line, as written by ptlines2flows) keep their
+          timetable unless --scale-pt is given;
+        - any other element (routes, vTypes, ..) is copied.
+    The decisions depend only on --seed and on the id of the element, the same slice is
+    produced on every run and independently of the order of the files.
+    The SUMO configuration written next to the sliced files runs the time window, with
+    the paths of the other inputs updated to its location. XML comments are not copied.
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+import xml.etree.ElementTree
+import zlib
+
+import instrumentation
+import routestore
+import xml2pickle
+
+## elements with a single departure, sampled or cloned
+DEPARTING = ('vehicle', 'trip', 'person', 'container')
+## elements with a departure rate, clipped and scaled
+FLOWS = ('flow', 'personFlow', 'containerFlow')
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Slice the demand to a time window and scale it, writing the route files '
+                    'and the matching SUMO configuration.')
+    parser.add_argument(
+        '-c', type=str, dest='sumocfg', required=True,
+        help='SUMO configuration of the complete scenario (e.g. scenario/most.sumocfg).')
+    parser.add_argument(
+        '-o', type=str, dest='output', required=True,
+        help='Output folder of the sliced route files and configuration.')
+    parser.add_argument(
+        '--begin', type=float, dest='begin', default=None,
+        help='Begin of the time window [s] (default: from the configuration).')
+    parser.add_argument(
+        '--end', type=float, dest='end', default=None,
+        help='End of the time window [s] (default: from the configuration).')
+    parser.add_argument(
+        '--scale', type=float, dest='scale', default=1.0,
+        help='Demand scale: 0.25 keeps a quarter of the vehicles, 2 doubles them.')
+    parser.add_argument(
+        '--seed', type=int, dest='seed', default=42,
+        help='Seed of the sampling.')
+    parser.add_argument(
+        '--scale-pt', dest='scale_pt', action='store_true',
+        help='Scale also the public transport flows (with a line attribute).')
+    parser.add_argument(
+        '--name', type=str, dest='name', default=None,
+        help='Name of the sliced configuration [default: the name of the input one].')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def _uniform(seed, key):
+    """ Deterministic value in [0, 1) of the key, independent of PYTHONHASHSEED. """
+    return zlib.crc32('{}:{}'.format(seed, key).encode('utf-8')) / 2**32
+
+def copies(element_id, scale, seed):
+    """ Number of copies of the element with the given id in the scaled demand. """
+    whole = int(math.floor(scale))
+    if _uniform(seed, element_id) < scale - whole:
+        return whole + 1
+    return whole
+
+def _float(element, attribute, default):
+    """ Numeric attribute of the element, default if missing. """
+    value = element.get(attribute)
+    if value is None:
+        return default
+    return float(value)
+
+class DemandSlicer(object):
+    """ Slices and scales the route files one element at a time. """
+
+    def __init__(self, begin, end, scale=1.0, seed=42, scale_pt=False):
+        self.begin = begin
+        self.end = end
+        self.scale = scale
+        self.seed = seed
+        self.scale_pt = scale_pt
+
+    def _departing(self, element):
+        """ Copies of a vehicle, trip, person or container in the slice. """
+        depart = element.get('depart')
+        try:
+            depart = float(depart)
+        except (TypeError, ValueError):
+            ## 'triggered', 'containerTriggered', .. are kept as they are
+            depart = None
+        if depart is not None and not self.begin <= depart < self.end:
+            return []
+        if self.scale == 1.0:
+            return [element]
+        element_id = element.get('id')
+        clones = []
+        for clone in range(copies(element_id, self.scale, self.seed)):
+            if clone:
+                element.set('id', '{}.{}'.format(element_id, clone))
+            clones.append(xml.etree.ElementTree.tostring(element, encoding='unicode'))
+        element.set('id', element_id)
+        return clones
+
+    def _flow(self, element):
+        """ The flow clipped to the time window and scaled, None if outside of it. """
+        begin = _float(element, 'begin', 0.0)
+        end = _float(element, 'end', float('inf'))
+        period = element.get('period')
+        try:
+            period = float(period) if period is not None else None
+        except ValueError:
+            ## random departures, e.g. period="exp(0.1)"
+            period = None
+
+        clipped_begin = max(begin, self.begin)
+        if period and clipped_begin > begin:
+            ## first departure of the original flow inside the window
+            clipped_begin = begin + math.ceil((clipped_begin - begin) / period) * period
+        clipped_end = min(end, self.end)
+        if clipped_begin >= clipped_end:
+            return None
+
+        scale = self.scale
+        if element.get('line') is not None and not self.scale_pt:
+            scale = 1.0
+        if element.get('number') is not None:
+            number = float(element.get('number')) * scale
+            if end != float('inf') and end > begin:
+                number *= (clipped_end - clipped_begin) / (end - begin)
+            number = int(round(number))
+            if number <= 0:
+                return None
+            element.set('number', str(number))
+        if period is not None:
+            element.set('period', routestore.format_time(period / scale))
+        elif element.get('period') is not None and element.get('period').startswith('exp('):
+            rate = float(element.get('period')[4:-1]) * scale
+            element.set('period', 'exp({})'.format(routestore.format_time(rate)))
+        for attribute in ('vehsPerHour', 'personsPerHour'):
+            if element.get(attribute) is not None:
+                element.set(attribute, routestore.format_time(
+                    float(element.get(attribute)) * scale))
+        if element.get('probability') is not None:
+            probability = float(element.get('probability')) * scale
+            if probability > 1.0:
+                logging.warning('Flow %s: the scaled probability %f is capped to 1.',
+                                element.get('id'), probability)
+                probability = 1.0
+            element.set('probability', repr(probability))
+
+        element.set('begin', routestore.format_time(float(clipped_begin)))
+        if element.get('end') is not None or end != float('inf'):
+            element.set('end', routestore.format_time(float(clipped_end)))
+        return element
+
+    def slice_file(self, route_file, output):
+        """ Write the slice of the route file.
+            ret: {tag: [read, written]} """
+        counts = {}
+        with open(output, 'w', encoding='utf-8') as outfile:
+            outfile.write(routestore.HEADER)
+            for element in xml2pickle.iterparse_elements(route_file):
+                element.tail = None
+                if element.tag in DEPARTING:
+                    texts = self._departing(element)
+                elif element.tag in FLOWS:
+                    flow = self._flow(element)
+                    texts = [] if flow is None else [flow]
+                else:
+                    texts = [element]
+                counts.setdefault(element.tag, [0, 0])
+                counts[element.tag][0] += 1
+                counts[element.tag][1] += len(texts)
+                for text in texts:
+                    if not isinstance(text, str):
+                        text = xml.etree.ElementTree.tostring(text, encoding='unicode')
+                    outfile.write('\n    ')
+                    outfile.write(text)
+            outfile.write(routestore.FOOTER)
+        return counts
+
+def _options(sumocfg):
+    """ Values of the options of a SUMO configuration. """
+    return {element.tag: element.get('value')
+            for element in xml.etree.ElementTree.parse(sumocfg).getroot().iter()
+            if element.get('value') is not None}
+
+def write_sumocfg(sumocfg, output, route_files, begin, end):
+    """ Copy of the SUMO configuration in the output file, with the route files and the time
+        window replaced and the paths of the other inputs relative to the new location. """
+    source = os.path.dirname(os.path.abspath(sumocfg))
+    target = os.path.dirname(os.path.abspath(output))
+    tree = xml.etree.ElementTree.parse(sumocfg)
+    for element in tree.getroot().iterfind('input/*'):
+        if element.tag == 'route-files':
+            element.set('value', ','.join(route_files))
+        elif element.get('value') is not None:
+            element.set('value', ','.join(
+                [os.path.relpath(os.path.join(source, path), target)
+                 for path in element.get('value').split(',')]))
+    time = tree.getroot().find('time')
+    for option, value in (('begin', begin), ('end', end)):
+        element = time.find(option)
+        if element is None:
+            element = xml.etree.ElementTree.SubElement(time, option)
+        element.set('value', routestore.format_time(float(value)))
+    tree.write(output, encoding='UTF-8', xml_declaration=True)
+
+def _main():
+    """ Slice the demand to a time window and scale it. """
+    args = _args()
+    instrumentation.start('demand.slicer', args.profile)
+
+    options = _options(args.sumocfg)
+    begin = args.begin if args.begin is not None else float(options.get('begin', 0))
+    end = args.end if args.end is not None else float(options.get('end', 'inf'))
+    if begin >= end:
+        sys.exit('Empty time window [{}, {}).'.format(begin, end))
+    if args.scale <= 0:
+        sys.exit('The scale must be positive.')
+    os.makedirs(args.output, exist_ok=True)
+
+    slicer = DemandSlicer(begin, end, args.scale, args.seed, args.scale_pt)
+    source = os.path.dirname(os.path.abspath(args.sumocfg))
+    route_files = []
+    for route_file in options.get('route-files', '').split(','):
+        filename = os.path.join(source, route_file)
+        if not os.path.isfile(filename):
+            logging.warning('%s not found, it is referenced from the original location.',
+                            filename)
+            route_files.append(os.path.relpath(filename, os.path.abspath(args.output)))
+            continue
+        logging.info('Slicing %s', filename)
+        with instrumentation.phase(os.path.basename(filename)) as phase:
+            counts = slicer.slice_file(
+                filename, os.path.join(args.output, os.path.basename(filename)))
+            phase.count = sum([read for read, _ in counts.values()])
+        for tag, (read, written) in sorted(counts.items()):
+            logging.info('    %s: %d read, %d written.', tag, read, written)
+        route_files.append(os.path.basename(filename))
+
+    sumocfg = os.path.join(args.output, args.name or os.path.basename(args.sumocfg))
+    write_sumocfg(args.sumocfg, sumocfg, route_files, begin, end)
+    logging.info('Configuration saved to %s', sumocfg)
+    instrumentation.write_report(args.report or os.path.join(args.output, 'slice.report.json'))
+    logging.info('Done.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+""" Phase timing, memory and profiling report shared by the tools.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The tools wrap their phases (load, filter, snap, unify, write, ..) in
+
+        with instrumentation.phase('load') as phase:
+            ...
+            phase.count = len(elements)
+
+    and each phase measures its wall time, CPU time (of the process and of its terminated
+    children), RSS and element count. The RSS is the high-water mark of the process (and of
+    its terminated children) since its start, not of the phase alone: each phase records it
+    at its end, and how much the phase raised it. The phases are recorded only between
+    start() and write_report(), called by the command line of the tools that write the JSON
+    report next to their outputs; used as libraries, the tools do not accumulate any record.
+    With profile=True the whole run is profiled with cProfile (saved to <report>.prof) and
+    tracemalloc (peak traced memory of each phase and the top allocation sites in the
+    report).
+"""
+
+import cProfile
+import contextlib
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+_RUN = {
+    'tool': None,
+    'start': None,
+    'profiler': None,
+    'phases': [],
+    'stack': [],
+}
+
+class Phase(object):
+    """ Measures of a phase, the count of the processed elements is set by the caller. """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_high_water = 0.0
+        self.rss_growth = 0.0
+        self.traced_peak = None
+
+    def to_dict(self):
+        """ JSON-friendly version of the measures. """
+        record = {
+            'phase': self.name,
+            'wall_s': round(self.wall, 6),
+            'cpu_s': round(self.cpu, 6),
+            'rss_high_water_mb': round(self.rss_high_water, 3),
+            'rss_growth_mb': round(self.rss_growth, 3),
+            'count': self.count,
+        }
+        if self.count and self.wall > 0:
+            record['per_s'] = round(self.count / self.wall, 3)
+        if self.traced_peak is not None:
+            record['traced_peak_mb'] = round(self.traced_peak, 3)
+        return record
+
+def _cpu_time():
+    """ User and system time of the process and of its terminated children. """
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+def _rss_high_water():
+    """ High-water mark of the resident set size [MB] since the start of the process, of the
+        process itself or of its largest terminated child. """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / _RSS_UNIT
+
+@contextlib.contextmanager
+def phase(name, count=None):
+    """ Record the phase, nested phases are named <outer>/<inner>. """
+    record = Phase('/'.join([outer.name for outer in _RUN['stack'][-1:]] + [name]))
+    record.count = count
+    if tracemalloc.is_tracing():
+        ## the peak of the outer phases so far is kept before resetting it for this one
+        traced = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        for outer in _RUN['stack']:
+            outer.traced_peak = max(outer.traced_peak or 0.0, traced)
+        record.traced_peak = 0.0
+        tracemalloc.reset_peak()
+    _RUN['stack'].append(record)
+    wall, cpu, rss = time.perf_counter(), _cpu_time(), _rss_high_water()
+    try:
+        yield record
+    finally:
+        record.wall = time.perf_counter() - wall
+        record.cpu = _cpu_time() - cpu
+        record.rss_high_water = _rss_high_water()
+        record.rss_growth = record.rss_high_water - rss
+        if tracemalloc.is_tracing():
+            record.traced_peak = max(record.traced_peak or 0.0,
+                                     tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        _RUN['stack'].pop()
+        if _RUN['start'] is not None:
+            _RUN['phases'].append(record.to_dict())
+        logging.debug('Phase %s: %.3fs wall, %.3fs CPU, RSS high-water %.1f MB (+%.1f).',
+                      record.name, record.wall, record.cpu, record.rss_high_water,
+                      record.rss_growth)
+
+def records():
+    """ Measures of the phases recorded so far. """
+    return list(_RUN['phases'])
+
+def clear():
+    """ Drop the recorded phases (e.g. in a forked worker, before its own phases). """
+    _RUN['phases'] = []
+
+def add_records(phases):
+    """ Add the phases recorded by another process. """
+    _RUN['phases'].extend(phases)
+
+def add_arguments(parser, default_report=True):
+    """ Add --report and --profile to the argument parser of a tool, without
+        default_report the report is written only when --report is given. """
+    parser.add_argument(
+        '--report', type=str, dest='report', default=None,
+        help='JSON file with the time, memory and elements of each phase [default: {}].'.format(
+            'next to the output' if default_report else 'not written'))
+    parser.add_argument(
+        '--profile', dest='profile', action='store_true',
+        help='Profile the run with cProfile (saved to <report>.prof) and tracemalloc.')
+
+def start(tool, profile=False):
+    """ Start the run of the tool, dropping any previous phase. """
+    _RUN['tool'] = tool
+    _RUN['start'] = (time.time(), time.perf_counter(), _cpu_time())
+    _RUN['phases'] = []
+    _RUN['stack'] = []
+    _RUN['profiler'] = None
+    if profile:
+        tracemalloc.start()
+        _RUN['profiler'] = cProfile.Profile()
+        _RUN['profiler'].enable()
+
+def write_report(filename):
+    """ Stop the profilers and write the JSON report of the run. """
+    started, wall, cpu = _RUN['start']
+    report = {
+        'tool': _RUN['tool'],
+        'argv': sys.argv,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'wall_s': round(time.perf_counter() - wall, 6),
+        'cpu_s': round(_cpu_time() - cpu, 6),
+        'rss_high_water_mb': round(_rss_high_water(), 3),
+        'phases': _RUN['phases'],
+    }
+
+    profiler = _RUN['profiler']
+    if profiler is not None:
+        profiler.disable()
+        stats_file = '{}.prof'.format(os.path.splitext(filename)[0])
+        profiler.dump_stats(stats_file)
+        results = io.StringIO()
+        pstats.Stats(profiler, stream=results).sort_stats('cumulative').print_stats(
+            TOP_FUNCTIONS)
+        logging.debug('Profile:\n%s', results.getvalue())
+        snapshot = tracemalloc.take_snapshot()
+        report['profile'] = {
+            'cprofile': stats_file,
+            'traced_peak_mb': round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 3),
+            'top_allocations': [
+                {'line': str(stat.traceback), 'size_mb': round(stat.size / 1024 / 1024, 3),
+                 'blocks': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]],
+        }
+        tracemalloc.stop()
+        _RUN['profiler'] = None
+    _RUN['start'] = None
+
+    with open(filename, 'w') as outfile:
+        json.dump(report, outfile, indent=4)
+    logging.info('Report saved to %s', filename)
+    return report
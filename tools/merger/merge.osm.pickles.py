@@ -17,43 +17,33 @@
 
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The pickles (and OSM stores, normalized from their arrays) are merged in name order, or
+    in the one given with --order, and the SHA-256 of the inputs are saved in a manifest
+    (<output>.manifest.json). With -p N they are loaded and normalized by N processes, with
+    the merge order (and the resulting IDs) of the serial run. MergeOSMFiles keeps its state
+    per instance: merge() and reset() allow the reuse of the same object for many merges,
+    and leaving a with block releases the merged elements.
 """
 
 import argparse
+import collections
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import pickle
 import sys
 from tqdm import tqdm
 
-HEADER_TPL = """<?xml version='1.0' encoding='UTF-8'?>
-<osm version="0.6">
-    <bounds minlat="{minlat}" minlon="{minlon}" maxlat="{maxlat}" maxlon="{maxlon}"/>""" # pylint: disable=C0301
-
-NODE_TPL = """
-    <node id="{id}" lat="{lat}" lon="{lon}" ele="{ele}" version="1" timestamp="2018-01-01T12:00:00Z"> {tags}
-    </node>"""
-
-WAY_TPL = """
-    <way id="{id}" version="1" timestamp="2018-01-01T12:00:00Z"> {nds} {tags}
-    </way>"""
-
-REL_TPL = """
-    <relation id="{id}" version="1" timestamp="2018-01-01T12:00:00Z"> {members} {tags}
-    </relation>"""
-
-ND_TPL = """
-        <nd ref="{ref}"/>"""
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import instrumentation # pylint: disable=C0413
+import osmstore # pylint: disable=C0413
+import osmwriter # pylint: disable=C0413
 
-TAG_TPL = """
-        <tag k="{k_val}" v="{v_val}"/>"""
-
-MEMB_TPL = """
-        <member type="{mtype}" ref="{ref}" role="{role}"/>"""
-
-FOOTER_TPL = """
-</osm>
-"""
+## attributes added to every element of the merged file
+ELEMENT_ATTRIBUTES = ' version="1" timestamp="2018-01-01T12:00:00Z"'
 
 def _logs():
     """ Log init. """
@@ -73,10 +63,17 @@ def _args():
         description='Merges a list of OSM-like pickles.')
     parser.add_argument(
         '-d', type=str, dest='osmdir', default='toMerge',
-        help='Directory containing the OSM-like pickles.')
+        help='Directory containing the OSM-like pickles (or OSM store folders).')
     parser.add_argument(
         '-o', type=str, dest='output', default='merged.osm',
         help='Merged OSM-like files.')
+    parser.add_argument(
+        '-p', type=int, dest='processes', default=1,
+        help='Number of processes used to load the pickles.')
+    parser.add_argument(
+        '--order', type=str, nargs='+', dest='order', default=None,
+        help='Merge order of the files in the directory, the others follow sorted by name.')
+    instrumentation.add_arguments(parser)
 
     return parser.parse_args()
 
@@ -84,66 +81,94 @@ class MergeOSMFiles(object):
     """ Merges all the OSM-like files (in cPickle format) stored in a folder,
         into a single OSM file. """
 
-    _boundaries = {
-        'minlat': 360.0,
-        'minlon': 360.0,
-        'maxlat': -360.0,
-        'maxlon': -360.0,
-    }
-
-    _global_counter = 1
-
-    _all_nodes = {}
-    _all_ways = {}
-    _all_relations = {}
+    def __init__(self, folder=None, processes=1, order=None):
+        """ Loads and process all the pickle files in the folder, if given. """
+        self.reset()
+        if folder is not None:
+            self.merge(folder, processes, order)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def reset(self):
+        """ Drop the merged elements, the instance can be used for a new merge. """
+        self._boundaries = {
+            'minlat': 360.0,
+            'minlon': 360.0,
+            'maxlat': -360.0,
+            'maxlon': -360.0,
+        }
 
-    _nodes_mapping = {}
-    _ways_mapping = {}
+        self._global_counter = 1
 
-    def __init__(self, folder):
-        """ Loads and process all the pickle files in the folder. """
+        self._all_nodes = {}
+        self._all_ways = {}
+        self._all_relations = {}
 
-        for filename in os.listdir(folder):
-            fname = os.path.join(folder, filename)
+        self._nodes_mapping = {}
+        self._ways_mapping = {}
 
-            if not os.path.isfile(fname):
-                continue
+        self._inputs = []
 
-            logging.info("Loading %s", fname)
-            self._parse_osm_pickle(fname)
-            logging.info("%s done.", fname)
+    def merge(self, folder, processes=1, order=None):
+        """ Loads and process all the pickle files in the folder, replacing any previous merge.
 
-        self._filter_duplicate_tags()
+            The files are merged in the given order (list of file names), the ones not
+            listed follow sorted by name. With processes > 1, the pickles are loaded and
+            normalized in parallel, the merge (and the assignment of the new IDs) is
+            always done in the same order, so the result does not depend on the number
+            of processes nor on the file system.
+        """
 
-    ## ------------------------------           LOADERS           ------------------------------ ##
+        self.reset()
 
-    @staticmethod
-    def _read_from_pickle(filename):
-        """ Dump the object into a binary pickle file. """
-        with open(filename, 'rb') as pickle_obj:
-            obj = pickle.load(pickle_obj)
-        return obj
+        filenames = [os.path.join(folder, filename)
+                     for filename in self._merge_order(folder, order)]
 
-    ## ------------------------------         PROCESSING          ------------------------------ ##
+        with instrumentation.phase('load') as phase:
+            if processes > 1:
+                logging.info("Loading %d files with %d processes", len(filenames), processes)
+                with multiprocessing.Pool(processes=processes) as pool:
+                    for fname, normalized in zip(filenames,
+                                                 pool.imap(_normalize_osm_pickle, filenames)):
+                        self._merge_osm_pickle(fname, normalized)
+            else:
+                for fname in filenames:
+                    logging.info("Loading %s", fname)
+                    self._merge_osm_pickle(fname, _normalize_osm_pickle(fname))
+            phase.count = self._elements()
 
-    def _parse_osm_pickle(self, filename):
-        """ Extract nodes and ways from OSM-like file. """
-        osm = self._read_from_pickle(filename)
+        with instrumentation.phase('filter', self._elements()):
+            self._filter_duplicate_tags()
 
-        if 'node' in osm.keys():
-            for node in tqdm(osm['node']):
-                self._process_osm_node(node)
+    def _elements(self):
+        """ Number of merged nodes, ways and relations. """
+        return len(self._all_nodes) + len(self._all_ways) + len(self._all_relations)
 
-        if 'way' in osm.keys():
-            for way in tqdm(osm['way']):
-                self._process_osm_way(way)
+    ## ------------------------------           LOADERS           ------------------------------ ##
 
-        if 'relation' in osm.keys():
-            for relation in tqdm(osm['relation']):
-                self._process_osm_relation(relation)
+    @staticmethod
+    def _merge_order(folder, order):
+        """ Pickles and stores of the folder, the ones listed in order first, then all the
+            others sorted by name. Any other file (e.g. reports and logs) is skipped. """
+        filenames = [filename for filename in os.listdir(folder)
+                     if _is_pickle(os.path.join(folder, filename)) or
+                     osmstore.is_store(os.path.join(folder, filename))]
+        order = order or []
+        for filename in order:
+            if filename not in filenames:
+                logging.warning("%s is not in the folder, skipped.", filename)
+        listed = [filename for filename in order if filename in filenames]
+        return listed + sorted([filename for filename in filenames if filename not in listed])
+
+    ## ------------------------------        NORMALIZATION        ------------------------------ ##
 
-    def _process_osm_node(self, node):
-        """ Process nodes from OSM-like file. """
+    @staticmethod
+    def _normalize_osm_node(node):
+        """ Compute the key (lat:lon:ele) and the tags of a node from OSM-like file. """
 
         lat = node['lat']
         lon = node['lon']
@@ -162,85 +187,125 @@ class MergeOSMFiles(object):
         node_name = ('{:.7f}:{:.7f}:{:.2f}'
                      .format(float(lat), float(lon), float(ele)))
 
-        self._boundaries['minlat'] = min(float(lat), self._boundaries['minlat'])
-        self._boundaries['minlon'] = min(float(lon), self._boundaries['minlon'])
-        self._boundaries['maxlat'] = max(float(lat), self._boundaries['maxlat'])
-        self._boundaries['maxlon'] = max(float(lon), self._boundaries['maxlon'])
+        return (node['id'], node_name, lat, lon, ele, tags)
+
+    @staticmethod
+    def _normalize_osm_way(way):
+        """ Extract the node references and the tags of a way from OSM-like file. """
+        refs = []
+        if 'nd' in way.keys():
+            refs = [node['ref'] for node in way['nd']]
+        tags = []
+        if 'tag' in way.keys():
+            tags = list(way['tag'])
+        return (way['id'], refs, tags)
+
+    @staticmethod
+    def _normalize_osm_relation(relation):
+        """ Extract the members and the tags of a relation from OSM-like file. """
+        members = []
+        if 'member' in relation.keys():
+            members = [(member['type'], member['ref'], member['role'])
+                       for member in relation['member']]
+        tags = []
+        if 'tag' in relation.keys():
+            tags = list(relation['tag'])
+        return (relation['id'], members, tags)
+
+    ## ------------------------------         PROCESSING          ------------------------------ ##
+
+    def _merge_osm_pickle(self, filename, normalized):
+        """ Merge the normalized nodes, ways and relations from OSM-like file. """
+        digest, boundaries, nodes, ways, relations = normalized
+        self._inputs.append((filename, digest))
+
+        self._boundaries['minlat'] = min(boundaries['minlat'], self._boundaries['minlat'])
+        self._boundaries['minlon'] = min(boundaries['minlon'], self._boundaries['minlon'])
+        self._boundaries['maxlat'] = max(boundaries['maxlat'], self._boundaries['maxlat'])
+        self._boundaries['maxlon'] = max(boundaries['maxlon'], self._boundaries['maxlon'])
+
+        for node in tqdm(nodes):
+            self._process_osm_node(node)
+
+        for way in tqdm(ways):
+            self._process_osm_way(way)
+
+        for relation in tqdm(relations):
+            self._process_osm_relation(relation)
+
+        logging.info("%s done.", filename)
+
+    def _process_osm_node(self, node):
+        """ Process normalized nodes from OSM-like file. """
+
+        node_id, node_name, lat, lon, ele, tags = node
 
         if node_name in self._all_nodes:
             ## UPDATE NODE
-            self._all_nodes[node_name]['id'].append(node['id'])
+            self._all_nodes[node_name]['id'].append(node_id)
             self._all_nodes[node_name]['tags'].extend(tags)
         else:
             ## SAVE NODE
             self._all_nodes[node_name] = {
                 'new_id': self._global_counter,
-                'id' : [node['id']],
+                'id' : [node_id],
                 'lat' : lat,
                 'lon' : lon,
                 'ele' : ele,
                 'tags' : tags,
             }
             self._global_counter += 1
-        self._nodes_mapping[node['id']] = self._all_nodes[node_name]['new_id']
+        self._nodes_mapping[node_id] = self._all_nodes[node_name]['new_id']
 
     def _process_osm_way(self, way):
-        """ Process ways from OSM-like file. """
+        """ Process normalized ways from OSM-like file. """
+
+        way_id, refs, tags = way
 
         new_way = {
-            'id': way['id'],
+            'id': way_id,
             'nds': [],
-            'tags': [],
+            'tags': tags,
         }
 
-        if 'nd' in way.keys():
-            for node in way['nd']:
-                if node['ref'] in list(self._nodes_mapping.keys()):
-                    new_way['nds'].append(self._nodes_mapping[node['ref']])
-                else:
-                    logging.debug("Dropped node %s.", node['ref'])
-
-        if 'tag' in way.keys():
-            for tag in way['tag']:
-                new_way['tags'].append(tag)
+        for ref in refs:
+            if ref in self._nodes_mapping:
+                new_way['nds'].append(self._nodes_mapping[ref])
+            else:
+                logging.debug("Dropped node %s.", ref)
 
         if new_way['nds']: # drop ways without nodes
             self._all_ways[self._global_counter] = new_way
-            self._ways_mapping[way['id']] = self._global_counter
+            self._ways_mapping[way_id] = self._global_counter
             self._global_counter += 1
 
     def _process_osm_relation(self, relation):
-        """ Process relations from OSM-like file. """
+        """ Process normalized relations from OSM-like file. """
+
+        relation_id, members, tags = relation
 
         new_rel = {
-            'id': relation['id'],
+            'id': relation_id,
             'members': [],
-            'tags': [],
+            'tags': tags,
         }
 
-        if 'member' in relation.keys():
-            for member in relation['member']:
-
-                # Public Transports
-                # <member type="node" ref="1776309882" role="stop"/>
+        for mtype, ref, role in members:
 
-                # Road Restrictions
-                # <member type="way" ref="1219" role="from"/>
-		        # <member type="way" ref="1198" role="to"/>
-		        # <member type="node" ref="-41988" role="via"/>
+            # Public Transports
+            # <member type="node" ref="1776309882" role="stop"/>
 
-                if member['type'] == 'node':
-                    if member['ref'] in list(self._nodes_mapping.keys()): # NODES
-                        new_rel['members'].append(
-                            (member['type'], self._nodes_mapping[member['ref']], member['role']))
-                if member['type'] == 'way':
-                    if member['ref'] in list(self._ways_mapping.keys()): # WAYS
-                        new_rel['members'].append(
-                            (member['type'], self._ways_mapping[member['ref']], member['role']))
+            # Road Restrictions
+            # <member type="way" ref="1219" role="from"/>
+            # <member type="way" ref="1198" role="to"/>
+            # <member type="node" ref="-41988" role="via"/>
 
-        if 'tag' in relation.keys():
-            for tag in relation['tag']:
-                new_rel['tags'].append(tag)
+            if mtype == 'node':
+                if ref in self._nodes_mapping: # NODES
+                    new_rel['members'].append((mtype, self._nodes_mapping[ref], role))
+            if mtype == 'way':
+                if ref in self._ways_mapping: # WAYS
+                    new_rel['members'].append((mtype, self._ways_mapping[ref], role))
 
         if new_rel['members']: # drop relation without members
             self._all_relations[self._global_counter] = new_rel
@@ -250,12 +315,12 @@ class MergeOSMFiles(object):
 
     @staticmethod
     def _filter_duplicates(tags):
-        """ Filter duplicate tags. """
-        set_filtered_tags = set()
+        """ Filter duplicate tags, keeping the first occurrence (and the order). """
+        filtered_tags = collections.OrderedDict()
         for tag in tags:
-            set_filtered_tags.add(tuple(tag.items()))
+            filtered_tags[tuple(tag.items())] = None
         list_filtered_tags = []
-        for item in set_filtered_tags:
+        for item in filtered_tags:
             list_filtered_tags.append(dict(item))
         return list_filtered_tags
 
@@ -278,94 +343,154 @@ class MergeOSMFiles(object):
 
     ## ------------------------------         SAVE FILE         ------------------------------ ##
 
-    def _write_all_nodes(self, filebuffer):
+    def _write_all_nodes(self, writer):
         """ Write all the nodes to OSM-like file. """
-        for _, node in self._all_nodes.items():
-            string_of_tags = ""
-            for value in node['tags']:
-                val = value['v'].replace('"', '')
-                val = val.replace('&', 'and')
-                string_of_tags += TAG_TPL.format(
-                    k_val=value['k'],
-                    v_val=val) #.encode('utf-8')
-
-            filebuffer.write(NODE_TPL.format(id=node['new_id'], lat=node['lat'],
-                                             lon=node['lon'], ele=node['ele'],
-                                             tags=string_of_tags))
-
-    def _write_all_ways(self, filebuffer):
-        """ Write all the ways to OSM-like file. """
-        for wid, way in self._all_ways.items():
-            string_of_nodes = ""
-            for nid in way['nds']:
-                string_of_nodes += ND_TPL.format(ref=nid)
-            string_of_tags = ""
-            for tag in way['tags']:
-                value = tag['v'].replace('"', '')
-                value = value.replace('&', 'and')
-                string_of_tags += TAG_TPL.format(
-                    k_val=tag['k'],
-                    v_val=value) #.encode('utf-8')
-
-            filebuffer.write(WAY_TPL.format(
-                id=wid, nds=string_of_nodes, tags=string_of_tags))
-
-    def _write_all_relations(self, filebuffer):
+        writer.write_nodes((node['new_id'], node['lat'], node['lon'], node['ele'], node['tags'])
+                           for node in self._all_nodes.values())
+
+    def _write_all_ways(self, writer):
         """ Write all the ways to OSM-like file. """
-        for rid, rel in self._all_relations.items():
-            string_of_members = ""
-            for mtype, ref, role in rel['members']:
-                string_of_members += MEMB_TPL.format(mtype=mtype, ref=ref,
-                                                     role=role)
-            string_of_tags = ""
-            for tag in rel['tags']:
-                value = tag['v'].replace('"', '')
-                value = value.replace('&', 'and')
-                string_of_tags += TAG_TPL.format(
-                    k_val=tag['k'],
-                    v_val=value) # .encode('utf-8')
-
-            filebuffer.write(REL_TPL.format(
-                id=rid, members=string_of_members, tags=string_of_tags))
+        writer.write_ways((wid, way['nds'], way['tags']) for wid, way in self._all_ways.items())
+
+    def _write_all_relations(self, writer):
+        """ Write all the relations to OSM-like file. """
+        writer.write_relations((rid, rel['members'], rel['tags'])
+                               for rid, rel in self._all_relations.items())
 
     def write_osm_file(self, filename):
-        """ Write the OSM-like file. """
+        """ Write the OSM-like file (gzip compressed if the name ends with .gz). """
 
         logging.info("Creation of %s", filename)
-        with open(filename, 'w') as outfile:
-            outfile.write(HEADER_TPL.format(
-                minlat=self._boundaries['minlat'], minlon=self._boundaries['minlon'],
-                maxlat=self._boundaries['maxlat'], maxlon=self._boundaries['maxlon']))
+        with instrumentation.phase('write', self._elements()):
+            with osmwriter.OSMWriter(filename, attributes=ELEMENT_ATTRIBUTES) as writer:
+                writer.write_header(self._boundaries)
+                self._write_all_nodes(writer)
+                self._write_all_ways(writer)
+                self._write_all_relations(writer)
+        logging.info("%s created.", filename)
 
-            self._write_all_nodes(outfile)
-            self._write_all_ways(outfile)
-            self._write_all_relations(outfile)
+    def write_manifest(self, filename, output):
+        """ Write the content-hash manifest of the merged inputs and of the output. """
 
-            outfile.write(FOOTER_TPL)
+        logging.info("Creation of %s", filename)
+        with instrumentation.phase('manifest', len(self._inputs)):
+            manifest = {
+                'inputs': [{'file': os.path.basename(fname), 'sha256': digest}
+                           for fname, digest in self._inputs],
+                'output': {'file': os.path.basename(output), 'sha256': _file_digest(output)},
+            }
+            ## single digest of the inputs, in merge order, to quickly detect any change
+            inputs_digest = hashlib.sha256()
+            for entry in manifest['inputs']:
+                inputs_digest.update('{file}:{sha256}\n'.format(**entry).encode('utf-8'))
+            manifest['digest'] = inputs_digest.hexdigest()
+
+            with open(filename, 'w') as outfile:
+                json.dump(manifest, outfile, indent=4)
         logging.info("%s created.", filename)
 
     ## ---------------------------------------------------------------------------------------- ##
 
+def _file_digest(filename):
+    """ SHA-256 of the file content. """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _is_pickle(filename):
+    """ The file starts with the opcode of a binary pickle (protocol 2 or higher). """
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'rb') as pickle_obj:
+        return pickle_obj.read(1) == pickle.PROTO
+
+def _normalize_osm_store(osm):
+    """ Normalized nodes, ways and relations of an OSM store, read from its arrays at once
+        instead of through the dicts of store['node'], .. (see the MergeOSMFiles
+        _normalize_osm_* methods). """
+    nodes = []
+    for nid, lat, lon, ele, tags in zip(osm.node_id.tolist(), osm.node_lat.tolist(),
+                                        osm.node_lon.tolist(), osm.node_ele.tolist(),
+                                        osm.tag_lists('node')):
+        ## NaN if missing
+        ele = '0.0' if ele != ele else ele
+        for tag in tags:
+            if tag['k'] == 'ele':
+                ele = tag['v']
+        nodes.append((str(nid), '{:.7f}:{:.7f}:{:.2f}'.format(lat, lon, float(ele)),
+                      lat, lon, ele, tags))
+
+    offsets = osm.way_nd_offsets.tolist()
+    refs = [str(ref) for ref in osm.way_nd_refs.tolist()]
+    ways = [(str(wid), refs[start:end], tags)
+            for wid, start, end, tags in zip(osm.way_id.tolist(), offsets[:-1], offsets[1:],
+                                             osm.tag_lists('way'))]
+
+    strings = osm.strings
+    members = [(strings[mtype], str(ref), strings[role])
+               for mtype, ref, role in zip(osm.rel_member_type.tolist(),
+                                           osm.rel_member_ref.tolist(),
+                                           osm.rel_member_role.tolist())]
+    offsets = osm.rel_member_offsets.tolist()
+    relations = [(str(rid), members[start:end], tags)
+                 for rid, start, end, tags in zip(osm.rel_id.tolist(), offsets[:-1],
+                                                  offsets[1:], osm.tag_lists('relation'))]
+    return nodes, ways, relations
+
+def _normalize_osm_pickle(filename):
+    """ Load an OSM-like pickle (or OSM store) and normalize its nodes, ways and relations.
+        Runs in the worker processes, it does not touch the merger state. """
+    boundaries = {
+        'minlat': 360.0,
+        'minlon': 360.0,
+        'maxlat': -360.0,
+        'maxlon': -360.0,
+    }
+
+    if osmstore.is_store(filename):
+        osm = osmstore.OSMStore(filename)
+        digest = osm.digest()
+        if len(osm.node_lat):
+            boundaries['minlat'] = min(float(osm.node_lat.min()), boundaries['minlat'])
+            boundaries['minlon'] = min(float(osm.node_lon.min()), boundaries['minlon'])
+            boundaries['maxlat'] = max(float(osm.node_lat.max()), boundaries['maxlat'])
+            boundaries['maxlon'] = max(float(osm.node_lon.max()), boundaries['maxlon'])
+        nodes, ways, relations = _normalize_osm_store(osm)
+        return digest, boundaries, nodes, ways, relations
+
+    with open(filename, 'rb') as pickle_obj:
+        content = pickle_obj.read()
+    digest = hashlib.sha256(content).hexdigest()
+    osm = pickle.loads(content)
+    del content
+
+    nodes = []
+    for node in osm.get('node', []):
+        nodes.append(MergeOSMFiles._normalize_osm_node(node)) # pylint: disable=W0212
+        boundaries['minlat'] = min(float(node['lat']), boundaries['minlat'])
+        boundaries['minlon'] = min(float(node['lon']), boundaries['minlon'])
+        boundaries['maxlat'] = max(float(node['lat']), boundaries['maxlat'])
+        boundaries['maxlon'] = max(float(node['lon']), boundaries['maxlon'])
+    ways = [MergeOSMFiles._normalize_osm_way(way) # pylint: disable=W0212
+            for way in osm.get('way', [])]
+    relations = [MergeOSMFiles._normalize_osm_relation(relation) # pylint: disable=W0212
+                 for relation in osm.get('relation', [])]
+
+    return digest, boundaries, nodes, ways, relations
+
 def _main():
     """ Merge OSM-like files from a directory. """
 
-    ## ========================              PROFILER              ======================== ##
-    # import cProfile, pstats, io
-    # profiler = cProfile.Profile()
-    # profiler.enable()
-    ## ========================              PROFILER              ======================== ##
-
     args = _args()
+    instrumentation.start('merge.osm.pickles', args.profile)
 
-    merger = MergeOSMFiles(args.osmdir)
-    merger.write_osm_file(args.output)
+    with MergeOSMFiles(args.osmdir, args.processes, args.order) as merger:
+        merger.write_osm_file(args.output)
+        merger.write_manifest('{}.manifest.json'.format(args.output), args.output)
 
-    ## ========================              PROFILER              ======================== ##
-    # profiler.disable()
-    # results = io.StringIO()
-    # pstats.Stats(profiler, stream=results).sort_stats('cumulative').print_stats(25)
-    # print(results.getvalue())
-    ## ========================              PROFILER              ======================== ##
+    instrumentation.write_report(args.report or '{}.report.json'.format(args.output))
 
 if __name__ == "__main__":
     _logs()
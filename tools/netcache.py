@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+""" Cache of the pre-parsed SUMO network, as used by pt.osm2sumo.py.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    A cache is a folder of NumPy arrays (.npy) plus a meta.json file:
+        edge_id, edge_length                    one entry per (non internal) edge
+        edge_lane_offsets                       CSR: the lanes of edge i, in index order, are
+                                                lane[edge_lane_offsets[i]:edge_lane_offsets[i+1]]
+        edge_succ_offsets, edge_succ            CSR: the positions of the edges connected
+                                                downstream of each edge
+        lane_length, lane_allowed               one entry per lane, the allowed vehicle classes
+                                                as a bitmask over meta['vclasses']
+        lane_shape_offsets, lane_shape          CSR: the (x, y) shape points of each lane
+    meta.json contains the SHA-256 of the net file and its location (offset and projection).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy
+import pyproj
+
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+
+def file_digest(filename):
+    """ SHA-256 of the file content. """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_cache(path):
+    """ True if the path is a network cache folder. """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, META_FILE))
+
+def write_cache(net, digest, folder):
+    """ Write the edges and lanes of a sumolib network to a cache folder. """
+    edges = net.getEdges()
+    lanes = [lane for edge in edges for lane in edge.getLanes()]
+    allowed = [lane._allowed for lane in lanes] # pylint: disable=W0212
+    vclasses = sorted(set([vclass for lane_allowed in allowed for vclass in lane_allowed]))
+    bits = {vclass: 1 << pos for pos, vclass in enumerate(vclasses)}
+    positions = {edge.getID(): pos for pos, edge in enumerate(edges)}
+    successors = [[positions[succ.getID()] for succ in edge.getOutgoing()
+                   if succ.getID() in positions] for edge in edges]
+
+    arrays = {
+        'edge_id': numpy.array([edge.getID() for edge in edges], dtype=str),
+        'edge_length': numpy.array([edge.getLength() for edge in edges], dtype=numpy.float64),
+        'edge_lane_offsets': numpy.cumsum([0] + [len(edge.getLanes()) for edge in edges],
+                                          dtype=numpy.int64),
+        'edge_succ_offsets': numpy.cumsum([0] + [len(succ) for succ in successors],
+                                          dtype=numpy.int64),
+        'edge_succ': numpy.array([pos for succ in successors for pos in succ], dtype=numpy.int64),
+        'lane_length': numpy.array([lane.getLength() for lane in lanes], dtype=numpy.float64),
+        'lane_allowed': numpy.array(
+            [sum([bits[vclass] for vclass in lane_allowed]) for lane_allowed in allowed],
+            dtype=numpy.int64),
+        'lane_shape_offsets': numpy.cumsum([0] + [len(lane.getShape()) for lane in lanes],
+                                           dtype=numpy.int64),
+        'lane_shape': numpy.array([point[:2] for lane in lanes for point in lane.getShape()],
+                                  dtype=numpy.float64).reshape(-1, 2),
+    }
+
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(folder, '{}.npy'.format(name)), array)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'digest': digest,
+        'location': {
+            'netOffset': net._location['netOffset'], # pylint: disable=W0212
+            'projParameter': net._location['projParameter'], # pylint: disable=W0212
+        },
+        'vclasses': vclasses,
+    }
+    ## written last, a cache without meta is not valid
+    with open(os.path.join(folder, META_FILE), 'w') as outfile:
+        json.dump(meta, outfile, indent=4)
+
+class CachedLane(object):
+    """ Read-only lane with the subset of the sumolib.net.lane.Lane API used by the tools. """
+
+    def __init__(self, net, edge, index, pos):
+        self._net = net
+        self._edge = edge
+        self._index = index
+        self._pos = pos
+        self._shape = None
+
+    def getID(self):
+        """ Lane ID: <edge ID>_<index> """
+        return '{}_{}'.format(self._edge.getID(), self._index)
+
+    def getEdge(self):
+        """ The edge of the lane. """
+        return self._edge
+
+    def getIndex(self):
+        """ Index of the lane in its edge. """
+        return self._index
+
+    def getLength(self):
+        """ Length of the lane. """
+        return float(self._net.lane_length[self._pos])
+
+    def getShape(self):
+        """ Shape of the lane, as list of (x, y). """
+        if self._shape is None:
+            start, end = self._net.lane_shape_offsets[self._pos:self._pos + 2]
+            self._shape = [tuple(point) for point in self._net.lane_shape[start:end].tolist()]
+        return self._shape
+
+    def allows(self, vclass):
+        """ True if the lane allows the given vehicle class. """
+        if vclass is None or vclass == 'ignoring':
+            return True
+        bit = self._net.vclass_bits.get(vclass, 0)
+        return bool(int(self._net.lane_allowed[self._pos]) & bit)
+
+class CachedEdge(object):
+    """ Read-only edge with the subset of the sumolib.net.edge.Edge API used by the tools. """
+
+    def __init__(self, net, pos):
+        self._net = net
+        self._pos = pos
+        self._id = str(net.edge_id[pos])
+        start, end = net.edge_lane_offsets[pos:pos + 2].tolist()
+        self._lanes = [CachedLane(net, self, index, lane)
+                       for index, lane in enumerate(range(start, end))]
+
+    def getID(self):
+        """ Edge ID. """
+        return self._id
+
+    def getLength(self):
+        """ Length of the edge. """
+        return float(self._net.edge_length[self._pos])
+
+    def getLanes(self):
+        """ Lanes of the edge, in index order. """
+        return self._lanes
+
+    def getOutgoing(self):
+        """ Edges connected downstream, as keys of a dict (connections are not cached). """
+        start, end = self._net.edge_succ_offsets[self._pos:self._pos + 2].tolist()
+        edges = self._net.getEdges()
+        return {edges[pos]: [] for pos in self._net.edge_succ[start:end].tolist()}
+
+    def getLane(self, index):
+        """ Lane with the given index, IndexError if it does not exist. """
+        return self._lanes[index]
+
+    def allows(self, vclass):
+        """ True if at least a lane allows the given vehicle class. """
+        for lane in self._lanes:
+            if lane.allows(vclass):
+                return True
+        return False
+
+class CachedNet(object):
+    """ Read-only network loaded from a cache folder, with the subset of the
+        sumolib.net.Net API used by the tools. """
+
+    def __init__(self, folder):
+        """ Load the arrays of the cache. """
+        with open(os.path.join(folder, META_FILE), 'r') as infile:
+            self.meta = json.load(infile)
+        if self.meta['version'] != CACHE_VERSION:
+            raise ValueError('Unsupported network cache version {} in {}.'.format(
+                self.meta['version'], folder))
+        for filename in os.listdir(folder):
+            name, extension = os.path.splitext(filename)
+            if extension == '.npy':
+                setattr(self, name, numpy.load(os.path.join(folder, filename)))
+        self.vclass_bits = {vclass: 1 << pos for pos, vclass in enumerate(self.meta['vclasses'])}
+        self._edges = [CachedEdge(self, pos) for pos in range(len(self.edge_id))]
+        self._id2edge = {edge.getID(): edge for edge in self._edges}
+        self._proj = None
+
+    def getEdges(self):
+        """ All the (non internal) edges. """
+        return self._edges
+
+    def getEdge(self, edge_id):
+        """ Edge with the given ID. """
+        return self._id2edge[edge_id]
+
+    def hasEdge(self, edge_id):
+        """ True if the edge exists. """
+        return edge_id in self._id2edge
+
+    def getLocationOffset(self):
+        """ Offset to be added after converting from geo-coordinates to UTM. """
+        return [float(value) for value in self.meta['location']['netOffset'].split(',')]
+
+    def getGeoProj(self):
+        """ The pyproj projection of the network. """
+        if self._proj is None:
+            self._proj = pyproj.Proj(projparams=self.meta['location']['projParameter'])
+        return self._proj
+
+    def convertLonLat2XY(self, lon, lat):
+        """ Network coordinates of a geo-location. """
+        x_coord, y_coord = self.getGeoProj()(lon, lat)
+        x_offset, y_offset = self.getLocationOffset()
+        return x_coord + x_offset, y_coord + y_offset
+
+    def convertXY2LonLat(self, x_coord, y_coord):
+        """ Geo-location of network coordinates. """
+        x_offset, y_offset = self.getLocationOffset()
+        return self.getGeoProj()(x_coord - x_offset, y_coord - y_offset, inverse=True)
+
+def load_net(filename, folder, reader):
+    """ Load the network from the cache folder, if it has been built from the current
+        content of the file, otherwise parse the file with reader (e.g. sumolib.net.readNet)
+        and rebuild the cache. """
+    digest = file_digest(filename)
+    if is_cache(folder):
+        with open(os.path.join(folder, META_FILE), 'r') as infile:
+            meta = json.load(infile)
+        if meta.get('version') == CACHE_VERSION and meta.get('digest') == digest:
+            logging.info('Loading the network from the cache %s', folder)
+            return CachedNet(folder)
+        logging.info('The network cache %s is outdated.', folder)
+    net = reader(filename)
+    logging.info('Building the network cache %s', folder)
+    write_cache(net, digest, folder)
+    return CachedNet(folder)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+""" Columnar, memory-mappable store for OSM-like structures.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    A store is a folder of NumPy arrays (.npy) plus a meta.json file:
+        node_id, node_lat, node_lon, node_ele   one entry per node (ele is NaN if missing)
+        way_id, way_nd_offsets, way_nd_refs     CSR: the refs of way i are
+                                                way_nd_refs[way_nd_offsets[i]:way_nd_offsets[i+1]]
+        rel_id, rel_member_offsets,             CSR: the members of relation i, with type and
+        rel_member_type, rel_member_ref,        role as indexes in the string table
+        rel_member_role
+        {node,way,rel}_tag_offsets,             CSR: the tags of each element, keys and values
+        {node,way,rel}_tag_keys,                as indexes in the string table
+        {node,way,rel}_tag_values
+        strings_blob, strings_offsets           interned string table (UTF-8)
+
+    IDs are stored as int64, the store supports only numeric OSM IDs.
+    Only id, lat, lon and ele are kept for the nodes, and only the id for ways and relations.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+
+ELEMENTS = {'node': 'node', 'way': 'way', 'relation': 'rel'}
+
+def is_store(path):
+    """ True if the path is an OSM store folder. """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, META_FILE))
+
+class StringTable(object):
+    """ Interning of strings (tags and members here, attributes and edges in routestore.py). """
+
+    def __init__(self):
+        self._index = {}
+        self.strings = []
+
+    def intern(self, string):
+        """ Return the index of the string, adding it if necessary. """
+        pos = self._index.get(string)
+        if pos is None:
+            pos = len(self.strings)
+            self._index[string] = pos
+            self.strings.append(string)
+        return pos
+
+    def arrays(self):
+        """ Return the UTF-8 blob and the offsets of the strings. """
+        encoded = [string.encode('utf-8') for string in self.strings]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(value) for value in encoded], dtype=numpy.int64)
+        blob = numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8)
+        return blob, offsets
+
+def _tags_csr(elements, table):
+    """ CSR arrays (offsets, keys, values) of the tags of the elements. """
+    offsets = numpy.zeros(len(elements) + 1, dtype=numpy.int64)
+    keys = []
+    values = []
+    for pos, element in enumerate(elements):
+        for tag in element.get('tag', []):
+            keys.append(table.intern(tag['k']))
+            values.append(table.intern(tag['v']))
+        offsets[pos + 1] = len(keys)
+    return offsets, numpy.array(keys, dtype=numpy.int32), numpy.array(values, dtype=numpy.int32)
+
+def write_store(osm, folder):
+    """ Write the OSM-like structure produced by xml2pickle.py to a store folder. """
+    os.makedirs(folder, exist_ok=True)
+    table = StringTable()
+    arrays = {}
+
+    nodes = osm.get('node', [])
+    arrays['node_id'] = numpy.array([int(node['id']) for node in nodes], dtype=numpy.int64)
+    arrays['node_lat'] = numpy.array([float(node['lat']) for node in nodes], dtype=numpy.float64)
+    arrays['node_lon'] = numpy.array([float(node['lon']) for node in nodes], dtype=numpy.float64)
+    arrays['node_ele'] = numpy.array([float(node.get('ele', 'nan')) for node in nodes],
+                                     dtype=numpy.float64)
+
+    ways = osm.get('way', [])
+    arrays['way_id'] = numpy.array([int(way['id']) for way in ways], dtype=numpy.int64)
+    offsets = numpy.zeros(len(ways) + 1, dtype=numpy.int64)
+    refs = []
+    for pos, way in enumerate(ways):
+        refs.extend([int(node['ref']) for node in way.get('nd', [])])
+        offsets[pos + 1] = len(refs)
+    arrays['way_nd_offsets'] = offsets
+    arrays['way_nd_refs'] = numpy.array(refs, dtype=numpy.int64)
+
+    relations = osm.get('relation', [])
+    arrays['rel_id'] = numpy.array([int(rel['id']) for rel in relations], dtype=numpy.int64)
+    offsets = numpy.zeros(len(relations) + 1, dtype=numpy.int64)
+    mtypes, mrefs, mroles = [], [], []
+    for pos, rel in enumerate(relations):
+        for member in rel.get('member', []):
+            mtypes.append(table.intern(member['type']))
+            mrefs.append(int(member['ref']))
+            mroles.append(table.intern(member['role']))
+        offsets[pos + 1] = len(mrefs)
+    arrays['rel_member_offsets'] = offsets
+    arrays['rel_member_type'] = numpy.array(mtypes, dtype=numpy.int32)
+    arrays['rel_member_ref'] = numpy.array(mrefs, dtype=numpy.int64)
+    arrays['rel_member_role'] = numpy.array(mroles, dtype=numpy.int32)
+
+    for element, prefix in ELEMENTS.items():
+        (arrays['{}_tag_offsets'.format(prefix)], arrays['{}_tag_keys'.format(prefix)],
+         arrays['{}_tag_values'.format(prefix)]) = _tags_csr(osm.get(element, []), table)
+
+    arrays['strings_blob'], arrays['strings_offsets'] = table.arrays()
+
+    for name, array in arrays.items():
+        numpy.save(os.path.join(folder, '{}.npy'.format(name)), array)
+
+    meta = {
+        'version': STORE_VERSION,
+        'bounds': osm.get('bounds', []),
+        'counts': {element: len(osm.get(element, [])) for element in ELEMENTS},
+    }
+    with open(os.path.join(folder, META_FILE), 'w') as outfile:
+        json.dump(meta, outfile, indent=4)
+
+class _ElementsView(object):
+    """ Read-only sequence of xml2pickle-like dicts, built on demand from the arrays. """
+
+    def __init__(self, length, builder):
+        self._length = length
+        self._builder = builder
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._builder(index) for index in range(*pos.indices(self._length))]
+        if pos < 0:
+            pos += self._length
+        if not 0 <= pos < self._length:
+            raise IndexError(pos)
+        return self._builder(pos)
+
+    def __iter__(self):
+        for pos in range(self._length):
+            yield self._builder(pos)
+
+class OSMStore(object):
+    """ Columnar OSM-like store, loaded with memory-mapped arrays.
+
+        Coordinates, IDs and references are available as NumPy arrays, tags through the
+        interned string table (string_index() and tag_lists() for all the elements at once),
+        and element() builds the dict of a single element: the tools read the arrays and
+        build dicts only for the elements they keep. For compatibility with the code written
+        for the pickles, store['node'], store['way'] and store['relation'] are sequences of
+        dicts with the same structure of the ones produced by xml2pickle.py (coordinates as
+        floats), built on each access.
+    """
+
+    def __init__(self, folder, mmap=True):
+        """ Load the arrays of the store. """
+        self.folder = folder
+        with open(os.path.join(folder, META_FILE), 'r') as infile:
+            self.meta = json.load(infile)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError('Unsupported OSM store version {} in {}.'.format(
+                self.meta['version'], folder))
+
+        mmap_mode = 'r' if mmap else None
+        for filename in os.listdir(folder):
+            name, extension = os.path.splitext(filename)
+            if extension == '.npy':
+                setattr(self, name, numpy.load(os.path.join(folder, filename),
+                                               mmap_mode=mmap_mode))
+        self._strings = None
+        self._string_index = None
+        self._overrides = {}
+
+    @property
+    def strings(self):
+        """ The interned string table, decoded on first use. """
+        if self._strings is None:
+            blob = bytes(self.strings_blob)
+            offsets = self.strings_offsets.tolist()
+            self._strings = [blob[offsets[pos]:offsets[pos+1]].decode('utf-8')
+                             for pos in range(len(offsets) - 1)]
+        return self._strings
+
+    def string_index(self, string):
+        """ Index of the string in the string table, None if the store does not contain it. """
+        if self._string_index is None:
+            self._string_index = {value: pos for pos, value in enumerate(self.strings)}
+        return self._string_index.get(string)
+
+    def digest(self):
+        """ SHA-256 of the content of the store. """
+        digest = hashlib.sha256()
+        for filename in sorted(os.listdir(self.folder)):
+            digest.update(filename.encode('utf-8'))
+            with open(os.path.join(self.folder, filename), 'rb') as infile:
+                for chunk in iter(lambda: infile.read(1 << 20), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def tags(self, element, pos):
+        """ Tags of the element ('node', 'way', 'relation') in position pos. """
+        prefix = ELEMENTS[element]
+        offsets = getattr(self, '{}_tag_offsets'.format(prefix))
+        start, end = int(offsets[pos]), int(offsets[pos + 1])
+        keys = getattr(self, '{}_tag_keys'.format(prefix))[start:end]
+        values = getattr(self, '{}_tag_values'.format(prefix))[start:end]
+        strings = self.strings
+        return [{'k': strings[key], 'v': strings[value]} for key, value in zip(keys, values)]
+
+    def tag_lists(self, element):
+        """ Tags of all the elements ('node', 'way', 'relation'), decoded at once. """
+        prefix = ELEMENTS[element]
+        offsets = getattr(self, '{}_tag_offsets'.format(prefix)).tolist()
+        strings = self.strings
+        tags = [{'k': strings[key], 'v': strings[value]} for key, value in zip(
+            getattr(self, '{}_tag_keys'.format(prefix)).tolist(),
+            getattr(self, '{}_tag_values'.format(prefix)).tolist())]
+        return [tags[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def way_refs(self, pos):
+        """ Node references of the way in position pos. """
+        return self.way_nd_refs[self.way_nd_offsets[pos]:self.way_nd_offsets[pos + 1]]
+
+    def _node(self, pos):
+        """ xml2pickle-like dict of the node in position pos. """
+        node = {
+            'id': str(self.node_id[pos]),
+            'lat': float(self.node_lat[pos]),
+            'lon': float(self.node_lon[pos]),
+        }
+        if not numpy.isnan(self.node_ele[pos]):
+            node['ele'] = float(self.node_ele[pos])
+        if self.node_tag_offsets[pos] != self.node_tag_offsets[pos + 1]:
+            node['tag'] = self.tags('node', pos)
+        return node
+
+    def _way(self, pos):
+        """ xml2pickle-like dict of the way in position pos. """
+        way = {'id': str(self.way_id[pos])}
+        refs = self.way_refs(pos)
+        if len(refs):
+            way['nd'] = [{'ref': str(ref)} for ref in refs.tolist()]
+        if self.way_tag_offsets[pos] != self.way_tag_offsets[pos + 1]:
+            way['tag'] = self.tags('way', pos)
+        return way
+
+    def _relation(self, pos):
+        """ xml2pickle-like dict of the relation in position pos. """
+        relation = {'id': str(self.rel_id[pos])}
+        start, end = int(self.rel_member_offsets[pos]), int(self.rel_member_offsets[pos + 1])
+        if start != end:
+            strings = self.strings
+            relation['member'] = [
+                {'type': strings[mtype], 'ref': str(ref), 'role': strings[role]}
+                for mtype, ref, role in zip(self.rel_member_type[start:end].tolist(),
+                                            self.rel_member_ref[start:end].tolist(),
+                                            self.rel_member_role[start:end].tolist())]
+        if self.rel_tag_offsets[pos] != self.rel_tag_offsets[pos + 1]:
+            relation['tag'] = self.tags('relation', pos)
+        return relation
+
+    def element(self, element, pos):
+        """ xml2pickle-like dict of the element ('node', 'way', 'relation') in position pos. """
+        return {'node': self._node, 'way': self._way, 'relation': self._relation}[element](pos)
+
+    ## ------------------------------      dict-like access      ------------------------------ ##
+
+    def keys(self):
+        """ Elements available, as in the xml2pickle.py dict. """
+        keys = [element for element in ELEMENTS if self.meta['counts'][element]]
+        if self.meta['bounds']:
+            keys.insert(0, 'bounds')
+        return keys
+
+    def __contains__(self, key):
+        return key in self._overrides or key in self.keys()
+
+    def __getitem__(self, key):
+        if key in self._overrides:
+            return self._overrides[key]
+        if key == 'bounds':
+            return self.meta['bounds']
+        if key == 'node':
+            return _ElementsView(len(self.node_id), self._node)
+        if key == 'way':
+            return _ElementsView(len(self.way_id), self._way)
+        if key == 'relation':
+            return _ElementsView(len(self.rel_id), self._relation)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        """ Replace a sequence of elements, in memory only. """
+        self._overrides[key] = value
+
+    def get(self, key, default=None):
+        """ dict.get() """
+        if key in self:
+            return self[key]
+        return default
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+""" Streaming, buffered writer for OSM-like XML files.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import io
+import itertools
+import re
+from xml.sax.saxutils import escape
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+PENDING_ELEMENTS = 4096
+ESCAPE_CACHE_SIZE = 100000
+
+HEADER_TPL = """<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6">
+    <bounds minlat="{minlat}" minlon="{minlon}" maxlat="{maxlat}" maxlon="{maxlon}"/>""" # pylint: disable=C0301
+
+NODE_OPEN_TPL = """
+    <node id="{id}" lat="{lat}" lon="{lon}" ele="{ele}"{attributes}> """
+
+NODE_CLOSE = """
+    </node>"""
+
+WAY_OPEN_TPL = """
+    <way id="{id}"{attributes}> """
+
+WAY_CLOSE = """
+    </way>"""
+
+REL_OPEN_TPL = """
+    <relation id="{id}"{attributes}> """
+
+REL_CLOSE = """
+    </relation>"""
+
+ND_TPL = """
+        <nd ref="{ref}"/>"""
+ND_HEAD, ND_TAIL = ND_TPL.split('{ref}')
+ND_SEPARATOR = ND_TAIL + ND_HEAD
+
+TAG_TPL = """
+        <tag k="{k_val}" v="{v_val}"/>"""
+
+MEMB_TPL = """
+        <member type="{mtype}" ref="{ref}" role="{role}"/>"""
+
+FOOTER_TPL = """
+</osm>
+"""
+
+## XML attribute values: quotes and whitespace characters must be escaped as well.
+ATTRIBUTE_ENTITIES = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+SPECIAL_CHARACTERS = re.compile('[&<>"\n\r\t]')
+
+def _positional(template, *fields):
+    """ The str.format template as a %-template of the fields, in the given order:
+        %-formatting with a tuple is about three times faster than format with keywords. """
+    template = template.replace('%', '%%')
+    for field in fields:
+        template = template.replace('{%s}' % field, '%s')
+    return template
+
+_TAG_TPL = _positional(TAG_TPL, 'k_val', 'v_val')
+_MEMB_TPL = _positional(MEMB_TPL, 'mtype', 'ref', 'role')
+
+def escape_attribute(value):
+    """ Escape a string to be used as XML attribute value (between double quotes). """
+    value = str(value)
+    if SPECIAL_CHARACTERS.search(value) is None:
+        return value
+    return escape(value, ATTRIBUTE_ENTITIES)
+
+class OSMWriter(object):
+    """ Writes an OSM-like file element by element.
+
+        Nodes, ways and relations are formatted with positional %-templates in list
+        comprehensions over blocks of PENDING_ELEMENTS elements, and each block is joined
+        and written at once through a file buffer of buffer_size bytes; most of the time
+        goes in the formatting, not in the writes. Escaped values are cached.
+        Output is gzip compressed if compress is True, or if it is None and the filename
+        ends with '.gz'. The attributes string (e.g. ' version="1"') is added to every node,
+        way and relation.
+    """
+
+    def __init__(self, filename, attributes='', compress=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 compresslevel=6):
+        """ Open the file. """
+        if compress is None:
+            compress = filename.endswith('.gz')
+        if compress:
+            self._file = io.TextIOWrapper(
+                io.BufferedWriter(gzip.open(filename, 'wb', compresslevel), buffer_size),
+                encoding='utf-8')
+        else:
+            self._file = open(filename, 'w', buffering=buffer_size, encoding='utf-8')
+        attributes = attributes.replace('%', '%%')
+        self._node_tpl = _positional(NODE_OPEN_TPL, 'id', 'lat', 'lon', 'ele').replace(
+            '{attributes}', attributes)
+        self._way_tpl = _positional(WAY_OPEN_TPL, 'id').replace('{attributes}', attributes)
+        self._rel_tpl = _positional(REL_OPEN_TPL, 'id').replace('{attributes}', attributes)
+        self._pending = []
+        ## tag keys and values repeat a lot, their escaped version is cached
+        self._escaped = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def flush(self):
+        """ Write the queued elements to the file buffer. """
+        self._file.write(''.join(self._pending))
+        self._pending = []
+
+    def _escape(self, value):
+        """ Cached escape_attribute(). """
+        escaped = self._escaped.get(value)
+        if escaped is None:
+            escaped = escape_attribute(value)
+            if len(self._escaped) < ESCAPE_CACHE_SIZE:
+                self._escaped[value] = escaped
+        return escaped
+
+    def _tags(self, tags):
+        """ XML of the tags of an element. """
+        if not tags:
+            return ''
+        cached, _escape = self._escaped.get, self._escape
+        return ''.join([_TAG_TPL % (cached(tag['k']) or _escape(tag['k']),
+                                    cached(tag['v']) or _escape(tag['v']))
+                        for tag in tags])
+
+    @staticmethod
+    def _nds(refs):
+        """ XML of the node references of a way, as a single join. """
+        if not refs:
+            return ''
+        return ND_HEAD + ND_SEPARATOR.join(map(str, refs)) + ND_TAIL
+
+    def _write_elements(self, texts):
+        """ Queue the XML of the elements, flushing every PENDING_ELEMENTS elements. """
+        pending = self._pending
+        for text in texts:
+            pending.append(text)
+            if len(pending) >= PENDING_ELEMENTS:
+                self.flush()
+                pending = self._pending
+
+    def write_header(self, boundaries):
+        """ XML declaration, osm opening element and bounds. """
+        self._write_elements([HEADER_TPL.format(
+            minlat=boundaries['minlat'], minlon=boundaries['minlon'],
+            maxlat=boundaries['maxlat'], maxlon=boundaries['maxlon'])])
+
+    def _write_blocks(self, elements, format_block):
+        """ Write the elements in blocks of PENDING_ELEMENTS, formatted by format_block(). """
+        self.flush()
+        elements = iter(elements)
+        write = self._file.write
+        block = list(itertools.islice(elements, PENDING_ELEMENTS))
+        while block:
+            write(''.join(format_block(block)))
+            block = list(itertools.islice(elements, PENDING_ELEMENTS))
+
+    def write_nodes(self, nodes):
+        """ Nodes as (id, lat, lon, ele, tags), with tags as a list of {'k': .., 'v': ..}. """
+        ## untagged nodes, the vast majority, are formatted with a single template
+        node_tpl, untagged_tpl = self._node_tpl, self._node_tpl + NODE_CLOSE
+        cached, _escape, _tags = self._escaped.get, self._escape, self._tags
+        self._write_blocks(nodes, lambda block: [
+            node_tpl % (nid, lat, lon, cached(ele) or _escape(ele)) + _tags(tags) + NODE_CLOSE
+            if tags else untagged_tpl % (nid, lat, lon, cached(ele) or _escape(ele))
+            for nid, lat, lon, ele, tags in block])
+
+    def write_ways(self, ways):
+        """ Ways as (id, node references, tags). """
+        way_tpl, _nds, _tags = self._way_tpl, self._nds, self._tags
+        self._write_blocks(ways, lambda block: [
+            ''.join([way_tpl % (wid,), _nds(refs), ' ', _tags(tags), WAY_CLOSE])
+            for wid, refs, tags in block])
+
+    def write_relations(self, relations):
+        """ Relations as (id, members, tags), with members as a list of (type, ref, role). """
+        rel_tpl, _escape, _tags = self._rel_tpl, self._escape, self._tags
+        self._write_blocks(relations, lambda block: [
+            ''.join([rel_tpl % (rid,),
+                     ''.join([_MEMB_TPL % (_escape(mtype), ref, _escape(role))
+                              for mtype, ref, role in members]),
+                     ' ', _tags(tags), REL_CLOSE])
+            for rid, members, tags in block])
+
+    def close(self):
+        """ Write the footer and close the file. """
+        self._write_elements([FOOTER_TPL])
+        self.flush()
+        self._file.close()
@@ -17,30 +17,91 @@
 
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The public transports are classified by their OSM tags with the rules in PT_TAG_RULES,
+    compiled once in a (key, value) hash table, or on the tag arrays of an OSM store; more
+    types (e.g. tram, ferry, subway) can be added to the rules, or given to the generator.
+    PublicTransportsGenerator keeps its state per instance: load(osm, net) and reset() allow
+    its reuse in a long-lived process, and leaving a with block releases inputs, indexes,
+    stops and lines. With -p N the bus and train pipelines (PT_PIPELINES) run in forked
+    processes sharing the OSM and the network loaded once, with the output files of the
+    serial run.
+
+    The network is loaded from a cache (netcache.py, by default <net>.cache) keyed by the
+    SHA-256 of the net file and rebuilt when the network changes. With --stop-tolerance M
+    the stops on the same lane whose start and end are within M meters are merged, the
+    merged IDs are kept in the comments of the additional files. The route of each line
+    connects its stops, in order, with the shortest paths on the edges allowed to its
+    vehicle class (PT_VCLASSES), memoized and shared by the lines; when two stops are not
+    connected an alert is logged and the route keeps the gap. With --no-route-completion
+    the route contains only the lanes of the stops.
 """
 
 
 import argparse
 import collections
+import heapq
 import logging
+import math
+import multiprocessing
 import os
 import pickle
 import sys
+import numpy
 import unidecode
 from tqdm import tqdm
 
+import instrumentation
+import netcache
+import osmstore
+
 # """ Import SUMOLIB """
+## optional to import the module with a stand-in network (e.g. netcache.CachedNet),
+## required to run the tool
+sumolib = None # pylint: disable=C0103
 if 'SUMO_TOOLS' in os.environ:
     sys.path.append(os.environ['SUMO_TOOLS'])
     import sumolib
-    from sumolib.miscutils import euclidean
-
-else:
-    sys.exit("Please declare environment variable 'SUMO_TOOLS'")
 
 BUS_PLATFORM_LEN = 15.0
 TRAIN_PLATFORM_LEN = 150.0
 
+GRID_CELL_SIZE = 100.0
+
+## OSM tags of the public transports, as (type, {key: [values]}) in order of precedence:
+## a node matching more than one type is a stop of the first one, a relation is a line of all.
+## More types (e.g. tram, ferry, subway) can be added, their stops and lines are classified,
+## SUMO stops and lines are generated for buses and trains.
+PT_TAG_RULES = [
+    ('bus', {
+        'bus': ['yes'],
+        'highway': ['bus_stop'],
+        'public_transport': ['stop_position', 'stop_area'],
+        'amenity': ['bus_station'],
+        'route': ['bus'],
+        'type': ['public_transport'],
+    }),
+    ('train', {
+        'railway': ['station'], #'subway_entrance'
+        'route': ['train'],
+    }),
+]
+
+## Vehicle class used to route the lines of each public transport type.
+PT_VCLASSES = {
+    'bus': 'bus',
+    'train': 'rail',
+}
+
+## Generation pipelines: type -> (generate, save) methods of PublicTransportsGenerator.
+PT_PIPELINES = collections.OrderedDict([
+    ('bus', ('generate_buses', 'save_buses_to_file')),
+    ('train', ('generate_trains', 'save_trains_to_file')),
+])
+
+## Generator inherited by the forked pipeline workers (read-only OSM and net).
+_FORKED_GENERATOR = {}
+
 ADDITIONALS_TPL = """<?xml version="1.0" encoding="UTF-8"?>
 
 <!-- Generated with Monaco SUMO Traffic (MoST) Scenario [https://github.com/lcodeca/MoSTScenario] -->
@@ -86,13 +147,30 @@ def _args():
         description='Extract STOPS and LINES from OSM public transports and a SUMO network.')
     parser.add_argument(
         '--osm', type=str, dest='osmstruct', required=True,
-        help='Pickle-OSM object.')
+        help='Pickle-OSM object or OSM store folder.')
     parser.add_argument(
         '--net', type=str, dest='netstruct', required=True,
-        help='Pickle-NET object.')
+        help='SUMO network file.')
+    parser.add_argument(
+        '--net-cache', type=str, dest='netcache', default=None,
+        help='Folder of the network cache, rebuilt when the network changes '
+             '[default: <net>.cache].')
+    parser.add_argument(
+        '--no-net-cache', dest='use_netcache', action='store_false',
+        help='Parse the network file without using the cache.')
     parser.add_argument(
         '-o', type=str, dest='output', required=True,
         help='Prefix for the output files.')
+    parser.add_argument(
+        '--stop-tolerance', type=float, dest='stop_tolerance', default=0.0,
+        help='Merge the stops on the same lane with start and end within this distance [m].')
+    parser.add_argument(
+        '--no-route-completion', dest='complete_routes', action='store_false',
+        help='Write only the lanes of the stops as route of the lines, without connecting them.')
+    parser.add_argument(
+        '-p', type=int, dest='processes', default=1,
+        help='Number of processes running the bus and train pipelines.')
+    instrumentation.add_arguments(parser)
 
     return parser.parse_args()
 
@@ -102,157 +180,443 @@ def _read_from_pickle(filename):
         obj = pickle.load(pickle_obj)
     return obj
 
+def _load_osm(filename):
+    """ Load the OSM-like structure from a pickle or from an OSM store folder. """
+    if osmstore.is_store(filename):
+        return osmstore.OSMStore(filename)
+    return _read_from_pickle(filename)
+
+def _run_pipeline(generator, pt_type, prefix):
+    """ Generate and save the stops and lines of a pipeline. """
+    generate, save = PT_PIPELINES[pt_type]
+    getattr(generator, generate)()
+    getattr(generator, save)(prefix)
+    return pt_type
+
+def _forked_pipeline(pt_type, prefix):
+    """ Run a pipeline with the generator inherited from the parent process.
+        ret: the type and the phases recorded by the worker. """
+    instrumentation.clear()
+    return _run_pipeline(_FORKED_GENERATOR['generator'], pt_type, prefix), \
+        instrumentation.records()
+
+class LaneSegmentIndex(object):
+    """ Uniform grid over the shape segments of a list of lanes.
+
+        The index is built once and answers closest-lane queries projecting the location
+        on all the candidate segments at once. Ties are resolved by lane order first,
+        then by segment order, as a linear scan over the lanes would do.
+    """
+
+    def __init__(self, lanes, cell_size=GRID_CELL_SIZE):
+        """ Insert all the shape segments of the lanes in the grid. """
+        self._lanes = lanes
+        self._cell_size = cell_size
+        self._cells = collections.defaultdict(list)
+
+        starts = []
+        ends = []
+        owners = []
+        offsets = []
+        for lane_pos, lane in enumerate(lanes):
+            shape = lane.getShape()
+            offset = 0.0
+            for pos in range(1, len(shape)):
+                prec, point = shape[pos-1], shape[pos]
+                min_cell = self._cell((min(prec[0], point[0]), min(prec[1], point[1])))
+                max_cell = self._cell((max(prec[0], point[0]), max(prec[1], point[1])))
+                for pos_x in range(min_cell[0], max_cell[0] + 1):
+                    for pos_y in range(min_cell[1], max_cell[1] + 1):
+                        self._cells[(pos_x, pos_y)].append(len(starts))
+                starts.append(prec)
+                ends.append(point)
+                owners.append(lane_pos)
+                offsets.append(offset)
+                offset += math.sqrt((point[0] - prec[0]) ** 2 + (point[1] - prec[1]) ** 2)
+
+        self._start = numpy.array(starts, dtype=float).reshape(-1, 2)
+        self._delta = numpy.array(ends, dtype=float).reshape(-1, 2) - self._start
+        self._sq_length = (self._delta ** 2).sum(axis=1)
+        self._owner = numpy.array(owners, dtype=int)
+        self._offset = numpy.array(offsets, dtype=float)
+
+        self._extent = None
+        if self._cells:
+            self._extent = (min([cell[0] for cell in self._cells]),
+                            min([cell[1] for cell in self._cells]),
+                            max([cell[0] for cell in self._cells]),
+                            max([cell[1] for cell in self._cells]))
+
+    def _cell(self, point):
+        """ Return the grid cell containing the point. """
+        return (int(math.floor(point[0] / self._cell_size)),
+                int(math.floor(point[1] / self._cell_size)))
+
+    @staticmethod
+    def _ring(center, radius):
+        """ Iterate over the cells at Chebyshev distance 'radius' from the center. """
+        if radius == 0:
+            yield center
+            return
+        for pos_x in range(center[0] - radius, center[0] + radius + 1):
+            yield (pos_x, center[1] - radius)
+            yield (pos_x, center[1] + radius)
+        for pos_y in range(center[1] - radius + 1, center[1] + radius):
+            yield (center[0] - radius, pos_y)
+            yield (center[0] + radius, pos_y)
+
+    def _project(self, coord, segments):
+        """ Project coord on the given segments, return distances and fractions. """
+        relative = numpy.array(coord, dtype=float) - self._start[segments]
+        delta = self._delta[segments]
+        sq_length = self._sq_length[segments]
+        fraction = (relative * delta).sum(axis=1) / numpy.where(sq_length > 0, sq_length, 1.0)
+        fraction = numpy.clip(fraction, 0.0, 1.0)
+        distance = numpy.sqrt(((relative - fraction[:, None] * delta) ** 2).sum(axis=1))
+        return distance, fraction
+
+    def nearest(self, coord):
+        """ Return (lane, offset, distance) of the lane closest to coord,
+            where offset is the position of the projection along the lane shape. """
+        if self._extent is None:
+            return None, None, sys.float_info.max
+
+        center = self._cell(coord)
+        max_radius = max(abs(center[0] - self._extent[0]), abs(center[1] - self._extent[1]),
+                         abs(center[0] - self._extent[2]), abs(center[1] - self._extent[3]))
+        visited = set()
+        best = None
+        for radius in range(max_radius + 1):
+            candidates = set()
+            for cell in self._ring(center, radius):
+                candidates.update(self._cells.get(cell, []))
+            candidates -= visited
+            if candidates:
+                visited |= candidates
+                segments = numpy.array(sorted(candidates), dtype=int)
+                distance, fraction = self._project(coord, segments)
+                pos = int(numpy.argmin(distance))
+                candidate = (float(distance[pos]), int(segments[pos]), float(fraction[pos]))
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+            # all the segments outside the visited rings are further than radius * cell_size
+            if best is not None and best[0] < radius * self._cell_size:
+                break
+
+        distance, segment, fraction = best
+        offset = self._offset[segment] + fraction * math.sqrt(self._sq_length[segment])
+        return self._lanes[self._owner[segment]], float(offset), distance
+
+class EdgeRouter(object):
+    """ Shortest paths between the edges allowed to a vehicle class.
+
+        The adjacency of the edges is built once in CSR form (successors of edge i are
+        successors[offsets[i]:offsets[i+1]]), the paths are computed with Dijkstra, stopping
+        at the destination, and memoized by (from, to) edges: the lines sharing a pair of
+        consecutive stops share its path.
+    """
+
+    def __init__(self, edges, vclass):
+        """ Build the adjacency of the edges allowing vclass. """
+        edges = [edge for edge in edges if edge.allows(vclass)]
+        self._ids = [edge.getID() for edge in edges]
+        self._positions = {eid: pos for pos, eid in enumerate(self._ids)}
+        self._lengths = [edge.getLength() for edge in edges]
+        self._offsets = [0]
+        self._successors = []
+        for edge in edges:
+            for succ in edge.getOutgoing():
+                if succ.getID() in self._positions:
+                    self._successors.append(self._positions[succ.getID()])
+            self._offsets.append(len(self._successors))
+        self._paths = {}
+
+    def path(self, from_edge, to_edge):
+        """ Edge IDs from from_edge to to_edge (both included), None if not connected. """
+        key = (from_edge, to_edge)
+        if key not in self._paths:
+            self._paths[key] = self._dijkstra(from_edge, to_edge)
+        return self._paths[key]
+
+    def _dijkstra(self, from_edge, to_edge):
+        """ Shortest path, the cost is the length of the edges entered. """
+        source = self._positions.get(from_edge)
+        target = self._positions.get(to_edge)
+        if source is None or target is None:
+            return None
+        offsets, successors, lengths = self._offsets, self._successors, self._lengths
+        costs = {source: 0.0}
+        previous = {}
+        heap = [(0.0, source)]
+        while heap:
+            cost, edge = heapq.heappop(heap)
+            if edge == target:
+                break
+            if cost > costs[edge]:
+                continue
+            for succ in successors[offsets[edge]:offsets[edge + 1]]:
+                succ_cost = cost + lengths[succ]
+                if succ_cost < costs.get(succ, sys.float_info.max):
+                    costs[succ] = succ_cost
+                    previous[succ] = edge
+                    heapq.heappush(heap, (succ_cost, succ))
+        else:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(previous[path[-1]])
+        return [self._ids[edge] for edge in reversed(path)]
+
+class TagClassifier(object):
+    """ Classification of OSM elements by their tags.
+
+        The rules are compiled once in a hash table from each (key, value) to the bitmask
+        of the types it belongs to, an element is classified with a lookup per tag.
+    """
+
+    def __init__(self, rules):
+        """ Compile the rules, list of (type, {key: [values]}) in order of precedence. """
+        self.types = [pt_type for pt_type, _ in rules]
+        self._masks = collections.defaultdict(int)
+        for pos, (_, tags) in enumerate(rules):
+            for key, values in tags.items():
+                for value in values:
+                    self._masks[(key, value)] |= 1 << pos
+        self._masks = dict(self._masks)
+        self._matching = dict()
+
+    def classify(self, elements):
+        """ Yield (element, mask) for all the elements matching at least one type. """
+        masks = self._masks
+        for element in elements:
+            mask = 0
+            for tag in element.get('tag', ()):
+                mask |= masks.get((tag['k'], tag['v']), 0)
+            if mask:
+                yield element, mask
+
+    def classify_store(self, store, element):
+        """ Yield (position, mask) for all the elements ('node', 'relation') of an OSM store
+            matching at least one type, computed on the tag arrays of the store. """
+        prefix = osmstore.ELEMENTS[element]
+        offsets = numpy.asarray(getattr(store, '{}_tag_offsets'.format(prefix)))
+        keys = numpy.asarray(getattr(store, '{}_tag_keys'.format(prefix)))
+        values = numpy.asarray(getattr(store, '{}_tag_values'.format(prefix)))
+        tag_masks = numpy.zeros(len(keys), dtype=numpy.int64)
+        for (key, value), mask in self._masks.items():
+            key, value = store.string_index(key), store.string_index(value)
+            if key is not None and value is not None:
+                tag_masks[(keys == key) & (values == value)] |= mask
+        ## OR of the masks of the tags of each element, the elements without tags are skipped
+        starts = offsets[:-1]
+        tagged = offsets[1:] > starts
+        masks = numpy.zeros(len(starts), dtype=numpy.int64)
+        if tagged.any():
+            masks[tagged] = numpy.bitwise_or.reduceat(tag_masks, starts[tagged])
+        for pos in numpy.flatnonzero(masks).tolist():
+            yield pos, int(masks[pos])
+
+    def first(self, mask):
+        """ The type with the highest precedence in the mask. """
+        return self.types[(mask & -mask).bit_length() - 1]
+
+    def matching(self, mask):
+        """ All the types in the mask, in order of precedence. """
+        types = self._matching.get(mask)
+        if types is None:
+            types = [pt_type for pos, pt_type in enumerate(self.types) if mask & (1 << pos)]
+            self._matching[mask] = types
+        return list(types)
+
 class PublicTransportsGenerator(object):
     """ Generates STOPS and LINES from OSM public transports and a SUMO network. """
 
-    _osm = None
-    _net = None
+    def __init__(self, osm=None, net=None, rules=None, stop_tolerance=0.0,
+                 complete_routes=True):
+        """ Initialize the public transports generator, filtering the OSM if given.
+
+            The public transports are classified with PT_TAG_RULES, or with the given rules.
+            Stops on the same lane with start and end within stop_tolerance meters are merged.
+            With complete_routes, the route of each line connects its stops with the
+            shortest paths, otherwise it contains only the lanes of the stops.
+        """
+        self._classifier = TagClassifier(rules or PT_TAG_RULES)
+        self._stop_tolerance = stop_tolerance
+        self._complete_routes = complete_routes
+        self.reset()
+        if osm is not None:
+            self.load(osm, net)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def reset(self):
+        """ Drop the inputs and all the generated stops and lines. """
+
+        self._osm = None
+        self._net = None
+
+        ## OSM stops and lines by type
+        self._osm_ptstops = {pt_type: dict() for pt_type in self._classifier.types}
+        self._osm_ptlines = {pt_type: dict() for pt_type in self._classifier.types}
+
+        ## network coordinates of the OSM stops by type, as (x, y) arrays in the order of the dicts
+        self._ptstops_xy = dict()
 
-    _osm_bus_stops = dict()
-    _osm_bus_lines = dict()
-    _osm_train_stops = dict()
-    _osm_train_lines = dict()
+        self._sumo_bus_stops = dict()
+        self._sumo_bus_lines = dict()
+        self._sumo_train_stops = dict()
+        self._sumo_train_lines = dict()
 
-    _sumo_bus_stops = dict()
-    _sumo_bus_lines = dict()
-    _sumo_train_stops = dict()
-    _sumo_train_lines = dict()
+        self._bus_index = None
+        self._railway_index = None
+        self._street_index = None
+        self._routers = dict()
 
-    def __init__(self, osm, net):
-        """ Initialize the public transports generator. """
+    def load(self, osm, net):
+        """ Filter the OSM public transports for the given network, replacing any previous one. """
 
+        self.reset()
         self._osm = osm
         self._net = net
 
         logging.info("Filtering OSM for public transports stop..")
-        self._filter_ptstops()
+        with instrumentation.phase('filter stops', len(self._osm['node'])):
+            self._filter_ptstops()
 
         logging.info("Filtering OSM for public transports lines..")
-        self._filter_ptlines()
+        with instrumentation.phase('filter lines', len(self._osm['relation'])):
+            self._filter_ptlines()
 
     def generate_buses(self):
         """ Generate the SUMO stops for buses. """
 
         logging.info("Create bus stops for SUMO..")
-        bus_stops_to_edges = self._bus_stops_to_edges()
-        self._bus_stops_for_sumo(bus_stops_to_edges)
-        self._sumo_bus_stops, bus_stop_mapping = self._unify_sumo_ptstops(self._sumo_bus_stops)
+        with instrumentation.phase('snap bus stops', len(self._osm_ptstops['bus'])):
+            bus_stops_to_edges = self._bus_stops_to_edges()
+            self._bus_stops_for_sumo(bus_stops_to_edges)
+        with instrumentation.phase('unify bus stops', len(self._sumo_bus_stops)):
+            self._sumo_bus_stops, bus_stop_mapping = self._unify_sumo_ptstops(
+                self._sumo_bus_stops, self._stop_tolerance)
 
         logging.info("Create bus lines for SUMO..")
-        self._sumo_bus_lines, self._sumo_bus_stops = self._ptlines_sumo(
-            self._osm_bus_lines, bus_stop_mapping, bus_stops_to_edges,
-            self._osm_bus_stops, self._sumo_bus_stops)
+        with instrumentation.phase('bus lines', len(self._osm_ptlines['bus'])):
+            self._sumo_bus_lines, self._sumo_bus_stops = self._ptlines_sumo(
+                self._osm_ptlines['bus'], bus_stop_mapping, bus_stops_to_edges,
+                self._osm_ptstops['bus'], self._sumo_bus_stops)
 
     def generate_trains(self):
         """ Generate the SUMO stops for trains. """
 
         logging.info("Create trains stops for SUMO..")
-        train_stops_to_edges = self._train_stops_to_edges()
-        self._train_stops_for_sumo(train_stops_to_edges)
-        self._sumo_train_stops, train_stop_mapping = self._unify_sumo_ptstops(
-            self._sumo_train_stops)
+        with instrumentation.phase('snap train stops', len(self._osm_ptstops['train'])):
+            train_stops_to_edges = self._train_stops_to_edges()
+            self._train_stops_for_sumo(train_stops_to_edges)
+        with instrumentation.phase('unify train stops', len(self._sumo_train_stops)):
+            self._sumo_train_stops, train_stop_mapping = self._unify_sumo_ptstops(
+                self._sumo_train_stops, self._stop_tolerance)
 
         logging.info("Create train lines for SUMO..")
-        self._sumo_train_lines, self._sumo_train_stops = self._ptlines_sumo(
-            self._osm_train_lines, train_stop_mapping, train_stops_to_edges,
-            self._osm_train_stops, self._sumo_train_stops)
+        with instrumentation.phase('train lines', len(self._osm_ptlines['train'])):
+            self._sumo_train_lines, self._sumo_train_stops = self._ptlines_sumo(
+                self._osm_ptlines['train'], train_stop_mapping, train_stops_to_edges,
+                self._osm_ptstops['train'], self._sumo_train_stops)
 
     def save_buses_to_file(self, prefix):
         """ Save bus STOPS and LINES to SUMO files. """
 
         logging.info("Saving bus lines and stops to files..")
-        self._save_ptstops_to_file(prefix, self._sumo_bus_stops, 'bus')
-        self._save_ptlines_to_file(prefix, self._sumo_bus_lines, 'bus')
+        with instrumentation.phase('write bus',
+                                   len(self._sumo_bus_stops) + len(self._sumo_bus_lines)):
+            self._save_ptstops_to_file(prefix, self._sumo_bus_stops, 'bus')
+            self._save_ptlines_to_file(prefix, self._sumo_bus_lines, 'bus')
 
     def save_trains_to_file(self, prefix):
         """ Save train STOPS and LINES to SUMO files. """
 
         logging.info("Saving train lines and stops to files..")
-        self._save_ptstops_to_file(prefix, self._sumo_train_stops, 'train')
-        self._save_ptlines_to_file(prefix, self._sumo_train_lines, 'train')
+        with instrumentation.phase('write train',
+                                   len(self._sumo_train_stops) + len(self._sumo_train_lines)):
+            self._save_ptstops_to_file(prefix, self._sumo_train_stops, 'train')
+            self._save_ptlines_to_file(prefix, self._sumo_train_lines, 'train')
+
+    def run_pipelines(self, prefix, processes=1, pipelines=None):
+        """ Generate and save the stops and lines of the pipelines (default: all PT_PIPELINES).
+
+            With processes > 1 the pipelines run in forked worker processes that share the
+            OSM and the network loaded by this one. The generated stops and lines are saved
+            by the workers, they are not available in this instance afterwards.
+        """
+        pipelines = pipelines or list(PT_PIPELINES)
+        if processes > 1 and len(pipelines) > 1:
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                logging.warning('Fork not available, the pipelines run serially.')
+                context = None
+            if context is not None:
+                _FORKED_GENERATOR['generator'] = self
+                try:
+                    with context.Pool(processes=min(processes, len(pipelines))) as pool:
+                        for pt_type, phases in pool.starmap(
+                                _forked_pipeline, [(pt_type, prefix) for pt_type in pipelines]):
+                            instrumentation.add_records(phases)
+                            logging.info('Pipeline %s done.', pt_type)
+                finally:
+                    del _FORKED_GENERATOR['generator']
+                return
+        for pt_type in pipelines:
+            _run_pipeline(self, pt_type, prefix)
 
     ## ---------------------------------------------------------------------------------------- ##
     ##                                       OSM Filters                                        ##
     ## ---------------------------------------------------------------------------------------- ##
 
-    @staticmethod
-    def _is_pt_train(tag):
-        """ Check if the tag matches to one of the possible public transports. """
-        pt_dict = {
-            'railway': ['station'], #'subway_entrance'
-            'route': ['train'],
-        }
-        for key, value in pt_dict.items():
-            if tag['k'] == key and tag['v'] in value:
-                return True
-        return False
-
-    @staticmethod
-    def _is_pt_bus(tag):
-        """ Check if the tag matches to one of the possible public transports. """
-        pt_dict = {
-            'bus': ['yes'],
-            'highway': ['bus_stop'],
-            'public_transport': ['stop_position', 'stop_area'],
-            'amenity': ['bus_station'],
-            'route': ['bus'],
-            'type': ['public_transport'],
-        }
-        for key, value in pt_dict.items():
-            if tag['k'] == key and tag['v'] in value:
-                return True
-        return False
+    def _classify(self, element):
+        """ Yield (element, mask) of the OSM elements matching at least one type, with a store
+            only the matching elements are built from the arrays. """
+        if isinstance(self._osm, osmstore.OSMStore):
+            for pos, mask in self._classifier.classify_store(self._osm, element):
+                yield self._osm.element(element, pos), mask
+        else:
+            yield from self._classifier.classify(tqdm(self._osm[element]))
 
     def _filter_ptstops(self):
         """ Retrieve all public transports from a OSM structure. """
 
-        for node in tqdm(self._osm['node']):
-            bus = False
-            train = False
-            if 'tag' not in list(node.keys()):
-                continue
-            for tag in node['tag']:
-                if self._is_pt_bus(tag):
-                    bus = True
-                elif self._is_pt_train(tag):
-                    train = True
-
-            if bus or train:
-                x_coord, y_coord = self._net.convertLonLat2XY(node['lon'], node['lat'])
-                node['x'] = x_coord
-                node['y'] = y_coord
-                if bus:
-                    node['pt_type'] = 'bus'
-                    self._osm_bus_stops[node['id']] = node
-                else:
-                    node['pt_type'] = 'train'
-                    self._osm_train_stops[node['id']] = node
-
-        logging.info('Gathered %d bus stops.', len(list(self._osm_bus_stops.keys())))
-        logging.info('Gathered %d train stops.', len(list(self._osm_train_stops.keys())))
+        for node, mask in self._classify('node'):
+            self._osm_ptstops[self._classifier.first(mask)][node['id']] = node
+
+        for pt_type, stops in self._osm_ptstops.items():
+            self._ptstops_xy[pt_type] = self._project_stops(stops)
+            logging.info('Gathered %d %s stops.', len(stops), pt_type)
+
+    def _project_stops(self, stops):
+        """ Network coordinates of the stops, as arrays in the same order of the dict,
+            computed with a single projection call. """
+        lon = numpy.fromiter((float(stop['lon']) for stop in stops.values()),
+                             dtype=numpy.float64, count=len(stops))
+        lat = numpy.fromiter((float(stop['lat']) for stop in stops.values()),
+                             dtype=numpy.float64, count=len(stops))
+        if not stops:
+            return lon, lat
+        x_coords, y_coords = self._net.getGeoProj()(lon, lat)
+        x_offset, y_offset = self._net.getLocationOffset()
+        return x_coords + x_offset, y_coords + y_offset
 
     def _filter_ptlines(self):
         """ Retrieve all bus lines from a OSM structure. """
 
-        for rel in tqdm(self._osm['relation']):
-            bus = False
-            train = False
-            if 'tag' not in list(rel.keys()):
-                continue
-            for tag in rel['tag']:
-                if self._is_pt_bus(tag):
-                    bus = True
-                elif self._is_pt_train(tag):
-                    train = True
-            if bus:
-                rel['pt_type'] = 'bus'
-                self._osm_bus_lines[rel['id']] = rel
-            if train:
-                rel['pt_type'] = 'train'
-                self._osm_train_lines[rel['id']] = rel
-
-        logging.info('Gathered %d bus lines.', len(list(self._osm_bus_lines.keys())))
-        logging.info('Gathered %d train lines.', len(list(self._osm_train_lines.keys())))
+        for rel, mask in self._classify('relation'):
+            for pt_type in self._classifier.matching(mask):
+                rel['pt_type'] = pt_type
+                self._osm_ptlines[pt_type][rel['id']] = rel
+
+        for pt_type, lines in self._osm_ptlines.items():
+            logging.info('Gathered %d %s lines.', len(lines), pt_type)
 
     ## ---------------------------------------------------------------------------------------- ##
     ##                               SUMO ptransports generation                                ##
@@ -261,117 +625,88 @@ class PublicTransportsGenerator(object):
     def _bus_stops_to_edges(self):
         """ Return the association stop-id to edge-id in a dictionary. """
         stops_to_edges = {}
-        for stop in tqdm(self._osm_bus_stops.values()):
-            stops_to_edges[stop['id']] = self._bus_stop_to_lane(stop)
+        x_coords, y_coords = self._ptstops_xy['bus']
+        for ptid, x_coord, y_coord in tqdm(zip(self._osm_ptstops['bus'], x_coords.tolist(),
+                                               y_coords.tolist()), total=len(x_coords)):
+            stops_to_edges[ptid] = self._bus_stop_to_lane(ptid, (x_coord, y_coord))
         return stops_to_edges
 
     def _train_stops_to_edges(self):
         """ Return the association stop-id to edge-id in a dictionary. """
         stops_to_edges = {}
-        for stop in tqdm(self._osm_train_stops.values()):
-            stops_to_edges[stop['id']] = self._train_stop_to_lane(stop)
+        x_coords, y_coords = self._ptstops_xy['train']
+        for ptid, x_coord, y_coord in tqdm(zip(self._osm_ptstops['train'], x_coords.tolist(),
+                                               y_coords.tolist()), total=len(x_coords)):
+            stops_to_edges[ptid] = self._train_stop_to_lane(ptid, (x_coord, y_coord))
         return stops_to_edges
 
-    def _bus_stop_to_lane(self, stop):
-        """ Given the coords of a bus stop, return te closest lane_0. """
+    def _bus_lanes_index(self):
+        """ Build (once) the spatial index of the lanes suitable for bus stops. """
+        if self._bus_index is None:
+            lanes = []
+            for edge in self._net.getEdges():
+                if not (edge.allows('bus') and edge.allows('pedestrian')):
+                    continue
 
-        lane_info = None
-        dist_edge = sys.float_info.max # distance.euclidean(a,b)
-        location = None
+                if edge.getLength() < (BUS_PLATFORM_LEN * 1.5):
+                    continue
 
-        for edge in self._net.getEdges():
-            if not (edge.allows('bus') and edge.allows('pedestrian')):
-                continue
+                try:
+                    lanes.append(edge.getLane(1))
+                except IndexError:
+                    lanes.append(edge.getLane(0))
+            self._bus_index = LaneSegmentIndex(lanes)
+        return self._bus_index
+
+    def _train_lanes_indexes(self):
+        """ Build (once) the spatial indexes of the railway and street lanes for train stops. """
+        if self._railway_index is None:
+            railway_lanes = []
+            street_lanes = []
+            for edge in self._net.getEdges():
+                if edge.allows('rail'):
+                    if edge.getLength() < (TRAIN_PLATFORM_LEN * 1.5):
+                        continue
+                    railway_lanes.append(edge.getLane(0))
+                elif edge.allows('pedestrian'):
+                    street_lanes.append(edge.getLane(0))
+            self._railway_index = LaneSegmentIndex(railway_lanes)
+            self._street_index = LaneSegmentIndex(street_lanes)
+        return self._railway_index, self._street_index
+
+    def _bus_stop_to_lane(self, ptid, coord):
+        """ Given the coords of a bus stop, return te closest lane_0. """
 
-            if edge.getLength() < (BUS_PLATFORM_LEN * 1.5):
-                continue
-
-            stop_lane = None
-            try:
-                stop_lane = edge.getLane(1)
-            except IndexError:
-                stop_lane = edge.getLane(0)
-
-            # compute all the distances
-            counter = 0
-            for point in stop_lane.getShape():
-                dist = euclidean((float(stop['x']), float(stop['y'])), point)
-                if dist < dist_edge:
-                    lane_info = stop_lane
-                    dist_edge = dist
-                    location = counter
-                counter += 1
+        lane_info, offset, dist_edge = self._bus_lanes_index().nearest(coord)
 
         if dist_edge > 50.0:
-            logging.info("Alert: stop %s [%s] is %d meters from lane %s.",
-                         stop['id'], stop['pt_type'], dist_edge, lane_info.getID())
+            logging.info("Alert: stop %s [bus] is %d meters from lane %s.",
+                         ptid, dist_edge, lane_info.getID())
 
-        return (lane_info, location)
+        return (lane_info, offset)
 
-    def _train_stop_to_lane(self, stop):
+    def _train_stop_to_lane(self, ptid, coord):
         """ Given the coords of a stop, return te closest lane_0 """
 
-        lane_info = None
-        dist_edge = None
-        location = None
-
-        railway_lane_info = None
-        railway_dist_edge = sys.float_info.max # distance.euclidean(a,b)
-        railway_location = None
-
-        street_lane_info = None
-        street_dist_edge = sys.float_info.max # distance.euclidean(a,b)
-        street_location = None
-
-        for edge in self._net.getEdges():
-            if edge.allows('rail'):
-                if edge.getLength() < (TRAIN_PLATFORM_LEN * 1.5):
-                    continue
-                lane_info = railway_lane_info
-                dist_edge = railway_dist_edge
-                location = railway_location
-            elif edge.allows('pedestrian'):
-                lane_info = street_lane_info
-                dist_edge = street_dist_edge
-                location = street_location
-            else:
-                continue
+        railway_index, street_index = self._train_lanes_indexes()
 
-            stop_lane = edge.getLane(0)
-
-            # compute all the distances
-            counter = 0
-            for point in stop_lane.getShape():
-                dist = euclidean((float(stop['x']), float(stop['y'])), point)
-                if dist < dist_edge:
-                    lane_info = stop_lane
-                    dist_edge = dist
-                    location = counter
-                counter += 1
-
-            if edge.allows('rail'):
-                railway_lane_info = lane_info
-                railway_dist_edge = dist_edge
-                railway_location = location
-            else:
-                street_lane_info = lane_info
-                street_dist_edge = dist_edge
-                street_location = location
+        railway_lane_info, railway_offset, railway_dist_edge = railway_index.nearest(coord)
+        street_lane_info, street_offset, street_dist_edge = street_index.nearest(coord)
 
-        railway_access = (railway_lane_info, railway_location)
+        railway_access = (railway_lane_info, railway_offset)
 
         if railway_dist_edge > 50.0:
-            logging.info("Alert: stop %s [%s] is %d meters from lane %s.",
-                         stop['id'], stop['pt_type'], railway_dist_edge, railway_lane_info.getID())
+            logging.info("Alert: stop %s [train] is %d meters from lane %s.",
+                         ptid, railway_dist_edge, railway_lane_info.getID())
 
-        street_access = (street_lane_info, street_location)
-        logging.info("Alert: Street access for stop %s [%s] is %d meters from edge %s.",
-                     stop['id'], stop['pt_type'], street_dist_edge, street_lane_info.getID())
+        street_access = (street_lane_info, street_offset)
+        logging.info("Alert: Street access for stop %s [train] is %d meters from edge %s.",
+                     ptid, street_dist_edge, street_lane_info.getID())
 
         if street_dist_edge > 500.0:
             street_access = None
             logging.info(
-                "Alert: Street access for stop %s too far and it will be removed.", stop['id'])
+                "Alert: Street access for stop %s too far and it will be removed.", ptid)
 
         return (railway_access, street_access)
 
@@ -385,33 +720,16 @@ class PublicTransportsGenerator(object):
 
     def _bus_stops_for_sumo(self, stops_to_edges):
         """ Compute the bus stops location for SUMO. """
-        for ptid, (lane, location) in tqdm(stops_to_edges.items()):
+        for ptid, (lane, offset) in tqdm(stops_to_edges.items()):
             new_pt = {
                 'id': ptid,
-                'name': self._get_stop_name(self._osm_bus_stops[ptid]),
-                'pt_type': self._osm_bus_stops[ptid]['pt_type'],
+                'name': self._get_stop_name(self._osm_ptstops['bus'][ptid]),
+                'pt_type': 'bus',
                 'lane': lane.getID(),
             }
 
-            _start = - BUS_PLATFORM_LEN/2
-            _end = BUS_PLATFORM_LEN/2
-
-            _prec = None
-            _counter = 0
-
-            for point in lane.getShape():
-                if _prec is None:
-                    _prec = point
-                    _counter += 1
-                    continue
-                if _counter <= location:
-                    dist = euclidean(_prec, point)
-                    _start += dist
-                    _end += dist
-                    _prec = point
-                    _counter += 1
-                else:
-                    break
+            _start = offset - BUS_PLATFORM_LEN/2
+            _end = offset + BUS_PLATFORM_LEN/2
 
             if _start < 5.0:
                 _start = 5.0
@@ -431,34 +749,18 @@ class PublicTransportsGenerator(object):
 
             railway_access, street_access = values
 
-            railway_lane_info, railway_location = railway_access
+            railway_lane_info, railway_offset = railway_access
 
             new_pt = {
                 'id': ptid,
-                'name': self._get_stop_name(self._osm_train_stops[ptid]),
-                'pt_type': self._osm_train_stops[ptid]['pt_type'],
+                'name': self._get_stop_name(self._osm_ptstops['train'][ptid]),
+                'pt_type': 'train',
                 'lane': railway_lane_info.getID(),
             }
 
             ### Compute the position for the railway
-            _start = - TRAIN_PLATFORM_LEN/2
-            _end = TRAIN_PLATFORM_LEN/2
-
-            _prec = None
-            _counter = 0
-            for point in railway_lane_info.getShape():
-                if _prec is None:
-                    _prec = point
-                    _counter += 1
-                    continue
-                if _counter <= railway_location:
-                    dist = euclidean(_prec, point)
-                    _start += dist
-                    _end += dist
-                    _prec = point
-                    _counter += 1
-                else:
-                    break
+            _start = railway_offset - TRAIN_PLATFORM_LEN/2
+            _end = railway_offset + TRAIN_PLATFORM_LEN/2
 
             if _start < 5.0:
                 _start = 5.0
@@ -473,31 +775,15 @@ class PublicTransportsGenerator(object):
             new_pt['start'] = _start
             new_pt['end'] = _end
 
-            street_lane_info, street_location = (None, None)
+            street_lane_info, street_offset = (None, None)
 
             if street_access:
-                street_lane_info, street_location = street_access
+                street_lane_info, street_offset = street_access
                 new_pt['access'] = {'lane': street_lane_info.getID()}
 
                 ### Compute the position for the street
-                _start = - TRAIN_PLATFORM_LEN/2
-                _end = TRAIN_PLATFORM_LEN/2
-
-                _prec = None
-                _counter = 0
-                for point in street_lane_info.getShape():
-                    if _prec is None:
-                        _prec = point
-                        _counter += 1
-                        continue
-                    if _counter <= street_location:
-                        dist = euclidean(_prec, point)
-                        _start += dist
-                        _end += dist
-                        _prec = point
-                        _counter += 1
-                    else:
-                        break
+                _start = street_offset - TRAIN_PLATFORM_LEN/2
+                _end = street_offset + TRAIN_PLATFORM_LEN/2
 
                 if _start < 5.0:
                     _start = 5.0
@@ -514,18 +800,37 @@ class PublicTransportsGenerator(object):
             self._sumo_train_stops[ptid] = new_pt
 
     @staticmethod
-    def _unify_sumo_ptstops(stops):
-        """ Merge and discard overlapping ptstops. """
+    def _unify_sumo_ptstops(stops, tolerance=0.0):
+        """ Merge and discard overlapping ptstops.
+
+            Stops on the same lane are merged when both their start and end are within
+            tolerance (meters) from the ones of the first stop of the group, with a sweep
+            over the stops of each lane sorted by position. Each group is represented by its
+            first stop in input order. With tolerance 0 only identical stops are merged.
+        """
 
         stop_mapping = {}
 
-        stops_to_merge = collections.defaultdict(list)
-        for stop in stops.values():
-            new_name = '{}_{}_{}'.format(stop['lane'], stop['start'], stop['end'])
-            stops_to_merge[new_name].append(stop['id'])
+        stops_by_lane = collections.defaultdict(list)
+        for pos, stop in enumerate(stops.values()):
+            stops_by_lane[stop['lane']].append((stop['start'], stop['end'], pos, stop['id']))
+
+        stops_to_merge = []
+        for lane_stops in stops_by_lane.values():
+            lane_stops.sort()
+            anchor = None
+            for start, end, pos, sid in lane_stops:
+                if (anchor is None or start - anchor[0] > tolerance or
+                        abs(end - anchor[1]) > tolerance):
+                    anchor = (start, end)
+                    stops_to_merge.append([])
+                stops_to_merge[-1].append((pos, sid))
+        ## groups and stops in each group in input order
+        stops_to_merge = [[sid for _, sid in sorted(group)]
+                          for group in sorted(stops_to_merge, key=min)]
 
         merged_stops = {}
-        for ids in stops_to_merge.values():
+        for ids in stops_to_merge:
             merged_id = ''
             merged_names = []
             for sid in ids:
@@ -573,21 +878,51 @@ class PublicTransportsGenerator(object):
                 'stops': [],
                 'substitutions': [],
             }
+            stop_lanes = []
             for member in line['member']:
-                if member['ref'] in list(mapping.keys()):
+                if member['ref'] in mapping:
                     if line['pt_type'] == 'train':
-                        new_line['route'].append(stops_to_edges[member['ref']][0][0].getID())
+                        stop_lanes.append(stops_to_edges[member['ref']][0][0])
                     else:
-                        new_line['route'].append(stops_to_edges[member['ref']][0].getID())
+                        stop_lanes.append(stops_to_edges[member['ref']][0])
                     new_line['stops'].append((mapping[member['ref']],
                                               self._get_stop_name(stops[mapping[member['ref']]])))
                     sumo_stops[mapping[member['ref']]]['lines'].append(new_line['line'])
                     if mapping[member['ref']] != member['ref']:
                         new_line['substitutions'].append('{}:{}'.format(member['ref'],
                                                                         mapping[member['ref']]))
+            if self._complete_routes:
+                new_line['route'] = self._complete_route(
+                    line_id, self._router(line['pt_type']),
+                    [lane.getEdge().getID() for lane in stop_lanes])
+            else:
+                new_line['route'] = [lane.getID() for lane in stop_lanes]
             sumo_lines[line_id] = new_line
         return sumo_lines, sumo_stops
 
+    def _router(self, pt_type):
+        """ Build (once) the router of the edges allowed to the public transport type. """
+        if pt_type not in self._routers:
+            self._routers[pt_type] = EdgeRouter(self._net.getEdges(), PT_VCLASSES[pt_type])
+        return self._routers[pt_type]
+
+    @staticmethod
+    def _complete_route(line_id, router, stop_edges):
+        """ Connect the edges of the stops, in order, with the shortest paths. """
+        route = []
+        for edge in stop_edges:
+            if not route:
+                route.append(edge)
+            elif route[-1] != edge:
+                path = router.path(route[-1], edge)
+                if path is None:
+                    logging.info("Alert: line %s, no path from edge %s to edge %s.",
+                                 line_id, route[-1], edge)
+                    route.append(edge)
+                else:
+                    route.extend(path[1:])
+        return route
+
     ## ---------------------------------------------------------------------------------------- ##
     ##                             Save SUMO Additionals to File                                ##
     ## ---------------------------------------------------------------------------------------- #
@@ -654,18 +989,29 @@ class PublicTransportsGenerator(object):
 def _main():
     """ Extract STOPS and LINES from OSM public transports and a SUMO network. """
 
+    if sumolib is None:
+        sys.exit("Please declare environment variable 'SUMO_TOOLS'")
     args = _args()
+    instrumentation.start('pt.osm2sumo', args.profile)
     logging.info('Loading from %s..', args.osmstruct)
-    osm = _read_from_pickle(args.osmstruct)
+    with instrumentation.phase('load osm') as phase:
+        osm = _load_osm(args.osmstruct)
+        phase.count = len(osm['node']) + len(osm['relation'])
     logging.info('Loading from %s..', args.netstruct)
-    net = sumolib.net.readNet(args.netstruct)
-
-    ptransports = PublicTransportsGenerator(osm, net)
-    ptransports.generate_buses()
-    ptransports.save_buses_to_file(args.output)
-    ptransports.generate_trains()
-    ptransports.save_trains_to_file(args.output)
-
+    with instrumentation.phase('load net') as phase:
+        if args.use_netcache:
+            net = netcache.load_net(args.netstruct,
+                                    args.netcache or '{}.cache'.format(args.netstruct),
+                                    sumolib.net.readNet)
+        else:
+            net = sumolib.net.readNet(args.netstruct)
+        phase.count = len(net.getEdges())
+
+    with PublicTransportsGenerator(osm, net, stop_tolerance=args.stop_tolerance,
+                                   complete_routes=args.complete_routes) as ptransports:
+        ptransports.run_pipelines(args.output, args.processes)
+
+    instrumentation.write_report(args.report or '{}report.json'.format(args.output))
     logging.info('Done.')
 
 if __name__ == "__main__":
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+
+""" Columnar store of the vehicle routes of a SUMO route file.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    A store is a folder of NumPy arrays (.npy) plus a meta.json file:
+        vehicle_id, vehicle_type                one entry per vehicle, as indexes in the
+                                                string table
+        vehicle_depart                          one entry per vehicle, in seconds
+        vehicle_attr_offsets,                   CSR: the other attributes of each vehicle
+        vehicle_attr_keys, vehicle_attr_values  (departLane, arrivalPos, ..) in file order
+        route_offsets, route_edges              CSR: the edges of the route of vehicle i are
+                                                route_edges[route_offsets[i]:route_offsets[i+1]]
+                                                as indexes in the edge dictionary
+        child_offsets, child_tag                CSR: the children of each vehicle other than
+                                                its route (e.g. stop), in file order
+        child_attr_offsets,                     CSR: the attributes of each child
+        child_attr_keys, child_attr_values
+        strings_blob, strings_offsets           interned string table (UTF-8)
+        edges_blob, edges_offsets               edge dictionary (UTF-8)
+
+    Only <vehicle> elements with an embedded <route edges=".."> and a numeric depart are
+    supported, any other top-level element is skipped with a warning.
+
+    Usage:
+        routestore.py -i most.commercial.rou.xml -o most.commercial.store
+        routestore.py -i most.commercial.store -o window.rou.xml --begin 28800 --end 32400
+        routestore.py -i most.commercial.store -o taz.rou.xml \
+            --taz-file out/taz/most.complete.taz.xml --from-taz 1 --shift -14400
+"""
+
+import argparse
+import array
+import json
+import logging
+import os
+import sys
+
+import numpy
+
+import instrumentation
+import osmstore
+import xml2pickle
+from osmwriter import escape_attribute
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+
+## attributes of the vehicle stored in their own columns
+VEHICLE_COLUMNS = ('id', 'type', 'depart')
+
+PENDING_VEHICLES = 4096
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+
+<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">""" # pylint: disable=C0301
+
+VEHICLE_OPEN_TPL = """
+    <vehicle id="{id}"{type} depart="{depart}"{attributes}>
+        <route edges="{edges}"/>"""
+
+CHILD_TPL = """
+        <{tag}{attributes}/>"""
+
+VEHICLE_CLOSE = """
+    </vehicle>"""
+
+FOOTER = """
+</routes>
+"""
+
+def _logs():
+    """ Log init. """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(handlers=[stdout_handler], level=logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Convert a SUMO route file into a columnar route store, or write the '
+                    '(filtered) routes of a store back to a SUMO route file.')
+    parser.add_argument(
+        '-i', type=str, dest='input', required=True,
+        help='SUMO route file (converted into a store) or route store folder.')
+    parser.add_argument(
+        '-o', type=str, dest='output', required=True,
+        help='Route store folder or, with a store as input, SUMO route file.')
+    parser.add_argument(
+        '--begin', type=float, dest='begin', default=None,
+        help='Keep only the vehicles departing at or after this time [s].')
+    parser.add_argument(
+        '--end', type=float, dest='end', default=None,
+        help='Keep only the vehicles departing before this time [s].')
+    parser.add_argument(
+        '--types', type=str, nargs='+', dest='types', default=None,
+        help='Keep only the vehicles of these types.')
+    parser.add_argument(
+        '--taz-file', type=str, dest='taz_file', default=None,
+        help='SUMO TAZ file, required by --from-taz and --to-taz.')
+    parser.add_argument(
+        '--from-taz', type=str, nargs='+', dest='from_taz', default=None,
+        help='Keep only the vehicles departing from an edge of these TAZ.')
+    parser.add_argument(
+        '--to-taz', type=str, nargs='+', dest='to_taz', default=None,
+        help='Keep only the vehicles arriving on an edge of these TAZ.')
+    parser.add_argument(
+        '--shift', type=float, dest='shift', default=0.0,
+        help='Time shift [s] added to the departures of the written vehicles.')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def is_store(path):
+    """ True if the path is a route store folder. """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, META_FILE))
+
+def _decode(blob, offsets):
+    """ List of the strings in the UTF-8 blob. """
+    blob = bytes(blob)
+    offsets = offsets.tolist()
+    return [blob[offsets[pos]:offsets[pos+1]].decode('utf-8') for pos in range(len(offsets) - 1)]
+
+def _attributes_csr(attributes, offsets, keys, values, table):
+    """ Append the (key, value) attributes to the CSR arrays. """
+    for key, value in attributes:
+        keys.append(table.intern(key))
+        values.append(table.intern(value))
+    offsets.append(len(keys))
+
+def write_store(route_file, folder):
+    """ Stream the vehicles of the SUMO route file into a store folder.
+        ret: number of vehicles stored. """
+    os.makedirs(folder, exist_ok=True)
+    table = osmstore.StringTable()
+    edges = osmstore.StringTable()
+
+    vehicle_id, vehicle_type = array.array('i'), array.array('i')
+    vehicle_depart = array.array('d')
+    attr_offsets, attr_keys, attr_values = array.array('q', [0]), array.array('i'), array.array('i')
+    route_offsets, route_edges = array.array('q', [0]), array.array('i')
+    child_offsets, child_tag = array.array('q', [0]), array.array('i')
+    cattr_offsets, cattr_keys, cattr_values = (array.array('q', [0]), array.array('i'),
+                                               array.array('i'))
+    skipped = {}
+
+    for element in xml2pickle.iterparse_elements(route_file):
+        route = element.find('route')
+        if element.tag != 'vehicle' or route is None or 'edges' not in route.attrib:
+            skipped[element.tag] = skipped.get(element.tag, 0) + 1
+            continue
+        try:
+            vehicle_depart.append(float(element.attrib['depart']))
+        except ValueError:
+            raise ValueError('Vehicle {} in {}: only numeric departures are supported.'.format(
+                element.attrib['id'], route_file))
+        vehicle_id.append(table.intern(element.attrib['id']))
+        vehicle_type.append(table.intern(element.attrib.get('type', '')))
+        _attributes_csr([(key, value) for key, value in element.attrib.items()
+                         if key not in VEHICLE_COLUMNS],
+                        attr_offsets, attr_keys, attr_values, table)
+        route_edges.extend([edges.intern(edge) for edge in route.attrib['edges'].split()])
+        route_offsets.append(len(route_edges))
+        for child in element:
+            if child is route:
+                continue
+            child_tag.append(table.intern(child.tag))
+            _attributes_csr(child.attrib.items(), cattr_offsets, cattr_keys, cattr_values, table)
+        child_offsets.append(len(child_tag))
+
+    for tag, count in skipped.items():
+        logging.warning('Skipped %d <%s> elements of %s: only vehicles with an embedded route '
+                        'are stored.', count, tag, route_file)
+
+    arrays = {
+        'vehicle_id': numpy.array(vehicle_id, dtype=numpy.int32),
+        'vehicle_type': numpy.array(vehicle_type, dtype=numpy.int32),
+        'vehicle_depart': numpy.array(vehicle_depart, dtype=numpy.float64),
+        'vehicle_attr_offsets': numpy.array(attr_offsets, dtype=numpy.int64),
+        'vehicle_attr_keys': numpy.array(attr_keys, dtype=numpy.int32),
+        'vehicle_attr_values': numpy.array(attr_values, dtype=numpy.int32),
+        'route_offsets': numpy.array(route_offsets, dtype=numpy.int64),
+        'route_edges': numpy.array(route_edges, dtype=numpy.int32),
+        'child_offsets': numpy.array(child_offsets, dtype=numpy.int64),
+        'child_tag': numpy.array(child_tag, dtype=numpy.int32),
+        'child_attr_offsets': numpy.array(cattr_offsets, dtype=numpy.int64),
+        'child_attr_keys': numpy.array(cattr_keys, dtype=numpy.int32),
+        'child_attr_values': numpy.array(cattr_values, dtype=numpy.int32),
+    }
+    arrays['strings_blob'], arrays['strings_offsets'] = table.arrays()
+    arrays['edges_blob'], arrays['edges_offsets'] = edges.arrays()
+
+    for name, values in arrays.items():
+        numpy.save(os.path.join(folder, '{}.npy'.format(name)), values)
+
+    meta = {
+        'version': STORE_VERSION,
+        'source': os.path.abspath(route_file),
+        'counts': {
+            'vehicles': len(vehicle_depart),
+            'edges': len(edges.strings),
+            'route_edges': len(route_edges),
+        },
+    }
+    with open(os.path.join(folder, META_FILE), 'w') as outfile:
+        json.dump(meta, outfile, indent=4)
+    return len(vehicle_depart)
+
+def taz_edges(taz_file, taz_ids):
+    """ Edges of the given TAZ, from the edges attribute or the tazSource/tazSink children. """
+    taz_ids = set(taz_ids)
+    edges = set()
+    for element in xml2pickle.iterparse_elements(taz_file):
+        if element.tag != 'taz' or element.attrib.get('id') not in taz_ids:
+            continue
+        taz_ids.discard(element.attrib['id'])
+        edges.update(element.attrib.get('edges', '').split())
+        edges.update([child.attrib['id'] for child in element
+                      if child.tag in ('tazSource', 'tazSink')])
+    if taz_ids:
+        logging.warning('TAZ %s not found in %s.', ', '.join(sorted(taz_ids)), taz_file)
+    return edges
+
+def format_time(value):
+    """ Time as integer when possible, as in the original route files. """
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class RouteStore(object):
+    """ Columnar route store, loaded with memory-mapped arrays.
+
+        The selections (time window, types, origin and destination edges) are computed on
+        the arrays and return the positions of the vehicles, that can be written back to a
+        SUMO route file with write_routes().
+    """
+
+    def __init__(self, folder, mmap=True):
+        """ Load the arrays of the store. """
+        self.folder = folder
+        with open(os.path.join(folder, META_FILE), 'r') as infile:
+            self.meta = json.load(infile)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError('Unsupported route store version {} in {}.'.format(
+                self.meta['version'], folder))
+
+        mmap_mode = 'r' if mmap else None
+        for filename in os.listdir(folder):
+            name, extension = os.path.splitext(filename)
+            if extension == '.npy':
+                setattr(self, name, numpy.load(os.path.join(folder, filename),
+                                               mmap_mode=mmap_mode))
+        self._strings = None
+        self._edges = None
+
+    def __len__(self):
+        return len(self.vehicle_depart)
+
+    @property
+    def strings(self):
+        """ The interned string table, decoded on first use. """
+        if self._strings is None:
+            self._strings = _decode(self.strings_blob, self.strings_offsets)
+        return self._strings
+
+    @property
+    def edges(self):
+        """ The edge dictionary, decoded on first use. """
+        if self._edges is None:
+            self._edges = _decode(self.edges_blob, self.edges_offsets)
+        return self._edges
+
+    def edge_indexes(self, edges):
+        """ Indexes in the edge dictionary of the given edges, unknown edges are ignored. """
+        edges = set(edges)
+        return numpy.array([pos for pos, edge in enumerate(self.edges) if edge in edges],
+                           dtype=numpy.int32)
+
+    def route(self, pos):
+        """ Edges of the route of the vehicle in position pos. """
+        edges = self.edges
+        start, end = int(self.route_offsets[pos]), int(self.route_offsets[pos + 1])
+        return [edges[edge] for edge in self.route_edges[start:end].tolist()]
+
+    def origins(self):
+        """ Edge index of the first edge of each route (-1 for empty routes). """
+        offsets = numpy.asarray(self.route_offsets)
+        origins = numpy.full(len(self), -1, dtype=numpy.int32)
+        valid = offsets[1:] > offsets[:-1]
+        origins[valid] = self.route_edges[offsets[:-1][valid]]
+        return origins
+
+    def destinations(self):
+        """ Edge index of the last edge of each route (-1 for empty routes). """
+        offsets = numpy.asarray(self.route_offsets)
+        destinations = numpy.full(len(self), -1, dtype=numpy.int32)
+        valid = offsets[1:] > offsets[:-1]
+        destinations[valid] = self.route_edges[offsets[1:][valid] - 1]
+        return destinations
+
+    def select(self, begin=None, end=None, types=None, from_edges=None, to_edges=None):
+        """ Positions of the vehicles departing in [begin, end), of the given types, with
+            the route starting in from_edges and ending in to_edges (all optional). """
+        mask = numpy.ones(len(self), dtype=bool)
+        if begin is not None:
+            mask &= self.vehicle_depart >= begin
+        if end is not None:
+            mask &= self.vehicle_depart < end
+        if types is not None:
+            types = set(types)
+            indexes = [pos for pos, string in enumerate(self.strings) if string in types]
+            mask &= numpy.isin(self.vehicle_type, indexes)
+        if from_edges is not None:
+            mask &= numpy.isin(self.origins(), self.edge_indexes(from_edges))
+        if to_edges is not None:
+            mask &= numpy.isin(self.destinations(), self.edge_indexes(to_edges))
+        return numpy.flatnonzero(mask)
+
+    def _attributes(self, offsets, keys, values, pos):
+        """ XML of the attributes in position pos of a CSR attribute table. """
+        start, end = int(offsets[pos]), int(offsets[pos + 1])
+        if start == end:
+            return ''
+        strings = self.strings
+        return ''.join([' {}="{}"'.format(strings[key], escape_attribute(strings[value]))
+                        for key, value in zip(keys[start:end].tolist(),
+                                              values[start:end].tolist())])
+
+    def _vehicle(self, pos, edges, shift):
+        """ XML of the vehicle in position pos, with its route and children. """
+        strings = self.strings
+        vtype = strings[self.vehicle_type[pos]]
+        route = ' '.join([edges[edge] for edge in self.route_edges[
+            int(self.route_offsets[pos]):int(self.route_offsets[pos + 1])].tolist()])
+        text = [VEHICLE_OPEN_TPL.format(
+            id=escape_attribute(strings[self.vehicle_id[pos]]),
+            ## without a type, SUMO uses its default one
+            type=' type="{}"'.format(escape_attribute(vtype)) if vtype else '',
+            depart=format_time(float(self.vehicle_depart[pos]) + shift),
+            attributes=self._attributes(self.vehicle_attr_offsets, self.vehicle_attr_keys,
+                                        self.vehicle_attr_values, pos),
+            edges=route)]
+        for child in range(int(self.child_offsets[pos]), int(self.child_offsets[pos + 1])):
+            text.append(CHILD_TPL.format(
+                tag=strings[self.child_tag[child]],
+                attributes=self._attributes(self.child_attr_offsets, self.child_attr_keys,
+                                            self.child_attr_values, child)))
+        text.append(VEHICLE_CLOSE)
+        return ''.join(text)
+
+    def write_routes(self, filename, positions=None, shift=0.0):
+        """ Stream the vehicles in the given positions (default: all) to a SUMO route file,
+            with the departures shifted by shift seconds.
+            ret: number of vehicles written. """
+        if positions is None:
+            positions = range(len(self))
+        ## the edge IDs are escaped once, routes are joins of the escaped strings
+        edges = [escape_attribute(edge) for edge in self.edges]
+        written = 0
+        with open(filename, 'w', encoding='utf-8') as outfile:
+            outfile.write(HEADER)
+            pending = []
+            for pos in positions:
+                pending.append(self._vehicle(int(pos), edges, shift))
+                if len(pending) >= PENDING_VEHICLES:
+                    outfile.write(''.join(pending))
+                    written += len(pending)
+                    pending = []
+            outfile.write(''.join(pending))
+            written += len(pending)
+            outfile.write(FOOTER)
+        return written
+
+def _main():
+    """ Convert a SUMO route file into a route store, or write the routes of a store. """
+    args = _args()
+    instrumentation.start('routestore', args.profile)
+
+    if not is_store(args.input):
+        logging.info('Storing %s into %s', args.input, args.output)
+        with instrumentation.phase('store') as phase:
+            phase.count = write_store(args.input, args.output)
+        logging.info('%d vehicles stored.', phase.count)
+        instrumentation.write_report(
+            args.report or '{}.report.json'.format(args.output.rstrip(os.sep)))
+        return
+
+    if (args.from_taz or args.to_taz) and not args.taz_file:
+        sys.exit('--from-taz and --to-taz require --taz-file.')
+    with instrumentation.phase('load') as phase:
+        store = RouteStore(args.input)
+        phase.count = len(store)
+    with instrumentation.phase('select') as phase:
+        selection = store.select(
+            begin=args.begin, end=args.end, types=args.types,
+            from_edges=taz_edges(args.taz_file, args.from_taz) if args.from_taz else None,
+            to_edges=taz_edges(args.taz_file, args.to_taz) if args.to_taz else None)
+        phase.count = len(selection)
+    logging.info('%d of %d vehicles selected.', len(selection), len(store))
+    with instrumentation.phase('write', len(selection)):
+        store.write_routes(args.output, selection, args.shift)
+    instrumentation.write_report(args.report or '{}.report.json'.format(args.output))
+    logging.info('Done.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
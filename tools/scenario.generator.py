@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+""" Incremental, content-addressed generation of the MoST Scenario.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Each stage (netconvert, polyconvert, pickles, public transports, flows, parkings,
+    rerouters, TAZ, activitygen and the test simulation) has its inputs and outputs: the
+    inputs are hashed (the python stages include the modules imported by their scripts)
+    and the outputs are stored in a local cache (.cache), as hardlinks of the files in out.
+    Only the stages whose inputs changed are executed again, the others are restored from
+    the cache, and independent stages run in parallel (-j N).
+"""
+
+import argparse
+import ast
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+if 'SUMO_TOOLS' in os.environ:
+    SUMO_TOOLS = os.environ['SUMO_TOOLS']
+else:
+    sys.exit("Please declare environment variable 'SUMO_TOOLS'")
+
+OUTPUT = 'out'
+INTERVAL = ['-b', '0', '-e', '86400']
+VTYPES = '../scenario/in/add/basic.vType.xml'
+
+NET = os.path.join(OUTPUT, 'most.net.xml')
+BUS_STOPS = os.path.join(OUTPUT, 'most.busstops.add.xml')
+BUS_LINES = os.path.join(OUTPUT, 'most.buslines.add.xml')
+TRAIN_STOPS = os.path.join(OUTPUT, 'most.trainstops.add.xml')
+TRAIN_LINES = os.path.join(OUTPUT, 'most.trainlines.add.xml')
+BUS_FLOWS = os.path.join(OUTPUT, 'most.buses.flows.xml')
+TRAIN_FLOWS = os.path.join(OUTPUT, 'most.trains.flows.xml')
+PARKINGS = os.path.join(OUTPUT, 'most.parking.add.xml')
+REROUTERS = os.path.join(OUTPUT, 'most.rerouters.add.xml')
+TAZ = os.path.join(OUTPUT, 'taz', 'most.complete.taz.xml')
+TAZ_WEIGHTS = os.path.join(OUTPUT, 'taz', 'most.complete.taz.weight.csv')
+BUILDINGS = os.path.join(OUTPUT, 'taz', 'buildings')
+ROUTES = [os.path.join(OUTPUT, 'most.{}.rou.xml'.format(name))
+          for name in ['3to1', '2to1', '1to2', '1to1']]
+
+NET_TYPEMAPS = ['typemap/osmNetconvert.typ.xml', 'typemap/osmNetconvertUrbanDe.typ.xml',
+                'typemap/osmNetconvertPedestrians.typ.xml', 'typemap/osmNetconvertBicycle.typ.xml',
+                'typemap/osmBidiRailNetconvert.typ.xml']
+
+def _logs():
+    """ Log init. """
+    file_handler = logging.FileHandler(filename='{}.log'.format(sys.argv[0]),
+                                       mode='w')
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    handlers = [file_handler, stdout_handler]
+    logging.basicConfig(handlers=handlers, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options] [stage ...]',
+        description='Incremental, content-addressed generation of the MoST Scenario.')
+    parser.add_argument(
+        'stages', type=str, nargs='*',
+        help='Stages to build, with their dependencies (default: all).')
+    parser.add_argument(
+        '--cache', type=str, dest='cache', default='.cache',
+        help='Cache directory.')
+    parser.add_argument(
+        '-j', type=int, dest='processes', default=os.cpu_count(),
+        help='Number of independent stages run in parallel.')
+    parser.add_argument(
+        '--force', dest='force', action='store_true',
+        help='Ignore the cache and run all the requested stages.')
+    parser.add_argument(
+        '--list', dest='list', action='store_true',
+        help='List the stages and exit.')
+    return parser.parse_args()
+
+def _strip_zero_index(filename):
+    """ Remove ':0' from the file, as 'sed -e s/:0//g' does. """
+    with open(filename, 'r') as infile:
+        content = infile.read()
+    with open(filename, 'w') as outfile:
+        outfile.write(content.replace(':0', ''))
+
+class Stage(object):
+    """ A step of the generation, with the files it reads and the ones it writes.
+
+        Each command is either a list of arguments for an external process or a
+        functools.partial of a python function. Outputs can be files or directories.
+    """
+
+    def __init__(self, name, inputs, outputs, commands):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.commands = commands
+
+    def key(self):
+        """ Content hash of the inputs and of the commands of the stage. """
+        digest = hashlib.sha256()
+        for command in self.commands:
+            if callable(command):
+                digest.update('{} {} {}'.format(command.func.__name__, command.args,
+                                                command.keywords).encode('utf-8'))
+            else:
+                digest.update(' '.join(command).encode('utf-8'))
+        for path in self.inputs:
+            digest.update(path.encode('utf-8'))
+            digest.update(_path_digest(path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def run(self):
+        """ Execute all the commands of the stage. """
+        for command in self.commands:
+            if callable(command):
+                command()
+            else:
+                subprocess.run(command, check=True)
+
+def _path_digest(path):
+    """ SHA-256 of a file, or of all the files (and their names) in a directory. """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                fname = os.path.join(root, filename)
+                digest.update(os.path.relpath(fname, path).encode('utf-8'))
+                digest.update(_path_digest(fname).encode('utf-8'))
+    else:
+        with open(path, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _remove(path):
+    """ Remove a file or a directory, if it exists. """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def _link(source, destination):
+    """ Hardlink the file, copy it if the link is not possible (e.g. across file systems). """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def _link_tree(source, destination):
+    """ Hardlink a file or all the files of a directory, replacing the destination.
+        The cache and the outputs share the files, which are never modified in place:
+        the outputs of a stage are removed before running it. """
+    _remove(destination)
+    dirname = os.path.dirname(destination)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, copy_function=_link)
+    else:
+        _link(source, destination)
+
+def _script(script):
+    """ The python script with the modules of the tools folder it imports, recursively,
+        so that a change to any of them invalidates the stage. """
+    folder = os.path.dirname(script)
+    files = [script]
+    for filename in files:
+        with open(filename, 'r') as infile:
+            tree = ast.parse(infile.read(), filename)
+        for node in ast.walk(tree):
+            names = []
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            for name in names:
+                module = os.path.join(folder, '{}.py'.format(name.split('.')[0]))
+                if os.path.isfile(module) and module not in files:
+                    files.append(module)
+    return files
+
+def most_stages():
+    """ The stages of tools/scenario.generator.sh, in the same order. """
+    python = sys.executable
+    saga = os.path.join(SUMO_TOOLS, 'contributed', 'saga')
+    ptlines2flows = os.path.join(SUMO_TOOLS, 'ptlines2flows.py')
+    return [
+        Stage('network', ['most.netcfg', 'most.raw.osm'] + NET_TYPEMAPS, [NET], [
+            ['netconvert', '-c', 'most.netcfg', '--output-prefix', OUTPUT + '/most.']]),
+        Stage('polygons', ['most.polycfg', 'most.raw.osm', NET, 'typemap/osmPolyconvert.typ.xml'],
+              [os.path.join(OUTPUT, 'most.poly.xml')], [
+                  ['polyconvert', '-c', 'most.polycfg', '--net-file', NET,
+                   '--output-prefix', OUTPUT + '/most.']]),
+        Stage('osm-pickle', _script('xml2pickle.py') + ['most.raw.osm'],
+              [os.path.join(OUTPUT, 'osm.pkl')], [
+                  [python, 'xml2pickle.py', '-i', 'most.raw.osm', '-o', OUTPUT + '/osm.pkl']]),
+        Stage('net-pickle', _script('xml2pickle.py') + [NET], [os.path.join(OUTPUT, 'net.pkl')], [
+            [python, 'xml2pickle.py', '-i', NET, '-o', OUTPUT + '/net.pkl']]),
+        Stage('public-transports',
+              _script('pt.osm2sumo.py') + [os.path.join(OUTPUT, 'osm.pkl'), NET],
+              [BUS_STOPS, BUS_LINES, TRAIN_STOPS, TRAIN_LINES], [
+                  [python, 'pt.osm2sumo.py', '--osm', OUTPUT + '/osm.pkl', '--net', NET,
+                   '-o', OUTPUT + '/most.']]),
+        Stage('bus-flows', [ptlines2flows, NET, BUS_STOPS, BUS_LINES], [BUS_FLOWS], [
+            [python, ptlines2flows, '-n', NET] + INTERVAL + [
+                '-p', '900', '--random-begin', '--seed', '42', '--no-vtypes',
+                '--ptstops', BUS_STOPS, '--ptlines', BUS_LINES, '-o', BUS_FLOWS],
+            functools.partial(_strip_zero_index, BUS_FLOWS)]),
+        Stage('train-flows', [ptlines2flows, NET, TRAIN_STOPS, TRAIN_LINES], [TRAIN_FLOWS], [
+            [python, ptlines2flows, '-n', NET] + INTERVAL + [
+                '-p', '1200', '-d', '300', '--random-begin', '--seed', '42', '--no-vtypes',
+                '--ptstops', TRAIN_STOPS, '--ptlines', TRAIN_LINES, '-o', TRAIN_FLOWS],
+            functools.partial(_strip_zero_index, TRAIN_FLOWS)]),
+        Stage('parkings', [os.path.join(saga, 'generateParkingAreasFromOSM.py'),
+                           'most.raw.osm', NET], [PARKINGS], [
+                               [python, os.path.join(saga, 'generateParkingAreasFromOSM.py'),
+                                '--osm', 'most.raw.osm', '--net', NET, '--out', PARKINGS]]),
+        Stage('rerouters', [os.path.join(SUMO_TOOLS, 'generateParkingAreaRerouters.py'),
+                            NET, PARKINGS], [REROUTERS], [
+                                [python, os.path.join(SUMO_TOOLS,
+                                                      'generateParkingAreaRerouters.py'),
+                                 '--processes', '4', '-n', NET, '-a', PARKINGS,
+                                 '--max-number-alternatives', '15',
+                                 '--min-capacity-visibility-true', '50', '-o', REROUTERS,
+                                 '--tqdm']]),
+        Stage('taz', [os.path.join(saga, 'generateTAZBuildingsFromOSM.py'), 'most.raw.osm', NET],
+              [TAZ, TAZ_WEIGHTS, BUILDINGS], [
+                  functools.partial(os.makedirs, BUILDINGS, exist_ok=True),
+                  [python, os.path.join(saga, 'generateTAZBuildingsFromOSM.py'),
+                   '--processes', '2', '--osm', 'most.raw.osm', '--net', NET,
+                   '--taz-output', TAZ, '--weight-output', TAZ_WEIGHTS,
+                   '--poly-output', os.path.join(BUILDINGS, 'most.poly.weight')]]),
+        Stage('activitygen', [os.path.join(saga, 'activitygen.py'), 'most.activitygen.json',
+                              'duarouter.sumocfg', NET, PARKINGS, TAZ, TAZ_WEIGHTS, BUILDINGS,
+                              BUS_FLOWS, TRAIN_FLOWS, BUS_STOPS, TRAIN_STOPS, VTYPES], ROUTES, [
+                                  [python, os.path.join(saga, 'activitygen.py'),
+                                   '-c', 'most.activitygen.json']]),
+        Stage('simulation', ['most.test.sumocfg', NET, BUS_FLOWS, TRAIN_FLOWS, BUS_STOPS,
+                             TRAIN_STOPS, PARKINGS, REROUTERS, VTYPES] + ROUTES,
+              [os.path.join(OUTPUT, 'res')], [
+                  functools.partial(os.makedirs, os.path.join(OUTPUT, 'res'), exist_ok=True),
+                  ['sumo', '-c', 'most.test.sumocfg']]),
+    ]
+
+class Pipeline(object):
+    """ Runs the stages in dependency order, in parallel when independent, and
+        skips the ones whose inputs did not change since a cached run. """
+
+    def __init__(self, stages, cache, force=False):
+        self._stages = {stage.name: stage for stage in stages}
+        self._cache = cache
+        self._force = force
+        self._producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                self._producers[output] = stage.name
+
+    def dependencies(self, name):
+        """ Stages producing the inputs of the given stage. """
+        return sorted(set([self._producers[path] for path in self._stages[name].inputs
+                           if path in self._producers]))
+
+    def _closure(self, targets):
+        """ The targets with all their (transitive) dependencies. """
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in needed:
+                continue
+            if name not in self._stages:
+                raise ValueError('Unknown stage {}.'.format(name))
+            needed.add(name)
+            pending.extend(self.dependencies(name))
+        return needed
+
+    def _build(self, name):
+        """ Restore the stage outputs from the cache, or run it and cache them. """
+        stage = self._stages[name]
+        key = stage.key()
+        entry = os.path.join(self._cache, name, key)
+
+        if not self._force and os.path.isdir(entry):
+            logging.info('--> %s: unchanged, restored from cache.', name)
+            for pos, output in enumerate(stage.outputs):
+                _link_tree(os.path.join(entry, str(pos)), output)
+            return False
+
+        logging.info('--> %s: running..', name)
+        ## new files, the previous ones may be shared with the cache
+        for output in stage.outputs:
+            _remove(output)
+        stage.run()
+
+        tmp_entry = entry + '.tmp'
+        if os.path.isdir(tmp_entry):
+            shutil.rmtree(tmp_entry)
+        os.makedirs(tmp_entry)
+        for pos, output in enumerate(stage.outputs):
+            _link_tree(output, os.path.join(tmp_entry, str(pos)))
+        with open(os.path.join(tmp_entry, 'stage.json'), 'w') as outfile:
+            json.dump({'stage': name, 'inputs': stage.inputs, 'outputs': stage.outputs},
+                      outfile, indent=4)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.rename(tmp_entry, entry)
+        logging.info('--> %s: done.', name)
+        return True
+
+    def run(self, targets=None, processes=1):
+        """ Build the targets (default: all the stages), return the stages executed. """
+        needed = self._closure(targets or list(self._stages.keys()))
+        done = set()
+        executed = []
+        futures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(processes, 1)) as pool:
+            while needed or futures:
+                ## stages are submitted in declaration order, as soon as they are ready
+                for name in list(self._stages.keys()):
+                    if name in needed and all([dep in done for dep in self.dependencies(name)]):
+                        needed.remove(name)
+                        futures[pool.submit(self._build, name)] = name
+                finished, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = futures.pop(future)
+                    if future.result():
+                        executed.append(name)
+                    done.add(name)
+        return executed
+
+def _main():
+    """ Incremental, content-addressed generation of the MoST Scenario. """
+
+    args = _args()
+    pipeline = Pipeline(most_stages(), args.cache, args.force)
+
+    if args.list:
+        for stage in most_stages():
+            print('{:20s} <- {}'.format(stage.name, ', '.join(pipeline.dependencies(stage.name))))
+        return
+
+    os.makedirs(OUTPUT, exist_ok=True)
+    executed = pipeline.run(args.stages, args.processes)
+    logging.info('Done, %d stages executed: %s', len(executed), ' '.join(executed))
+
+if __name__ == "__main__":
+    _logs()
+    _main()
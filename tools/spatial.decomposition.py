@@ -0,0 +1,1048 @@
+#!/usr/bin/env python3
+
+""" Spatial decomposition of the MoST simulation in regions run in parallel.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    The steps, all in the output folder:
+        - partition: each TAZ is the seed of a region, the edges not in any TAZ join the
+          region of the closest TAZ edge (Dijkstra on the length, in both directions), and
+          the smallest regions are merged with the neighbour sharing most connections until
+          --regions are left (partition.json);
+        - networks: netconvert keeps the edges of each region (<region>/net.xml), or the
+          whole network is used with --full-net;
+        - routes: the routes of the vehicles and flows are cut at the region boundaries,
+          each piece is a vehicle (or flow) <id>.part<k> departing at the free-flow time of
+          its first edge, plus the time spent at the stops before it (duration or until);
+          flows and trips with from and to are routed on the fastest path for the vClass
+          of their type, in the regions and in the monolithic reference. Stops follow
+          the piece with their edge, and the additional files keep only the elements of
+          the region (<region>/routes.rou.xml, <region>/*.add.xml);
+        - runs: the regions run in parallel (see batch.runner.py), and then, with
+          --reference, the monolithic simulation alone (results.csv), all without
+          rerouting; the monolithic run loads only the vehicles and flows that are
+          decomposed (monolithic/<k>.<route file>), the dropped ones are reported in
+          decomposition.json;
+        - merge: the tripinfo of the pieces are merged into the trips of the original
+          vehicles (merged.tripinfo.xml);
+        - boundary flows: the crossings of the region boundaries in the monolithic run
+          (vehroute exit times) are compared with the ones of the decomposed run, the
+          arrival from the upstream region (outflow) and the insertion in the downstream
+          one (inflow), per boundary connection and interval (boundary.flows.csv), with the
+          speedup in decomposition.json.
+    Persons and vehicles without a numeric departure are not decomposed.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree
+
+import instrumentation
+import routestore
+import xml2pickle
+from toolloader import load_tool
+
+# """ Import SUMOLIB """
+if 'SUMO_TOOLS' in os.environ:
+    sys.path.append(os.environ['SUMO_TOOLS'])
+    import sumolib
+
+else:
+    sys.exit("Please declare environment variable 'SUMO_TOOLS'")
+
+PIECE_TPL = '{}.part{}'
+## <vehicle>.part<k> and <flow>.part<k>.<n>, as <vehicle> and <flow>.<n>
+VEHICLE_PIECE_RE = re.compile(r'^(.*)\.part(\d+)$')
+FLOW_PIECE_RE = re.compile(r'^(.*)\.part(\d+)\.(\d+)$')
+
+## vClass of the vehicles without a type or vClass (SUMO DEFAULT_VEHTYPE)
+DEFAULT_VCLASS = 'passenger'
+
+STOPPING_PLACES = ('busStop', 'trainStop', 'parkingArea', 'containerStop', 'chargingStation')
+
+## options of every run: the outputs used to merge the trips and to measure the boundary
+## flows, and no rerouting, the pieces must stay in their region (with --full-net as well)
+## and the monolithic reference must drive the same routes
+RUN_OPTIONS = collections.OrderedDict([
+    (('routing', 'device.rerouting.probability'), '0'),
+    (('output', 'tripinfo-output'), 'tripinfo.xml'),
+    (('output', 'tripinfo-output.write-unfinished'), 'true'),
+    (('output', 'vehroute-output'), 'vehroute.xml'),
+    (('output', 'vehroute-output.exit-times'), 'true'),
+    (('output', 'vehroute-output.write-unfinished'), 'true'),
+])
+
+## additionals on a sequence of consecutive lanes, dropped if any of them is cut out
+CONTINUOUS_LANES = ('laneAreaDetector', 'e2Detector')
+## rerouter entries naming their edge (or lane) in the id
+REROUTE_EDGES = ('closingReroute', 'destProbReroute')
+REROUTE_LANES = ('closingLaneReroute',)
+## additionals dropped without children of each group of tags, e.g. the E3 detectors
+## without entries or without exits
+CONTAINERS = {
+    'rerouter': ['interval'],
+    'interval': ['closingReroute|closingLaneReroute|destProbReroute|routeProbReroute|'
+                 'parkingAreaReroute'],
+    'entryExitDetector': ['detEntry', 'detExit'],
+    'e3Detector': ['detEntry', 'detExit'],
+}
+
+BOUNDARY_COLUMNS = ['from_edge', 'to_edge', 'from_region', 'to_region', 'begin', 'end',
+                    'monolithic', 'outflow', 'inflow']
+
+BATCH = load_tool('batch.runner.py')
+
+def _logs():
+    """ Log init. """
+    file_handler = logging.FileHandler(filename='{}.log'.format(sys.argv[0]),
+                                       mode='w')
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    handlers = [file_handler, stdout_handler]
+    logging.basicConfig(handlers=handlers, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+def _args():
+    """ Argument Parser
+    ret: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='{}'.format(sys.argv[0]), usage='%(prog)s [options]',
+        description='Decompose the simulation in regions seeded by the TAZ, run them in '
+                    'parallel and measure the boundary flow error.')
+    parser.add_argument(
+        '-c', type=str, dest='sumocfg', required=True,
+        help='SUMO configuration of the complete scenario (e.g. scenario/most.sumocfg).')
+    parser.add_argument(
+        '--taz', type=str, dest='taz', default=os.path.join('out', 'taz', 'most.complete.taz.xml'),
+        help='TAZ file, the seeds of the regions.')
+    parser.add_argument(
+        '-n', type=str, dest='net', default=None,
+        help='SUMO network [default: the one of the configuration].')
+    parser.add_argument(
+        '-o', type=str, dest='output', default='decomposition',
+        help='Output folder, with a sub-folder for each region.')
+    parser.add_argument(
+        '--regions', type=int, dest='regions', default=None,
+        help='Number of regions, merging the smallest ones [default: one for each TAZ].')
+    parser.add_argument(
+        '--full-net', dest='full_net', action='store_true',
+        help='Run each region on the whole network, without netconvert.')
+    parser.add_argument(
+        '--netconvert', type=str, dest='netconvert', default=BATCH.sumo_binary('netconvert'),
+        help='netconvert binary.')
+    parser.add_argument(
+        '--sumo', type=str, dest='sumo', default=BATCH.sumo_binary(),
+        help='SUMO binary (or any executable accepting -c <config>).')
+    parser.add_argument(
+        '--seed', type=int, dest='seed', default=42,
+        help='Seed of the runs.')
+    parser.add_argument(
+        '-j', type=int, dest='processes', default=None,
+        help='Number of parallel runs [default: from the cores and the free memory].')
+    parser.add_argument(
+        '--memory-per-run', type=float, dest='memory', default=1024.0,
+        help='Memory [MB] required by each region, to size the pool.')
+    parser.add_argument(
+        '--timeout', type=float, dest='timeout', default=None,
+        help='Wall time [s] after which a run is killed.')
+    parser.add_argument(
+        '--reference', dest='reference', action='store_true',
+        help='Run also the monolithic simulation and compare the boundary flows.')
+    parser.add_argument(
+        '--interval', type=float, dest='interval', default=900.0,
+        help='Aggregation interval [s] of the boundary flows.')
+    parser.add_argument(
+        '--no-run', dest='run', action='store_false',
+        help='Prepare the regions without running them.')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def _lane_edge(lane):
+    """ Edge of a lane ID. """
+    return lane.rsplit('_', 1)[0]
+
+def _float(value, default=None):
+    """ Numeric value, default if missing or not numeric. """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def read_taz(taz_file):
+    """ Edges of each TAZ, in file order. """
+    taz = collections.OrderedDict()
+    for element in xml2pickle.iterparse_elements(taz_file):
+        if element.tag != 'taz':
+            continue
+        edges = element.get('edges', '').split()
+        edges.extend([child.get('id') for child in element
+                      if child.tag in ('tazSource', 'tazSink')])
+        taz[element.get('id')] = edges
+    return taz
+
+## ---------------------------------------------------------------------------------------- ##
+##                                       Partition                                           ##
+## ---------------------------------------------------------------------------------------- ##
+
+class Partition(object):
+    """ Assignment of the edges of the network to regions seeded by the TAZ. """
+
+    def __init__(self, net, taz):
+        self.length = {}
+        self._neighbours = collections.defaultdict(set)
+        self._links = []
+        for edge in net.getEdges():
+            edge_id = edge.getID()
+            self.length[edge_id] = edge.getLength()
+            for succ in edge.getOutgoing():
+                self._links.append((edge_id, succ.getID()))
+                self._neighbours[edge_id].add(succ.getID())
+                self._neighbours[succ.getID()].add(edge_id)
+        self.region = {}
+        self.seeds = collections.OrderedDict()
+        self._seed(taz)
+        self._grow()
+
+    def _seed(self, taz):
+        """ The edges of each TAZ, to its region (the first TAZ of an edge wins). """
+        unknown = 0
+        shared = 0
+        for taz_id, edges in taz.items():
+            name = 'r{}'.format(taz_id)
+            self.seeds[name] = [taz_id]
+            for edge in edges:
+                if edge not in self.length:
+                    unknown += 1
+                elif edge in self.region:
+                    shared += 1
+                else:
+                    self.region[edge] = name
+        if unknown:
+            logging.warning('%d TAZ edges are not in the network.', unknown)
+        if shared:
+            logging.info('%d edges are in more than one TAZ, the first one is used.', shared)
+        for name in list(self.seeds):
+            if name not in set(self.region.values()):
+                logging.warning('Region %s has no edges in the network, it is dropped.', name)
+                del self.seeds[name]
+        if not self.seeds:
+            sys.exit('None of the TAZ edges is in the network.')
+
+    def _grow(self):
+        """ The other edges join the region of the closest seeded edge. """
+        distance = {edge: 0.0 for edge in self.region}
+        queue = [(0.0, edge) for edge in sorted(self.region)]
+        heapq.heapify(queue)
+        while queue:
+            dist, edge = heapq.heappop(queue)
+            if dist > distance[edge]:
+                continue
+            for neighbour in self._neighbours[edge]:
+                candidate = dist + self.length[neighbour]
+                if candidate < distance.get(neighbour, float('inf')):
+                    distance[neighbour] = candidate
+                    self.region[neighbour] = self.region[edge]
+                    heapq.heappush(queue, (candidate, neighbour))
+        isolated = [edge for edge in sorted(self.length) if edge not in self.region]
+        if isolated:
+            ## not connected to any TAZ, no vehicle can reach them from the rest of the network
+            largest = max(self.regions().items(), key=lambda item: len(item[1]))[0]
+            logging.warning('%d edges are not connected to any TAZ, they go to %s.',
+                            len(isolated), largest)
+            for edge in isolated:
+                self.region[edge] = largest
+
+    def regions(self):
+        """ Edges of each region. """
+        regions = collections.OrderedDict([(name, set()) for name in self.seeds])
+        for edge, name in self.region.items():
+            regions[name].add(edge)
+        return regions
+
+    def boundary(self):
+        """ Connections between edges of different regions, with their number per pair. """
+        return collections.Counter([(self.region[from_edge], self.region[to_edge])
+                                    for from_edge, to_edge in self._links
+                                    if self.region[from_edge] != self.region[to_edge]])
+
+    def merge(self, count):
+        """ Merge the smallest region (by length) with the neighbour sharing most
+            connections, until count regions are left. """
+        while len(self.seeds) > max(count, 1):
+            lengths = collections.Counter()
+            for edge, name in self.region.items():
+                lengths[name] += self.length[edge]
+            smallest = min(self.seeds, key=lambda name: (lengths[name], name))
+            shared = collections.Counter()
+            for (from_region, to_region), links in self.boundary().items():
+                if smallest in (from_region, to_region):
+                    shared[to_region if from_region == smallest else from_region] += links
+            if shared:
+                target = max(shared, key=lambda name: (shared[name], name))
+            else:
+                target = min([name for name in self.seeds if name != smallest],
+                             key=lambda name: (lengths[name], name))
+            logging.debug('Region %s merged into %s.', smallest, target)
+            for edge, name in self.region.items():
+                if name == smallest:
+                    self.region[edge] = target
+            self.seeds[target].extend(self.seeds.pop(smallest))
+
+    def to_dict(self):
+        """ JSON-friendly summary of the partition. """
+        boundary = self.boundary()
+        return {
+            'regions': collections.OrderedDict([
+                (name, {
+                    'taz': self.seeds[name],
+                    'edges': len(edges),
+                    'length_km': round(sum([self.length[edge] for edge in edges]) / 1000, 3),
+                    'boundary_connections': sum([links for pair, links in boundary.items()
+                                                 if name in pair]),
+                }) for name, edges in self.regions().items()]),
+            'boundary_connections': sum(boundary.values()),
+        }
+
+## ---------------------------------------------------------------------------------------- ##
+##                                       Routes                                              ##
+## ---------------------------------------------------------------------------------------- ##
+
+class RouteCutter(object):
+    """ Cuts the routes of the vehicles and flows at the region boundaries. """
+
+    def __init__(self, net, partition, stopping_places):
+        self._net = net
+        self._region = partition.region
+        self._travel_time = {edge.getID(): edge.getLength() / max(edge.getSpeed(), 0.1)
+                             for edge in net.getEdges()}
+        self._stopping_places = stopping_places
+        self._routes = {}
+        self._paths = {}
+        ## vType or vTypeDistribution: vClasses of its vehicles
+        self._vclasses = {}
+        ## region: definitions (vTypes, ..) and [(time, sequence, XML)] of the pieces
+        self.definitions = collections.defaultdict(list)
+        self.pieces = collections.defaultdict(list)
+        ## original id: number of pieces, for the vehicles (and flows) that are cut
+        self.cut = {}
+        self.counts = collections.Counter()
+
+    def _define(self, element):
+        """ Record the vClasses of a vType or of the members of a vTypeDistribution. """
+        if element.tag == 'vType':
+            self._vclasses[element.get('id')] = [element.get('vClass', DEFAULT_VCLASS)]
+            return
+        vclasses = []
+        for vtype in element.iter('vType'):
+            self._vclasses[vtype.get('id')] = [vtype.get('vClass', DEFAULT_VCLASS)]
+            vclasses.append(vtype.get('vClass', DEFAULT_VCLASS))
+        for vtype in element.get('vTypes', '').split():
+            vclasses.extend(self._vclasses.get(vtype, [DEFAULT_VCLASS]))
+        self._vclasses[element.get('id')] = list(
+            collections.OrderedDict.fromkeys(vclasses)) or [DEFAULT_VCLASS]
+
+    def _path(self, from_edge, to_edge, vtype):
+        """ Memoized fastest path between two edges for the vClasses of the type, None if
+            not connected. With a distribution, the first path allowed to all its vClasses
+            is used, or the one of the first vClass. """
+        vclasses = tuple(self._vclasses.get(vtype, [DEFAULT_VCLASS]))
+        key = (from_edge, to_edge, vclasses)
+        if key not in self._paths:
+            path = None
+            if from_edge in self._region and to_edge in self._region:
+                for vclass in vclasses:
+                    edges, _ = self._net.getOptimalPath(
+                        self._net.getEdge(from_edge), self._net.getEdge(to_edge),
+                        fastest=True, vClass=vclass)
+                    if not edges:
+                        continue
+                    if path is None:
+                        path = [edge.getID() for edge in edges]
+                    if all(edge.allows(other) for edge in edges for other in vclasses):
+                        path = [edge.getID() for edge in edges]
+                        break
+            self._paths[key] = path
+        return self._paths[key]
+
+    @staticmethod
+    def _dwell(stop, arrival):
+        """ Time spent at the stop by a vehicle arriving at the given time. """
+        dwell = _float(stop.get('duration'), 0.0)
+        until = _float(stop.get('until'))
+        if until is not None:
+            dwell = max(dwell, until - arrival)
+        return dwell
+
+    def _split(self, edges, stops, positions, depart):
+        """ Pieces of the route as (region, start, end, offset of the start), the offset is
+            the free-flow travel time plus the time spent at the stops before the start. """
+        stops_at = collections.defaultdict(list)
+        for stop, pos in zip(stops, positions):
+            if pos is not None:
+                stops_at[pos].append(stop)
+        pieces = []
+        offset = 0.0
+        for pos, edge in enumerate(edges):
+            region = self._region[edge]
+            if not pieces or pieces[-1][0] != region:
+                pieces.append([region, pos, pos + 1, offset])
+            else:
+                pieces[-1][2] = pos + 1
+            offset += self._travel_time[edge]
+            for stop in stops_at[pos]:
+                offset += self._dwell(stop, depart + offset)
+            offset = round(offset, 2)
+        return pieces
+
+    def _stop_edge(self, stop):
+        """ Edge of a stop, None if unknown. """
+        if stop.get('lane') is not None:
+            return _lane_edge(stop.get('lane'))
+        if stop.get('edge') is not None:
+            return stop.get('edge')
+        for place in STOPPING_PLACES:
+            if stop.get(place) is not None:
+                return self._stopping_places.get(stop.get(place))
+        return None
+
+    def _stop_positions(self, stops, edges):
+        """ Position in the route of the edge of each stop, None if not found. """
+        positions = []
+        pos = 0
+        for stop in stops:
+            try:
+                pos = edges.index(self._stop_edge(stop), pos)
+            except ValueError:
+                self.counts['stops not on the route'] += 1
+                positions.append(None)
+                continue
+            positions.append(pos)
+        return positions
+
+    @staticmethod
+    def _assign_stops(positions, pieces):
+        """ Index of the piece of each stop, the last one if the stop is not on the route. """
+        return [len(pieces) - 1 if pos is None else
+                [piece for piece, (_, start, end, _) in enumerate(pieces)
+                 if start <= pos < end][0]
+                for pos in positions]
+
+    def _add(self, region, when, element):
+        """ Queue the XML of a piece for the route file of the region. """
+        self.pieces[region].append(
+            (when, len(self.pieces[region]),
+             xml.etree.ElementTree.tostring(element, encoding='unicode')))
+
+    def _route(self, element):
+        """ Edges and stops of the route of a vehicle or flow, None if it has no route. """
+        route = element.find('route')
+        if route is not None:
+            return route.get('edges', '').split(), list(route.iter('stop')), False
+        if element.get('route') is not None:
+            if element.get('route') not in self._routes:
+                return None
+            edges, stops = self._routes[element.get('route')]
+            return list(edges), list(stops), True
+        if element.get('from') is not None and element.get('to') is not None:
+            vtype = element.get('type')
+            path = self._path(element.get('from'), element.get('to'), vtype)
+            if path is None:
+                return None
+            via = [edge for edge in element.get('via', '').split() if edge]
+            if via:
+                path = None
+                for from_edge, to_edge in zip([element.get('from')] + via,
+                                              via + [element.get('to')]):
+                    leg = self._path(from_edge, to_edge, vtype)
+                    if leg is None:
+                        return None
+                    path = leg if path is None else path + leg[1:]
+            return path, [], False
+        return None
+
+    def _piece(self, element, edges, stops, assigned, piece, pieces, shared_route):
+        """ Element of a piece of the vehicle or flow. """
+        region, start, end, offset = pieces[piece]
+        copy = xml.etree.ElementTree.Element(element.tag, dict(element.attrib))
+        for attribute in ('route', 'from', 'to', 'via'):
+            copy.attrib.pop(attribute, None)
+        if len(pieces) > 1:
+            copy.set('id', PIECE_TPL.format(element.get('id'), piece))
+        if piece > 0:
+            for attribute in ('departPos', 'departSpeed', 'departLane'):
+                copy.attrib.pop(attribute, None)
+            copy.set('departLane', 'best')
+            copy.set('departSpeed', 'max')
+        if piece < len(pieces) - 1:
+            for attribute in ('arrivalPos', 'arrivalSpeed', 'arrivalLane'):
+                copy.attrib.pop(attribute, None)
+        route = xml.etree.ElementTree.SubElement(copy, 'route', {'edges': ' '.join(edges[start:end])})
+        for stop, stop_piece in zip(stops, assigned):
+            if stop_piece != piece:
+                continue
+            ## until is absolute, for flows it is the one of the first vehicle (SUMO shifts
+            ## it by the period for the others), and the first vehicle of each piece is the
+            ## first one of the flow
+            stop = xml.etree.ElementTree.Element('stop', dict(stop.attrib))
+            ## the stops of a vehicle are children of the vehicle, the ones of the
+            ## shared routes of the route
+            (route if shared_route else copy).append(stop)
+        for child in element:
+            if child.tag not in ('route', 'stop'):
+                copy.append(child)
+        return region, offset, copy
+
+    def _vehicle(self, element):
+        """ Pieces of a vehicle or trip, returns the edges of its route, None if it is not
+            decomposed. """
+        depart = _float(element.get('depart'))
+        route = self._route(element)
+        if depart is None or route is None:
+            self.counts['{} not decomposed'.format(element.tag)] += 1
+            return None
+        edges, stops, shared_route = route
+        stops = stops + list(element.findall('stop'))
+        positions = self._stop_positions(stops, edges)
+        pieces = self._split(edges, stops, positions, depart)
+        assigned = self._assign_stops(positions, pieces)
+        if element.tag == 'trip':
+            element.tag = 'vehicle'
+        for piece in range(len(pieces)):
+            region, offset, copy = self._piece(element, edges, stops, assigned, piece, pieces,
+                                               shared_route)
+            copy.set('depart', routestore.format_time(round(depart + offset, 2)))
+            self._add(region, depart + offset, copy)
+        if len(pieces) > 1:
+            self.cut[element.get('id')] = len(pieces)
+        self.counts['vehicles'] += 1
+        self.counts['vehicle pieces'] += len(pieces)
+        return edges
+
+    def _flow(self, element):
+        """ Pieces of a flow, returns the edges of its route, None if it is not
+            decomposed. """
+        begin = _float(element.get('begin'), 0.0)
+        route = self._route(element)
+        if route is None:
+            self.counts['flows not decomposed'] += 1
+            return None
+        edges, stops, shared_route = route
+        stops = stops + list(element.findall('stop'))
+        positions = self._stop_positions(stops, edges)
+        pieces = self._split(edges, stops, positions, begin)
+        assigned = self._assign_stops(positions, pieces)
+        for piece in range(len(pieces)):
+            region, offset, copy = self._piece(element, edges, stops, assigned, piece, pieces,
+                                               shared_route)
+            copy.set('begin', routestore.format_time(round(begin + offset, 2)))
+            if _float(element.get('end')) is not None:
+                copy.set('end', routestore.format_time(
+                    round(float(element.get('end')) + offset, 2)))
+            self._add(region, begin + offset, copy)
+        if len(pieces) > 1:
+            self.cut[element.get('id')] = len(pieces)
+        self.counts['flows'] += 1
+        self.counts['flow pieces'] += len(pieces)
+        return edges
+
+    @staticmethod
+    def _routed(tag, element, edges):
+        """ XML of a trip or flow with from and to, with the route of its pieces. """
+        copy = xml.etree.ElementTree.Element(
+            'vehicle' if tag == 'trip' else tag,
+            {key: value for key, value in element.attrib.items()
+             if key not in ('from', 'to', 'via')})
+        xml.etree.ElementTree.SubElement(copy, 'route', {'edges': ' '.join(edges)})
+        copy.extend(element)
+        return xml.etree.ElementTree.tostring(copy, encoding='unicode')
+
+    def cut_file(self, route_file, filtered_file):
+        """ Cut all the vehicles and flows of a route file, and copy the definitions and the
+            decomposed vehicles and flows in filtered_file (the demand of the monolithic
+            reference), unchanged, but for the ones with from and to, that get the route
+            of their pieces. """
+        with open(filtered_file, 'w', encoding='utf-8') as filtered:
+            filtered.write(routestore.HEADER)
+            for element in xml2pickle.iterparse_elements(route_file):
+                element.tail = None
+                text = xml.etree.ElementTree.tostring(element, encoding='unicode')
+                if element.tag in ('vType', 'vTypeDistribution'):
+                    self._define(element)
+                    for region in set(self._region.values()):
+                        self.definitions[region].append(text)
+                elif element.tag == 'route':
+                    self._routes[element.get('id')] = (element.get('edges', '').split(),
+                                                       [xml.etree.ElementTree.Element(
+                                                           'stop', dict(stop.attrib))
+                                                        for stop in element.iter('stop')])
+                elif element.tag in ('vehicle', 'trip', 'flow'):
+                    routed = (element.find('route') is None and element.get('route') is None
+                              and element.get('from') is not None)
+                    tag = element.tag
+                    edges = (self._flow if tag == 'flow' else self._vehicle)(element)
+                    if edges is None:
+                        continue
+                    if routed:
+                        text = self._routed(tag, element, edges)
+                else:
+                    self.counts['{} not decomposed'.format(element.tag)] += 1
+                    continue
+                filtered.write('\n    ')
+                filtered.write(text)
+            filtered.write(routestore.FOOTER)
+
+    def dropped(self):
+        """ Elements not decomposed, per tag, and their share of all the demand elements. """
+        dropped = {what[:-len(' not decomposed')]: count
+                   for what, count in self.counts.items() if what.endswith(' not decomposed')}
+        total = self.counts['vehicles'] + self.counts['flows'] + sum(dropped.values())
+        return dropped, round(sum(dropped.values()) / total, 4) if total else 0.0
+
+    def write(self, region, filename):
+        """ Route file of the region, with the pieces sorted by departure. """
+        with open(filename, 'w', encoding='utf-8') as outfile:
+            outfile.write(routestore.HEADER)
+            for text in self.definitions[region]:
+                outfile.write('\n    ')
+                outfile.write(text)
+            for _, _, text in sorted(self.pieces[region]):
+                outfile.write('\n    ')
+                outfile.write(text)
+            outfile.write(routestore.FOOTER)
+
+## ---------------------------------------------------------------------------------------- ##
+##                                     Additionals                                           ##
+## ---------------------------------------------------------------------------------------- ##
+
+def stopping_places(additional_files):
+    """ Edge of each stopping place (bus stops, parking areas, ..) of the additional files. """
+    places = {}
+    for filename in additional_files:
+        for element in xml2pickle.iterparse_elements(filename):
+            if element.tag in STOPPING_PLACES and element.get('lane') is not None:
+                places[element.get('id')] = _lane_edge(element.get('lane'))
+    return places
+
+def _keep(element, edges, places):
+    """ Filter the element (and its children) to the given edges, in place.
+        ret: False if the element has to be dropped. """
+    if element.get('lane') is not None and _lane_edge(element.get('lane')) not in edges:
+        return False
+    if element.get('edge') is not None and element.get('edge') not in edges:
+        return False
+    for attribute in ('edges', 'lanes'):
+        if element.get(attribute) is None:
+            continue
+        values = element.get(attribute).split()
+        kept = [value for value in values
+                if (value if attribute == 'edges' else _lane_edge(value)) in edges]
+        if not kept:
+            return False
+        if attribute == 'lanes' and element.tag in CONTINUOUS_LANES and kept != values:
+            ## a detector on consecutive lanes cannot lose any of them
+            return False
+        element.set(attribute, ' '.join(kept))
+    if element.tag == 'parkingAreaReroute' and places.get(element.get('id')) not in edges:
+        return False
+    if element.tag in REROUTE_EDGES and element.get('id') not in edges:
+        return False
+    if element.tag in REROUTE_LANES and _lane_edge(element.get('id', '')) not in edges:
+        return False
+    children = list(element)
+    for child in children:
+        if not _keep(child, edges, places):
+            element.remove(child)
+    if element.tag in CONTAINERS:
+        ## containers of other elements are useless (or invalid) without them
+        tags = set([child.tag for child in element])
+        if not all([tags.intersection(required.split('|'))
+                    for required in CONTAINERS[element.tag]]):
+            return False
+    return True
+
+def filter_additional(filename, output, edges, places):
+    """ Copy of the additional file with only the elements on the given edges.
+        ret: number of elements written. """
+    written = 0
+    with open(output, 'w', encoding='utf-8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<additional>')
+        for element in xml2pickle.iterparse_elements(filename):
+            element.tail = None
+            if not _keep(element, edges, places):
+                continue
+            outfile.write('\n    ')
+            outfile.write(xml.etree.ElementTree.tostring(element, encoding='unicode'))
+            written += 1
+        outfile.write('\n</additional>\n')
+    return written
+
+## ---------------------------------------------------------------------------------------- ##
+##                                   Merge and compare                                       ##
+## ---------------------------------------------------------------------------------------- ##
+
+def _original(vehicle_id, cut):
+    """ Original vehicle and piece of a vehicle id, (vehicle_id, None) if it is not a piece. """
+    match = FLOW_PIECE_RE.match(vehicle_id)
+    if match and match.group(1) in cut:
+        return '{}.{}'.format(match.group(1), match.group(3)), int(match.group(2)), \
+               cut[match.group(1)]
+    match = VEHICLE_PIECE_RE.match(vehicle_id)
+    if match and match.group(1) in cut:
+        return match.group(1), int(match.group(2)), cut[match.group(1)]
+    return vehicle_id, None, 1
+
+def merge_tripinfos(tripinfo_files, cut, output):
+    """ Trips of the original vehicles from the tripinfo of their pieces.
+        ret: number of trips written, and of the ones with missing pieces. """
+    trips = collections.OrderedDict()
+    written = 0
+    with open(output, 'w', encoding='utf-8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<tripinfos>')
+        for filename in tripinfo_files:
+            if not os.path.isfile(filename):
+                logging.warning('%s not found.', filename)
+                continue
+            for element in xml2pickle.iterparse_elements(filename):
+                if element.tag != 'tripinfo':
+                    continue
+                vehicle_id, piece, pieces = _original(element.get('id'), cut)
+                if piece is None:
+                    element.tail = None
+                    outfile.write('\n    ')
+                    outfile.write(xml.etree.ElementTree.tostring(element, encoding='unicode'))
+                    written += 1
+                    continue
+                trips.setdefault(vehicle_id, [None] * pieces)[piece] = dict(element.attrib)
+        incomplete = 0
+        for vehicle_id, pieces in trips.items():
+            found = [piece for piece in pieces if piece is not None]
+            complete = len(found) == len(pieces) and float(pieces[-1]['arrival']) >= 0
+            incomplete += not complete
+            first = pieces[0] or found[0]
+            depart = float(first['depart'])
+            arrival = float(pieces[-1]['arrival']) if complete else -1.0
+            attributes = collections.OrderedDict([
+                ('id', vehicle_id),
+                ('depart', first['depart']),
+                ('departDelay', first.get('departDelay', '0')),
+                ('arrival', routestore.format_time(arrival)),
+                ('duration', routestore.format_time(round(arrival - depart, 3))
+                 if complete else '-1'),
+            ])
+            for attribute in ('routeLength', 'waitingTime', 'waitingCount', 'stopTime',
+                              'timeLoss', 'rerouteNo'):
+                attributes[attribute] = routestore.format_time(
+                    round(sum([float(piece.get(attribute, 0)) for piece in found]), 3))
+            ## the insertion delay at the boundaries is a time loss of the trip
+            attributes['timeLoss'] = routestore.format_time(round(
+                float(attributes['timeLoss']) +
+                sum([float(piece.get('departDelay', 0)) for piece in pieces[1:]
+                     if piece is not None]), 3))
+            attributes['vType'] = first.get('vType', '')
+            attributes['pieces'] = str(len(pieces))
+            outfile.write('\n    <tripinfo {}/>'.format(' '.join(
+                ['{}="{}"'.format(key, value) for key, value in attributes.items()])))
+            written += 1
+        outfile.write('\n</tripinfos>\n')
+    return written, incomplete
+
+def _vehroutes(filename):
+    """ Yield id, depart, edges and exit times of the vehicles of a vehroute output. """
+    if not os.path.isfile(filename):
+        logging.warning('%s not found.', filename)
+        return
+    for element in xml2pickle.iterparse_elements(filename):
+        if element.tag != 'vehicle':
+            continue
+        routes = list(element.iter('route'))
+        if not routes:
+            continue
+        ## the last route is the one driven, the others were replaced by rerouting
+        route = routes[-1]
+        exits = [_float(value, -1.0) for value in route.get('exitTimes', '').split()]
+        yield element.get('id'), _float(element.get('depart'), -1.0), \
+              route.get('edges', '').split(), exits
+
+def monolithic_crossings(vehroute_file, region):
+    """ Boundary crossings of the monolithic run, {(vehicle, from, to): time}. """
+    crossings = {}
+    for vehicle_id, _, edges, exits in _vehroutes(vehroute_file):
+        for pos, (from_edge, to_edge) in enumerate(zip(edges, edges[1:])):
+            if (region.get(from_edge, from_edge) != region.get(to_edge, to_edge)
+                    and pos < len(exits) and exits[pos] >= 0):
+                crossings.setdefault((vehicle_id, from_edge, to_edge), exits[pos])
+    return crossings
+
+def decomposed_crossings(vehroute_files, cut):
+    """ Boundary crossings of the decomposed run, {(vehicle, from, to): (outflow, inflow)}
+        as time of arrival from the upstream region and of insertion downstream. """
+    pieces = collections.defaultdict(dict)
+    for filename in vehroute_files:
+        for vehicle_id, depart, edges, exits in _vehroutes(filename):
+            original, piece, _ = _original(vehicle_id, cut)
+            if piece is None or not edges:
+                continue
+            arrival = exits[-1] if exits and len(exits) == len(edges) else -1.0
+            pieces[original][piece] = (edges[0], edges[-1], depart, arrival)
+    crossings = {}
+    for vehicle_id, parts in pieces.items():
+        for piece in sorted(parts):
+            if piece + 1 not in parts:
+                continue
+            _, last_edge, _, outflow = parts[piece]
+            first_edge, _, inflow, _ = parts[piece + 1]
+            crossings[(vehicle_id, last_edge, first_edge)] = (outflow, inflow)
+    return crossings
+
+def _geh(model, reference, hours):
+    """ GEH statistic of the hourly flows. """
+    model, reference = model / hours, reference / hours
+    if model + reference == 0:
+        return 0.0
+    return math.sqrt(2 * (model - reference) ** 2 / (model + reference))
+
+def compare_boundary_flows(monolithic, decomposed, region, interval, output):
+    """ Boundary flows per connection and interval of the two runs, saved to a CSV file.
+        ret: summary of the errors. """
+    counts = collections.defaultdict(lambda: [0, 0, 0])
+    for (_, from_edge, to_edge), crossing in monolithic.items():
+        counts[(from_edge, to_edge, int(crossing // interval))][0] += 1
+    for (_, from_edge, to_edge), (outflow, inflow) in decomposed.items():
+        if outflow >= 0:
+            counts[(from_edge, to_edge, int(outflow // interval))][1] += 1
+        if inflow >= 0:
+            counts[(from_edge, to_edge, int(inflow // interval))][2] += 1
+
+    rows = []
+    for (from_edge, to_edge, slot), (mono, out, inflow) in sorted(counts.items()):
+        rows.append(collections.OrderedDict([
+            ('from_edge', from_edge), ('to_edge', to_edge),
+            ('from_region', region.get(from_edge, '')), ('to_region', region.get(to_edge, '')),
+            ('begin', slot * interval), ('end', (slot + 1) * interval),
+            ('monolithic', mono), ('outflow', out), ('inflow', inflow)]))
+    with open(output, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=BOUNDARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    summary = {
+        'monolithic_crossings': len(monolithic),
+        'decomposed_crossings': len(decomposed),
+        'interval_s': interval,
+    }
+    for measure, column in (('outflow', 'outflow'), ('inflow', 'inflow')):
+        if not rows:
+            break
+        errors = [row[column] - row['monolithic'] for row in rows]
+        gehs = [_geh(row[column], row['monolithic'], interval / 3600) for row in rows]
+        summary[measure] = {
+            'rmse': round(math.sqrt(sum([error ** 2 for error in errors]) / len(errors)), 6),
+            'mean_abs_error': round(sum([abs(error) for error in errors]) / len(errors), 6),
+            'relative_error': round(sum([abs(error) for error in errors]) /
+                                    max(sum([row['monolithic'] for row in rows]), 1), 6),
+            'geh_below_5': round(sum([geh < 5 for geh in gehs]) / len(gehs), 6),
+        }
+        ## timing of the crossings of the same vehicle on the same connection
+        position = 0 if measure == 'outflow' else 1
+        delays = [times[position] - monolithic[key] for key, times in decomposed.items()
+                  if key in monolithic and times[position] >= 0]
+        summary[measure]['matched_crossings'] = len(delays)
+        if delays:
+            summary[measure]['mean_abs_time_error_s'] = round(
+                sum([abs(delay) for delay in delays]) / len(delays), 3)
+            summary[measure]['mean_time_error_s'] = round(sum(delays) / len(delays), 3)
+    return summary
+
+## ---------------------------------------------------------------------------------------- ##
+##                                         Main                                              ##
+## ---------------------------------------------------------------------------------------- ##
+
+def _input_files(sumocfg, option):
+    """ Files of an input option of the configuration, relative to the working directory. """
+    folder = os.path.dirname(os.path.abspath(sumocfg))
+    element = xml.etree.ElementTree.parse(sumocfg).getroot().find('input/{}'.format(option))
+    if element is None or not element.get('value'):
+        return []
+    return [os.path.join(folder, path) for path in element.get('value').split(',')]
+
+def _cut_nets(netconvert, net, folders, processes):
+    """ netconvert of the network of each region, in parallel. """
+    def _netconvert(folder):
+        """ Keep the edges of the region. """
+        subprocess.run([netconvert, '-s', net,
+                        '--keep-edges.input-file', os.path.join(folder, 'edges.txt'),
+                        '-o', os.path.join(folder, 'net.xml')],
+                       check=True, stdout=subprocess.DEVNULL)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=processes) as pool:
+        list(pool.map(_netconvert, folders))
+
+def _main():
+    """ Decompose the simulation in regions, run them in parallel and compare the flows. """
+    args = _args()
+    instrumentation.start('spatial.decomposition', args.profile)
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.abspath(args.output)
+
+    net_file = args.net or _input_files(args.sumocfg, 'net-file')[0]
+    with instrumentation.phase('load net') as phase:
+        net = sumolib.net.readNet(net_file)
+        phase.count = len(net.getEdges())
+
+    with instrumentation.phase('partition') as phase:
+        partition = Partition(net, read_taz(args.taz))
+        if args.regions:
+            partition.merge(args.regions)
+        regions = partition.regions()
+        phase.count = len(partition.region)
+    summary = {'partition': partition.to_dict()}
+    with open(os.path.join(output, 'partition.json'), 'w') as outfile:
+        json.dump(summary['partition'], outfile, indent=4)
+    logging.info('%d regions, %d boundary connections.', len(regions),
+                 summary['partition']['boundary_connections'])
+
+    folders = collections.OrderedDict()
+    for name, edges in regions.items():
+        folders[name] = os.path.join(output, name)
+        os.makedirs(folders[name], exist_ok=True)
+        with open(os.path.join(folders[name], 'edges.txt'), 'w') as outfile:
+            outfile.write('\n'.join(sorted(edges)) + '\n')
+    processes = args.processes or BATCH.pool_size(args.memory, len(regions))
+    if not args.full_net:
+        with instrumentation.phase('networks', len(regions)):
+            _cut_nets(args.netconvert, os.path.abspath(net_file), folders.values(), processes)
+
+    additional_files = []
+    for filename in _input_files(args.sumocfg, 'additional-files'):
+        if os.path.isfile(filename):
+            additional_files.append(filename)
+        else:
+            logging.warning('%s not found, it is not used by the regions.', filename)
+    places = stopping_places(additional_files)
+
+    ## the monolithic reference runs only the demand that is decomposed
+    reference = BATCH.Run('monolithic', args.sumocfg, args.seed, None, None)
+    reference_folder = os.path.join(output, reference.name)
+    os.makedirs(reference_folder, exist_ok=True)
+    with instrumentation.phase('routes') as phase:
+        cutter = RouteCutter(net, partition, places)
+        route_files = []
+        for filename in _input_files(args.sumocfg, 'route-files'):
+            if not os.path.isfile(filename):
+                logging.warning('%s not found, it is not decomposed.', filename)
+                continue
+            logging.info('Cutting %s', filename)
+            ## one filtered file per input, each one keeps the departure order of its own
+            route_files.append(os.path.join(
+                reference_folder, '{}.{}'.format(len(route_files), os.path.basename(filename))))
+            cutter.cut_file(filename, route_files[-1])
+        for name, folder in folders.items():
+            cutter.write(name, os.path.join(folder, 'routes.rou.xml'))
+        phase.count = cutter.counts['vehicles'] + cutter.counts['flows']
+    for what, count in sorted(cutter.counts.items()):
+        logging.info('    %s: %d', what, count)
+    summary['routes'] = dict(cutter.counts)
+    summary['routes']['cut'] = len(cutter.cut)
+    summary['routes']['dropped'], summary['routes']['dropped_share'] = cutter.dropped()
+    if summary['routes']['dropped_share']:
+        logging.warning('%.2f%% of the demand is not decomposed, nor in the monolithic run.',
+                        100 * summary['routes']['dropped_share'])
+
+    with instrumentation.phase('additionals', len(regions) * len(additional_files)):
+        for name, folder in folders.items():
+            for filename in additional_files:
+                filter_additional(filename, os.path.join(folder, os.path.basename(filename)),
+                                  regions[name], places)
+
+    runs = []
+    for name, folder in folders.items():
+        run = BATCH.Run(name, args.sumocfg, args.seed, None, None)
+        options = collections.OrderedDict(RUN_OPTIONS)
+        options[('input', 'net-file')] = (os.path.relpath(os.path.abspath(net_file), folder)
+                                          if args.full_net else 'net.xml')
+        options[('input', 'route-files')] = 'routes.rou.xml'
+        options[('input', 'additional-files')] = ','.join(
+            [os.path.basename(filename) for filename in additional_files]) or None
+        BATCH.write_run_config(run, folder, options)
+        runs.append(run)
+    ## the monolithic run has the same inputs of the regions
+    options = collections.OrderedDict(RUN_OPTIONS)
+    for option, filenames in (('net-file', [net_file]), ('route-files', route_files),
+                              ('additional-files', additional_files)):
+        ## omitted without files, instead of an empty value
+        options[('input', option)] = ','.join(
+            [os.path.relpath(os.path.abspath(filename), reference_folder)
+             for filename in filenames]) or None
+    BATCH.write_run_config(reference, reference_folder, options)
+    if not args.run:
+        instrumentation.write_report(args.report or os.path.join(output, 'report.json'))
+        logging.info('Regions ready in %s', output)
+        return
+
+    with instrumentation.phase('run regions', len(runs)):
+        start = time.perf_counter()
+        results = BATCH.run_batch(runs, output, args.sumo, processes, args.timeout)
+        summary['decomposed_wall_s'] = round(time.perf_counter() - start, 3)
+    if args.reference:
+        ## alone, to measure its time without the regions competing for the cores
+        with instrumentation.phase('run monolithic', 1):
+            results.extend(BATCH.run_batch([reference], output, args.sumo, 1, args.timeout))
+        summary['monolithic_wall_s'] = results[-1]['wall_s']
+        summary['speedup'] = round(summary['monolithic_wall_s'] /
+                                   max(summary['decomposed_wall_s'], 1e-9), 3)
+    BATCH.write_results(results, os.path.join(output, 'results.csv'))
+    summary['processes'] = processes
+    summary['failed'] = [result['run'] for result in results if result['status'] != 'ok']
+
+    with instrumentation.phase('merge') as phase:
+        phase.count, summary['incomplete_trips'] = merge_tripinfos(
+            [os.path.join(folder, 'most.tripinfo.xml') for folder in folders.values()],
+            cutter.cut, os.path.join(output, 'merged.tripinfo.xml'))
+
+    if args.reference:
+        with instrumentation.phase('boundary flows') as phase:
+            monolithic = monolithic_crossings(
+                os.path.join(reference_folder, 'most.vehroute.xml'), partition.region)
+            decomposed = decomposed_crossings(
+                [os.path.join(folder, 'most.vehroute.xml') for folder in folders.values()],
+                cutter.cut)
+            summary['boundary_flows'] = compare_boundary_flows(
+                monolithic, decomposed, partition.region, args.interval,
+                os.path.join(output, 'boundary.flows.csv'))
+            phase.count = len(monolithic) + len(decomposed)
+
+    with open(os.path.join(output, 'decomposition.json'), 'w') as outfile:
+        json.dump(summary, outfile, indent=4)
+    instrumentation.write_report(args.report or os.path.join(output, 'report.json'))
+    if summary['failed']:
+        sys.exit('Failed runs: {}'.format(' '.join(summary['failed'])))
+    logging.info('Done.')
+
+if __name__ == "__main__":
+    _logs()
+    _main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+""" Import of the MoST tools with a dotted file name (e.g. batch.runner.py) as modules.
+
+    Monaco SUMO Traffic (MoST) Scenario
+    Author: Lara CODECA
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import importlib.util
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_tool(filename):
+    """ Load a tool script (e.g. 'pt.osm2sumo.py') from the tools folder as a module. """
+    if TOOLS_DIR not in sys.path:
+        sys.path.append(TOOLS_DIR)
+    path = os.path.join(TOOLS_DIR, filename)
+    name = os.path.splitext(os.path.basename(filename))[0].replace('.', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    ## registered, so that the tools can send their functions to a process pool
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -17,6 +17,12 @@
 
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    With --streaming the file is parsed incrementally with iterparse, keeping in memory only
+    one top-level element at a time. With --store an OSM-like file is saved as a columnar
+    OSM store (see osmstore.py) instead of a pickle. The JSON report (see
+    instrumentation.py) is written only with --report: the output folder of the pickles is
+    read by the merger.
 """
 
 import argparse
@@ -25,6 +31,9 @@ import pickle
 import sys
 import xml.etree.ElementTree
 
+import instrumentation
+import osmstore
+
 def _logs():
     """ Log init. """
     file_handler = logging.FileHandler(filename='xml2pickle.log', mode='w')
@@ -46,31 +55,80 @@ def _args():
         help='XML file.')
     parser.add_argument(
         '-o', type=str, dest='output', required=True,
-        help='Pickle file.')
+        help='Pickle file (or OSM store folder, with --store).')
+    parser.add_argument(
+        '--streaming', dest='streaming', action='store_true',
+        help='Parse the XML file incrementally with iterparse instead of loading the whole tree.')
+    parser.add_argument(
+        '--store', dest='store', action='store_true',
+        help='Save an OSM-like file into a columnar OSM store (see osmstore.py) instead of a pickle.')
+    instrumentation.add_arguments(parser, default_report=False)
 
     return parser.parse_args()
 
+def _element_to_dict(element):
+    """ Convert a top-level element and its children into a dict. """
+    parsed = {}
+    for key, value in element.attrib.items():
+        parsed[key] = value
+
+    for attribute in element:
+        if attribute.tag in parsed:
+            parsed[attribute.tag].append(attribute.attrib)
+        else:
+            parsed[attribute.tag] = [attribute.attrib]
+    return parsed
+
 def _parse_xml_file(xml_file):
     """ Extract nodes and ways from XML file. """
     xml_tree = xml.etree.ElementTree.parse(xml_file).getroot()
     dict_xml = {}
     for child in xml_tree:
-        parsed = {}
-        for key, value in child.attrib.items():
-            parsed[key] = value
-
-        for attribute in child:
-            if attribute.tag in list(parsed.keys()):
-                parsed[attribute.tag].append(attribute.attrib)
-            else:
-                parsed[attribute.tag] = [attribute.attrib]
+        parsed = _element_to_dict(child)
 
-        if child.tag in list(dict_xml.keys()):
+        if child.tag in dict_xml:
             dict_xml[child.tag].append(parsed)
         else:
             dict_xml[child.tag] = [parsed]
     return dict_xml
 
+def iterparse_elements(xml_file):
+    """ Yield the top-level elements of the XML file, one at a time.
+
+        Each element is complete (with all its children) when yielded and it is cleared
+        when the next one is requested, the memory used by the parser is bounded by the
+        largest single element.
+    """
+    root = None
+    depth = 0
+    for event, element in xml.etree.ElementTree.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        yield element
+
+        element.clear()
+        root.clear()
+
+def _iterparse_xml_file(xml_file):
+    """ Extract nodes and ways from XML file, one top-level element at a time. """
+    dict_xml = {}
+    for element in iterparse_elements(xml_file):
+        ## the attributes of the children are referenced by parsed, clearing drops only the tree
+        parsed = _element_to_dict(element)
+        if element.tag in dict_xml:
+            dict_xml[element.tag].append(parsed)
+        else:
+            dict_xml[element.tag] = [parsed]
+    return dict_xml
+
 def _dump_to_pickle(obj, filename):
     """ Dump the object into a binary pickle file. """
     with open(filename, 'wb') as dump:
@@ -80,10 +138,25 @@ def _main():
     """ Load a XML file into a dict and save it to a binary pickle file. """
 
     args = _args()
+    instrumentation.start('xml2pickle', args.profile)
     logging.info('Loading from %s', args.input)
-    xml_data = _parse_xml_file(args.input)
+    with instrumentation.phase('parse') as phase:
+        if args.streaming:
+            xml_data = _iterparse_xml_file(args.input)
+        else:
+            xml_data = _parse_xml_file(args.input)
+        phase.count = sum([len(elements) for elements in xml_data.values()])
     logging.info('Dumping to %s', args.output)
-    _dump_to_pickle(xml_data, args.output)
+    with instrumentation.phase('write', phase.count):
+        if args.store:
+            osmstore.write_store(xml_data, args.output)
+        else:
+            _dump_to_pickle(xml_data, args.output)
+    ## the output folder of the pickles is read by the merger, the report is opt-in
+    if args.report:
+        instrumentation.write_report(args.report)
+    elif args.profile:
+        logging.warning('The profile is saved next to the report, use --report.')
     logging.info('Done.')
 
 if __name__ == "__main__":